@@ -28,6 +28,14 @@ the top-level directory of this distribution.
 
 """
 
-from pbr.version import VersionInfo
 __all__ = ('__version__',)
-__version__ = VersionInfo('hep-score').release_string()
+
+
+def __getattr__(name):
+    # reading the package metadata is slow on shared filesystems: only do it
+    # when the version is used (PEP 562)
+    if name == '__version__':
+        from pbr.version import VersionInfo
+        globals()['__version__'] = VersionInfo('hep-score').release_string()
+        return globals()['__version__']
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
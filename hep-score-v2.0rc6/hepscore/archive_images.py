@@ -1,21 +1,36 @@
 """
 Script Description:
-This script downloads SIF images specified in a YAML configuration file, 
-archives them in a tar archive (no compression given that are SIF images), 
-and prepares the scp and ssh commands to be executed in the CI for the upload
-into the web archive.
+This script downloads the SIF images specified in a YAML configuration file
+into a content-addressed store, and prepares the scp and ssh commands to be
+executed in the CI for the upload into the web archive.
 
-Only image sets not already downloaded will be downloaded. 
-A check of the sets already uploaded on the web archive is performed.
+Images are stored individually, named by the SHA256 of their content, and
+each image set is described by a small manifest referencing them:
 
-Hash representations of these sets are used for unique identification.
+    <workdir>/blobs/<digest>.sif          image files
+    <workdir>/refs/<ref>.json             image URL -> digest and size, <ref>
+                                          is the SHA256 of the image URL
+    <workdir>/manifests/<arch>_<hash>.json  image set: image URL -> digest
+
+The web archive has the same layout.  Only the images whose reference is not
+already in the local store or in the web archive are pulled and uploaded, so
+bumping the version of a single workload ships a single image, and identical
+images are shared across image sets and architectures.
+
+Images are pulled concurrently.  With --tar, the whole set is also archived
+in a tar archive (no compression given that are SIF images) as before; each
+image is appended to the archive as soon as its pull completes, the SHA256
+of the archive is computed while it is written, so the archive is never
+read back, and an index of its members is written next to it.
 
 Usage:
-python script_name.py -i <input_config> [-w <workdir>] [-a <architecture>] [-r <remote_archive_content>]
+python script_name.py -i <input_config> [-w <workdir>] [-a <architecture>] [-r <remote_archive_content>] [-j <jobs>] [--tar] [--link <dir>]
 """
 
 import argparse
+import concurrent.futures
 import subprocess
+import tarfile
 import yaml
 import json
 import os
@@ -92,44 +107,51 @@ def list_of_images(data, architecture=None):
 
     return local_images_list, images_list_hash
 
-def download_images(images_list, directory, output_archive_file):
+class HashingWriter:
     """
-    Download images from the provided list and archive them.
+    Write-only file object computing the SHA256 of the bytes written through it.
 
     Args:
-        images_list (list): List of image URLs.
-        directory (str): Directory to store downloaded images.
-        output_archive_file (str): Path to the output archive file.
+        fileobj (file): Binary file to write to.
     """
 
-    for image in images_list:
-        # Download the image
-        print(f"singularity pull --dir {directory} {image}")
-        # Run the singularity command 
-        sys.stdout.flush()  # Flush stdout to ensure immediate printing
-        subprocess.run(["singularity", "pull", "--dir", directory, image], check=True)
-        sys.stdout.flush()  # Flush stdout to ensure immediate printing
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+        self.offset = 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.offset += len(data)
+        return self.fileobj.write(data)
+
+    def tell(self):
+        return self.offset
+
+    def hexdigest(self):
+        return self.sha256.hexdigest()
 
-        # Print a message after the subprocess is completed
-        print(f"Downloaded {image} successfully.")
 
-        # Rename the downloaded image
-        original_name=image.split('/')[-1].replace(":","_")+".sif"
-        new_name=image.split('/')[-1]
-        print(f"rename image from {directory}/{original_name} to {directory}/{new_name}")
-        sys.stdout.flush()  # Flush stdout to ensure immediate printing
-        subprocess.run(["mv", f"{directory}/{original_name}", f"{directory}/{new_name}"], check=True)
+def pull_image(image, directory):
+    """
+    Pull an image to a SIF file named after the image.
 
-        # Add the image to the archive
-        print(f"archive image {new_name} in {output_archive_file}")
-        sys.stdout.flush()  # Flush stdout to ensure immediate printing
-        subprocess.run(["tar", "-uvf", output_archive_file, "-C", directory, new_name], check=True)
+    Args:
+        image (str): Image URL.
+        directory (str): Directory to store the image.
 
-        # Remove the downloaded image to save space
-        print(f"free space removing downloaded image {directory}/{new_name}")
-        sys.stdout.flush()  # Flush stdout to ensure immediate printing
-        os.remove(f"{directory}/{new_name}")
-        print(f"Removed {image} successfully.")
+    Returns:
+        str: Path of the SIF file.
+    """
+
+    name = image.split('/')[-1]
+    target = os.path.join(directory, name)
+    print(f"singularity pull {target} {image}")
+    sys.stdout.flush()  # Flush stdout to ensure immediate printing
+    subprocess.run(["singularity", "pull", target, image], check=True)
+    print(f"Downloaded {image} successfully.")
+    sys.stdout.flush()
+    return target
 
 
 def download_and_validate_remote_images(remote_archive_url, local_hash):
@@ -145,20 +167,230 @@ def download_and_validate_remote_images(remote_archive_url, local_hash):
     """
 
     remote_archive_url = remote_archive_url.rstrip('/')  # Remove trailing slashes if any
-    remote_archive_url = f"{remote_archive_url}/{local_hash}/{local_hash}.json"
+    return remote_json(f"{remote_archive_url}/{local_hash}/{local_hash}.json")
+
+def remote_json(url):
+    """
+    Download a JSON document from the web archive.
+
+    Args:
+        url (str): URL of the document.
+
+    Returns:
+        dict: Content of the document, empty if it is not available.
+    """
 
     try:
-        with urllib.request.urlopen(remote_archive_url) as response:
+        with urllib.request.urlopen(url) as response:
             data = response.read().decode('utf-8')
             if response.status == 200:
                 return json.loads(data)
             else:
-                print(f"Warning: \n\tFailed to download remote archive from {remote_archive_url}.\n\tAssuming this archive is not available remotely.\n\tContinuing the archive process.")
+                print(f"Warning: \n\tFailed to download {url}.\n\tAssuming it is not available remotely.")
                 return {}  # Return an empty dictionary
-    except urllib.error.URLError as e:
-        print(f"Warning: \n\tFailed to download remote archive from {remote_archive_url}.\n\tError {e}.\n\tAssuming this archive is not available remotely.\n\tContinuing the archive process.")
+    except (urllib.error.URLError, ValueError) as e:
+        print(f"Warning: \n\tFailed to download {url}.\n\tError {e}.\n\tAssuming it is not available remotely.")
         return {}  # Return an empty dictionary
-    
+
+def read_json(path):
+    """
+    Read a JSON file.
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        dict: Content of the file, empty if it does not exist or is invalid.
+    """
+
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_json(path, data):
+    """
+    Write a JSON file atomically.
+
+    Args:
+        path (str): Path to the file.
+        data (dict): Content of the file.
+    """
+
+    with open(path + ".tmp", 'w') as f:
+        json.dump(data, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+def image_ref(image):
+    """
+    Name of the reference file of an image.
+
+    Args:
+        image (str): Image URL.
+
+    Returns:
+        str: SHA256 hash of the image URL.
+    """
+
+    return hashlib.sha256(image.encode()).hexdigest()
+
+def store_blob(path, blob_folder):
+    """
+    Move an image file into the content-addressed store.
+
+    Args:
+        path (str): Path of the image file.
+        blob_folder (str): Directory of the stored images.
+
+    Returns:
+        tuple: SHA256 hash and size of the image.
+    """
+
+    digest = generate_sha256sum(path)
+    size = os.path.getsize(path)
+    target = os.path.join(blob_folder, f"{digest}.sif")
+    if os.path.exists(target):
+        # Same content under another image URL
+        os.remove(path)
+    else:
+        os.replace(path, target)
+    return digest, size
+
+def pull_and_store(image, directory, blob_folder):
+    """
+    Pull an image and move it into the content-addressed store.
+
+    Args:
+        image (str): Image URL.
+        directory (str): Directory to pull the image to.
+        blob_folder (str): Directory of the stored images.
+
+    Returns:
+        dict: Reference of the image, with its URL, digest and size.
+    """
+
+    digest, size = store_blob(pull_image(image, directory), blob_folder)
+    print(f"Stored {image} as {digest}.sif ({size} bytes)")
+    sys.stdout.flush()
+    return {"image": image, "digest": digest, "size": size}
+
+def pull_images(images_list, directory, blob_folder, jobs=4):
+    """
+    Pull images into the content-addressed store concurrently.
+
+    Args:
+        images_list (list): List of image URLs.
+        directory (str): Directory to pull the images to.
+        blob_folder (str): Directory of the stored images.
+        jobs (int, optional): Number of concurrent pulls. Defaults to 4.
+
+    Yields:
+        dict: Reference of each image, as its pull completes.
+    """
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+        pulls = [pool.submit(pull_and_store, image, directory, blob_folder)
+                 for image in images_list]
+        try:
+            for pull in concurrent.futures.as_completed(pulls):
+                yield pull.result()
+        except BaseException:
+            for pull in pulls:
+                pull.cancel()
+            raise
+
+def fetch_blob(remote_archive_url, digest, target):
+    """
+    Download a stored image from the web archive, checking its digest.
+
+    Args:
+        remote_archive_url (str): URL of the web archive.
+        digest (str): SHA256 hash of the image.
+        target (str): Path to write the image to.
+    """
+
+    url = f"{remote_archive_url}/blobs/{digest}.sif"
+    print(f"Downloading {url}")
+    sys.stdout.flush()
+    hash_sha256 = hashlib.sha256()
+    with urllib.request.urlopen(url) as response, open(target, "wb") as f:
+        for chunk in iter(lambda: response.read(1 << 20), b""):
+            hash_sha256.update(chunk)
+            f.write(chunk)
+    if hash_sha256.hexdigest() != digest:
+        os.remove(target)
+        raise ValueError(f"Digest mismatch for {url}")
+
+class ImageArchive:
+    """
+    Tar archive of image files, written as the images are added.
+
+    The SHA256 of the archive is computed while it is written.  On close, an
+    index giving the offset and size of the data of each member is written to
+    <archive>.index.json, so that hepscore can use the images of the archive
+    without extracting it (tar:// registry, see hepscore.sifarchive).
+
+    Args:
+        output_archive_file (str): Path to the output archive file.
+    """
+
+    def __init__(self, output_archive_file):
+        self.path = output_archive_file
+        self.index = {}
+        self.archive_file = open(output_archive_file, "wb")
+        self.writer = HashingWriter(self.archive_file)
+        self.tar = tarfile.open(fileobj=self.writer, mode="w", format=tarfile.GNU_FORMAT)
+
+    def add(self, name, path):
+        """
+        Append an image file to the archive.
+
+        Args:
+            name (str): Name of the image in the archive.
+            path (str): Path of the image file.
+        """
+
+        print(f"archive image {name} in {self.path}")
+        sys.stdout.flush()
+        tarinfo = self.tar.gettarinfo(path, arcname=name)
+        header = tarinfo.tobuf(self.tar.format, self.tar.encoding, self.tar.errors)
+        self.index[name] = [self.tar.offset + len(header), tarinfo.size]
+        with open(path, "rb") as f:
+            self.tar.addfile(tarinfo, f)
+
+    def close(self):
+        """
+        Complete the archive and write its index.
+
+        Returns:
+            str: SHA256 hash of the archive.
+        """
+
+        self.tar.close()
+        self.archive_file.close()
+        write_json(self.path + ".index.json",
+                   {"size": os.path.getsize(self.path), "members": self.index})
+        return self.writer.hexdigest()
+
+def link_images(manifest, blob_folder, directory):
+    """
+    Link the images of a set into a directory usable as a dir:// registry.
+
+    Args:
+        manifest (dict): Manifest of the image set.
+        blob_folder (str): Directory of the stored images.
+        directory (str): Directory to create the links in.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    for image, entry in manifest["images"].items():
+        link = os.path.join(directory, image.split('/')[-1])
+        if os.path.lexists(link):
+            os.remove(link)
+        os.symlink(os.path.abspath(os.path.join(blob_folder, f"{entry['digest']}.sif")), link)
+    print(f"Images of {manifest['name']} linked in {directory}")
+
 def create_output_directory(directory):
     """
     Create an output directory if it doesn't exist.
@@ -191,66 +423,129 @@ def generate_sha256sum(file_path):
             hash_sha256.update(chunk)
     return hash_sha256.hexdigest()
 
-if __name__ == "__main__":
+def main(argv=None):
     parser = argparse.ArgumentParser(description="Download images")
     parser.add_argument("-i", "--input_config", required=True, help="Path to input YAML configuration file")
     parser.add_argument("-w", "--workdir", default="hep-workloads-sif", help="Working directory to store intermediate files")
     parser.add_argument("-a", "--architecture", help="Architecture type (e.g., x86_64, aarch64)")
-    parser.add_argument("-r", "--remote_archive_content", default=None, help="URL to remote archive content (JSON)")
-    args = parser.parse_args()
-
+    parser.add_argument("-r", "--remote_archive_content", default=None, help="URL to remote archive content")
+    parser.add_argument("-j", "--jobs", type=int, default=4, help="Number of images pulled concurrently")
+    parser.add_argument("--tar", action="store_true", help="Also archive the whole image set in a tar archive")
+    parser.add_argument("--link", default=None, help="Directory to link the images of the set in, for a dir:// registry")
+    args = parser.parse_args(argv)
 
     data = parse_yaml_file(args.input_config)
     local_images_list, local_images_hash = list_of_images(data, args.architecture)
-    
-    key_name=f"{args.architecture}_{local_images_hash}"
-    archive_folder=os.path.join(args.workdir,key_name)
-    create_output_directory(archive_folder)
-
-    sif_image_folder=os.path.join(archive_folder,"sif_images")
-    create_output_directory(sif_image_folder)
-
+    remote = args.remote_archive_content.rstrip('/') if args.remote_archive_content else None
 
-    output_archive_file=os.path.join(archive_folder,f"{key_name}.tar")
-    output_archive_images=os.path.join(archive_folder,f"{key_name}.json")
-    output_archive_sha256sum=os.path.join(archive_folder, f"{key_name}_sha256sum.txt")
-
-    print("Output Archive File:", output_archive_file)
-    print("Output Archive Images:", output_archive_images)
-    print("Output Archive SHA256sum:", output_archive_sha256sum)
+    key_name=f"{args.architecture}_{local_images_hash}"
+    blob_folder=os.path.join(args.workdir,"blobs")
+    ref_folder=os.path.join(args.workdir,"refs")
+    manifest_folder=os.path.join(args.workdir,"manifests")
+    pull_folder=os.path.join(args.workdir,"tmp")
+    for folder in (blob_folder, ref_folder, manifest_folder, pull_folder):
+        os.makedirs(folder, exist_ok=True)
+
+    # Only the new images are uploaded: they are staged with hard links
+    upload_folder=os.path.join(args.workdir,"upload",key_name)
+    shutil.rmtree(upload_folder, ignore_errors=True)
+    for folder in ("blobs", "refs", "manifests"):
+        os.makedirs(os.path.join(upload_folder, folder))
+
+    # Images already in the local store or in the web archive are reused
+    entries = {}
+    remote_entries = {}
+    new_images = []
+    for image in local_images_list:
+        ref = image_ref(image)
+        entry = read_json(os.path.join(ref_folder, f"{ref}.json"))
+        if entry.get("image") == image and os.path.exists(os.path.join(blob_folder, f"{entry['digest']}.sif")):
+            entries[image] = entry
+            continue
+        if remote is not None:
+            entry = remote_json(f"{remote}/refs/{ref}.json")
+            if entry.get("image") == image and "digest" in entry:
+                remote_entries[image] = entries[image] = entry
+                print(f"{image} is already in the web archive as {entry['digest']}.sif")
+                continue
+        new_images.append(image)
 
-    must_download=False
-    if args.remote_archive_content is not None:
-        remote_images_list = download_and_validate_remote_images(args.remote_archive_content, key_name)
-        if set(local_images_list) != set(remote_images_list):
-            must_download=True
-    else:
-        must_download=True
-    
-    with open(output_archive_images, 'w') as f:
+    archive_folder=os.path.join(args.workdir,key_name)
+    uploads = [os.path.join(upload_folder, folder) for folder in ("blobs", "refs", "manifests")]
+    must_archive = False
+    if args.tar:
+        must_archive = remote is None or \
+            set(local_images_list) != set(download_and_validate_remote_images(remote, key_name))
+
+    if must_archive or args.link is not None:
+        # The archive and the links need the images reused from the web archive
+        for image, entry in remote_entries.items():
+            blob_file = os.path.join(blob_folder, f"{entry['digest']}.sif")
+            if not os.path.exists(blob_file):
+                fetch_blob(remote, entry["digest"], blob_file)
+
+    archive = None
+    if must_archive:
+        create_output_directory(archive_folder)
+        output_archive_file=os.path.join(archive_folder,f"{key_name}.tar")
+        output_archive_images=os.path.join(archive_folder,f"{key_name}.json")
+        output_archive_sha256sum=os.path.join(archive_folder, f"{key_name}_sha256sum.txt")
+        archive = ImageArchive(output_archive_file)
+        for image in local_images_list:
+            if image in entries:
+                archive.add(image.split('/')[-1],
+                            os.path.join(blob_folder, f"{entries[image]['digest']}.sif"))
+
+    print(f"{len(new_images)} of {len(local_images_list)} images to download: {new_images}")
+    # The new images are archived as their pulls complete
+    for entry in pull_images(new_images, pull_folder, blob_folder, args.jobs):
+        entries[entry["image"]] = entry
+        ref_file = os.path.join(ref_folder, f"{image_ref(entry['image'])}.json")
+        write_json(ref_file, entry)
+        os.link(ref_file, os.path.join(upload_folder, "refs", os.path.basename(ref_file)))
+        blob_file = os.path.join(blob_folder, f"{entry['digest']}.sif")
+        if not os.path.exists(os.path.join(upload_folder, "blobs", os.path.basename(blob_file))):
+            os.link(blob_file, os.path.join(upload_folder, "blobs", os.path.basename(blob_file)))
+        if archive is not None:
+            archive.add(entry["image"].split('/')[-1], blob_file)
+
+    manifest = {"name": key_name,
+                "architecture": args.architecture,
+                "images": {image: {"digest": entries[image]["digest"], "size": entries[image]["size"]}
+                           for image in sorted(local_images_list)}}
+    manifest_file = os.path.join(manifest_folder, f"{key_name}.json")
+    write_json(manifest_file, manifest)
+    os.link(manifest_file, os.path.join(upload_folder, "manifests", f"{key_name}.json"))
+    print(f"Manifest of the image set saved in {manifest_file}")
+
+    if archive is not None:
+        archive_sha256sum = archive.close()
+        print(f"Images archived successfully in archive {output_archive_file}" )
+
+        with open(output_archive_images, 'w') as f:
             json.dump(local_images_list, f)
-    print(f"List of images saved in {output_archive_images}")
-    print(f"{local_images_list}")
+        with open(output_archive_sha256sum, "w") as f:
+            f.write(f"{key_name}.tar {archive_sha256sum}")
+        uploads.append(archive_folder)
+
+    if args.link is not None:
+        link_images(manifest, blob_folder, args.link)
 
     with open("scp_command.sh", "w") as f:
         f.write("SSHPASS=${CI_CPUBMK} sshpass -v -e scp -v -oStrictHostKeyChecking=no -oPreferredAuthentications=keyboard-interactive -pr " +
-                f"{archive_folder} cpubmk@lxplus.cern.ch:${{destination_folder}}/{key_name}\n")
+                " ".join(uploads) + " cpubmk@lxplus.cern.ch:${destination_folder}/\n")
 
     with open("ssh_command.sh", "w") as f:
         f.write('SSHPASS=${CI_CPUBMK} sshpass -v -e ssh -v -oStrictHostKeyChecking=no -oPreferredAuthentications=keyboard-interactive cpubmk@lxplus.cern.ch '+
-            '"link_folder=${destination_folder}/../${HSVERSION}; [ ! -e \${link_folder} ] && mkdir \${link_folder}; ' +
-            f'[ ! -e \${{link_folder}}/{key_name} ] && ln -s ${{destination_folder}}/{key_name} \${{link_folder}}/{key_name}" \n'
-        )
-
-    if must_download:
-        download_images(local_images_list, sif_image_folder, output_archive_file)
-        #create_tar_archive(archive_folder, output_archive_file)
-        print(f"Images downloaded successfully in archive {output_archive_file}" )
-        shutil.rmtree(sif_image_folder)
-        print(f"Removed successfully temporarly {sif_image_folder} .")
-
-        with open(output_archive_sha256sum, "w") as f:
-            f.write(f"{key_name}.tar {generate_sha256sum(output_archive_file)}")
-    else:
-        print("Local and remote images are identical. No need to download.")
+            '"link_folder=${destination_folder}/../${HSVERSION}; [ ! -e \\${link_folder} ] && mkdir \\${link_folder}; ' +
+            f'ln -sf ${{destination_folder}}/manifests/{key_name}.json \\${{link_folder}}/{key_name}.json' +
+            (f'; [ ! -e \\${{link_folder}}/{key_name} ] && ln -s ${{destination_folder}}/{key_name} \\${{link_folder}}/{key_name}' if args.tar else '') +
+            '" \n')
+
+    if not new_images and not must_archive and remote is not None and \
+            remote_json(f"{remote}/manifests/{key_name}.json").get("images") == manifest["images"]:
+        print("All the images of the set are already in the web archive. No need to upload.")
         sys.exit(111)
+
+if __name__ == "__main__":
+    main()
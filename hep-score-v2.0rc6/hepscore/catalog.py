@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+"""
+catalog.py - Local SQLite catalogue of HEPscore results
+
+Every report written by hepscore can be recorded in an SQLite database,
+with one row per run (configuration hash, host, CPU model, architecture,
+score, duration and energy) and one row per workload of the run, so that
+fleet questions are answered with an indexed query instead of walking
+results directories:
+
+    $ hep-score-catalog ingest /archive/fleet
+    $ hep-score-catalog summary --by cpu_model --name HEPscore23
+
+Copyright 2019-2021 CERN. See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+
+import argparse
+import csv
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+import yaml
+
+from hepscore import paths
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CATALOG = paths.CATALOG
+SCHEMA_VERSION = 1
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    resultsdir TEXT UNIQUE NOT NULL,
+    report TEXT,
+    name TEXT,
+    config_hash TEXT,
+    hepscore_ver TEXT,
+    host TEXT,
+    cpu_model TEXT,
+    arch TEXT,
+    cores INTEGER,
+    start_at TEXT,
+    duration REAL,
+    score REAL,
+    status TEXT,
+    joules REAL,
+    mean_watts REAL
+);
+CREATE TABLE IF NOT EXISTS workloads (
+    run_id INTEGER NOT NULL REFERENCES runs(id),
+    benchmark TEXT NOT NULL,
+    score REAL,
+    runs INTEGER,
+    duration REAL,
+    joules REAL,
+    mean_watts REAL,
+    PRIMARY KEY (run_id, benchmark)
+);
+CREATE INDEX IF NOT EXISTS runs_config_hash ON runs (config_hash, score);
+CREATE INDEX IF NOT EXISTS runs_host ON runs (host, start_at);
+CREATE INDEX IF NOT EXISTS runs_cpu_model ON runs (cpu_model, config_hash);
+CREATE INDEX IF NOT EXISTS runs_arch ON runs (arch);
+CREATE INDEX IF NOT EXISTS workloads_benchmark ON workloads (benchmark, score);
+"""
+RUN_COLUMNS = ['resultsdir', 'report', 'name', 'config_hash', 'hepscore_ver', 'host',
+               'cpu_model', 'arch', 'cores', 'start_at', 'duration', 'score', 'status',
+               'joules', 'mean_watts']
+WORKLOAD_COLUMNS = ['benchmark', 'score', 'runs', 'duration', 'joules', 'mean_watts']
+GROUPS = ['cpu_model', 'host', 'arch', 'config_hash', 'name']
+
+
+def connect(path=DEFAULT_CATALOG, readonly=False):
+    """Open a catalogue, creating it if needed
+
+    Args:
+        path (str, optional): database file. Default: DEFAULT_CATALOG
+        readonly (bool, optional): open an existing catalogue read-only. Default: False
+
+    Returns:
+        sqlite3.Connection: connection returning sqlite3.Row rows
+    """
+    if readonly:
+        conn = sqlite3.connect('file:%s?mode=ro' % path, uri=True)
+    else:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # several hosts may record their runs in a catalogue at once
+        conn = sqlite3.connect(path, timeout=60)
+        if conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+            conn.executescript(SCHEMA)
+            conn.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _start_at(environment):
+    """Start time of a run as an ISO string, which sorts and compares in SQL"""
+    try:
+        return time.strftime('%Y-%m-%d %H:%M:%S',
+                             time.strptime(environment['start_at'], '%a %b %d %H:%M:%S %Y'))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _workload_score(wl_scores):
+    """Workload score from the 'wl-scores' entry of a report, None if not valid"""
+    subs = [sub for sub in wl_scores if sub + '_ref' in wl_scores]
+    if not subs:
+        return None
+    from hepscore import stats
+    try:
+        score = float(stats.workload_scores([wl_scores[sub] for sub in subs],
+                                            [wl_scores[sub + '_ref'] for sub in subs]))
+    except (TypeError, ValueError):
+        return None
+    return score if score > 0 else None
+
+
+def report_rows(report, resultsdir, outfile=None):
+    """Catalogue rows of a HEPscore report
+
+    Args:
+        report (dict): summary output of a HEPscore run
+        resultsdir (str): results directory of the run
+        outfile (str, optional): path of the report
+
+    Returns:
+        2-tuple (dict, list[dict]): run row, and a row per workload
+    """
+    environment = report.get('environment', {})
+    energy = report.get('energy') or {}
+    score = report.get('score')
+
+    run = {'resultsdir': os.path.abspath(resultsdir),
+           'report': os.path.abspath(outfile) if outfile else None,
+           'name': report.get('settings', {}).get('name'),
+           'config_hash': report.get('app_info', {}).get('config_hash'),
+           'hepscore_ver': report.get('app_info', {}).get('hepscore_ver'),
+           'host': (environment.get('system', '').split(' ') + [''])[1] or None,
+           'cpu_model': environment.get('cpu_model'),
+           'arch': environment.get('arch'),
+           'cores': environment.get('available_cores'),
+           'start_at': _start_at(environment),
+           'duration': environment.get('duration'),
+           'score': score if isinstance(score, (int, float)) and score >= 0 else None,
+           'status': report.get('status'),
+           'joules': energy.get('joules'),
+           'mean_watts': energy.get('mean_watts')}
+
+    workloads = []
+    for benchmark, bench_conf in report.get('benchmarks', {}).items():
+        if not isinstance(bench_conf, dict):
+            continue
+        runs = [val for key, val in bench_conf.items()
+                if key.startswith('run') and key[3:].isdigit() and isinstance(val, dict)]
+        energy = bench_conf.get('energy') or {}
+        workloads.append({
+            'benchmark': benchmark,
+            'score': _workload_score(report.get('wl-scores', {}).get(benchmark, {})),
+            'runs': len(runs),
+            'duration': sum(r.get('duration', 0) for r in runs) if runs else None,
+            'joules': energy.get('joules'),
+            'mean_watts': energy.get('mean_watts')})
+    return run, workloads
+
+
+def record(conn, report, resultsdir, outfile=None):
+    """Add a report to a catalogue, replacing any earlier report of resultsdir
+
+    Args:
+        conn (sqlite3.Connection): see `connect`
+        report (dict): summary output of a HEPscore run
+        resultsdir (str): results directory of the run
+        outfile (str, optional): path of the report
+    """
+    run, workloads = report_rows(report, resultsdir, outfile)
+    with conn:
+        old = conn.execute('SELECT id FROM runs WHERE resultsdir = ?',
+                           (run['resultsdir'],)).fetchone()
+        if old is not None:
+            conn.execute('DELETE FROM workloads WHERE run_id = ?', (old[0],))
+            conn.execute('DELETE FROM runs WHERE id = ?', (old[0],))
+        run_id = conn.execute('INSERT INTO runs (%s) VALUES (%s)' % (
+            ', '.join(RUN_COLUMNS), ', '.join('?' * len(RUN_COLUMNS))),
+            [run[col] for col in RUN_COLUMNS]).lastrowid
+        conn.executemany('INSERT INTO workloads (run_id, %s) VALUES (?, %s)' % (
+            ', '.join(WORKLOAD_COLUMNS), ', '.join('?' * len(WORKLOAD_COLUMNS))),
+            [[run_id] + [wl[col] for col in WORKLOAD_COLUMNS] for wl in workloads])
+
+
+def read_report(path):
+    """Read a JSON or YAML HEPscore report
+
+    Returns:
+        dict: the report, None if path is not a HEPscore report
+    """
+    try:
+        with open(path, mode='r') as rfile:
+            if path.endswith('.json'):
+                report = json.load(rfile)
+            else:
+                report = yaml.safe_load(rfile)
+                report = report.get('hepscore', report) if isinstance(report, dict) else None
+    except (OSError, ValueError, yaml.YAMLError):
+        return None
+    if not isinstance(report, dict) or 'app_info' not in report or 'benchmarks' not in report:
+        return None
+    return report
+
+
+def ingest(conn, trees):
+    """Record every HEPscore report found under trees
+
+    Args:
+        conn (sqlite3.Connection): see `connect`
+        trees (list[str]): directories searched for reports
+
+    Returns:
+        int: number of reports recorded
+    """
+    count = 0
+    for tree in trees:
+        for dirpath, _, filenames in os.walk(tree):
+            for filename in sorted(filenames):
+                if not filename.endswith(('.json', '.yaml')):
+                    continue
+                path = os.path.join(dirpath, filename)
+                report = read_report(path)
+                if report is not None:
+                    record(conn, report, dirpath, path)
+                    count += 1
+    return count
+
+
+def _filters(args, table='runs'):
+    """WHERE clause and parameters of the run filters of the command line"""
+    clauses, params = [], []
+    if args.config_hash:
+        clauses.append('%s.config_hash LIKE ?' % table)
+        params.append(args.config_hash + '%')
+    for col in ('host', 'arch', 'name'):
+        if getattr(args, col):
+            clauses.append('%s.%s = ?' % (table, col))
+            params.append(getattr(args, col))
+    if args.cpu_model:
+        clauses.append('%s.cpu_model LIKE ?' % table)
+        params.append('%' + args.cpu_model + '%')
+    if args.since:
+        clauses.append('%s.start_at >= ?' % table)
+        params.append(args.since)
+    return clauses, params
+
+
+def write_rows(cursor, out, fmt='table'):
+    """Write the rows of a query
+
+    Args:
+        cursor (sqlite3.Cursor): executed query
+        out (file): output stream
+        fmt (str, optional): 'table', 'csv' or 'json'. Default: 'table'
+    """
+    columns = [desc[0] for desc in cursor.description]
+    rows = [list(row) for row in cursor]
+    if fmt == 'json':
+        json.dump([dict(zip(columns, row)) for row in rows], out, indent=1)
+        out.write('\n')
+    elif fmt == 'csv':
+        writer = csv.writer(out)
+        writer.writerow(columns)
+        writer.writerows(rows)
+    else:
+        cells = [columns] + [['' if val is None else str(val) for val in row] for row in rows]
+        widths = [max(len(row[i]) for row in cells) for i in range(len(columns))]
+        for row in cells:
+            out.write('  '.join(val.ljust(width) for val, width in zip(row, widths)).rstrip()
+                      + '\n')
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Query the catalogue of HEPscore results")
+    parser.add_argument('--db', default=DEFAULT_CATALOG,
+                        help="catalogue database (default: %(default)s)")
+    parser.add_argument('--format', choices=['table', 'csv', 'json'], default='table',
+                        help="output format (default: table)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="display debug messages")
+    commands = parser.add_subparsers(dest='command')
+
+    ingest_cmd = commands.add_parser('ingest', help="record the reports found under directories")
+    ingest_cmd.add_argument('trees', nargs='+', metavar='TREE')
+
+    for name, helpstr in (('runs', "list runs"),
+                          ('summary', "score statistics of groups of successful runs")):
+        cmd = commands.add_parser(name, help=helpstr)
+        cmd.add_argument('--config_hash', help="configuration hash, or a prefix of it")
+        cmd.add_argument('--host', help="host name")
+        cmd.add_argument('--cpu_model', help="substring of the CPU model")
+        cmd.add_argument('--arch', help="architecture, e.g. x86_64")
+        cmd.add_argument('--name', help="benchmark suite name, e.g. HEPscore23")
+        cmd.add_argument('--since', help="runs started at or after this date (YYYY-MM-DD)")
+        cmd.add_argument('--benchmark', help="report the scores of this workload instead")
+    commands.choices['summary'].add_argument('--by', choices=GROUPS, default='cpu_model',
+                                             help="grouping (default: cpu_model)")
+
+    sql_cmd = commands.add_parser('sql', help="run a read-only SQL query")
+    sql_cmd.add_argument('query')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s hepscore [%(levelname)s] %(message)s')
+    if args.command is None:
+        parser.print_usage()
+        sys.exit(1)
+
+    if args.command == 'ingest':
+        conn = connect(args.db)
+        logger.info("Recorded %d reports in %s", ingest(conn, args.trees), args.db)
+        conn.close()
+        return
+
+    if not os.path.exists(args.db):
+        logger.error("No catalogue at %s", args.db)
+        sys.exit(1)
+    conn = connect(args.db, readonly=True)
+
+    try:
+        if args.command == 'sql':
+            cursor = conn.execute(args.query)
+        else:
+            clauses, params = _filters(args)
+            if args.benchmark:
+                source = 'runs JOIN workloads ON workloads.run_id = runs.id'
+                clauses.append('workloads.benchmark = ?')
+                params.append(args.benchmark)
+                score, joules, watts = 'workloads.score', 'workloads.joules', \
+                    'workloads.mean_watts'
+            else:
+                source = 'runs'
+                score, joules, watts = 'runs.score', 'runs.joules', 'runs.mean_watts'
+
+            if args.command == 'runs':
+                query = ('SELECT runs.start_at, runs.host, runs.cpu_model, runs.name, '
+                         'substr(runs.config_hash, 1, 12) AS config_hash, runs.status, '
+                         '{0} AS score, {1} AS joules, {2} AS mean_watts, runs.resultsdir '
+                         'FROM {3}{4} ORDER BY runs.start_at').format(
+                             score, joules, watts, source,
+                             ' WHERE ' + ' AND '.join(clauses) if clauses else '')
+            else:
+                clauses.append('%s IS NOT NULL' % score)
+                query = ('SELECT runs.{0} AS {0}, count(*) AS runs, '
+                         'round(min({1}), 4) AS min, round(avg({1}), 4) AS mean, '
+                         'round(max({1}), 4) AS max, round(avg({2}), 2) AS mean_watts, '
+                         'round(avg({1} / {2}), 4) AS score_per_watt '
+                         'FROM {3} WHERE {4} GROUP BY runs.{0} ORDER BY mean DESC').format(
+                             args.by, score, watts, source, ' AND '.join(clauses))
+            cursor = conn.execute(query, params)
+        write_rows(cursor, sys.stdout, args.format)
+    except sqlite3.Error as err:
+        logger.error("Query failed: %s", err)
+        sys.exit(1)
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
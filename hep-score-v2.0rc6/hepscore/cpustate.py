@@ -0,0 +1,333 @@
+#!/usr/bin/env python3
+"""
+cpustate.py - CPU frequency, temperature and thermal throttling during workloads
+
+A sampler thread follows one run of a workload and reads from sysfs:
+
+    cpu/cpuN/cpufreq/scaling_cur_freq       current frequency of the CPUs
+                                            the workload runs on
+    class/thermal/thermal_zoneN/temp        temperature of every thermal zone
+    cpu/cpuN/thermal_throttle/*_count       thermal throttling events of the
+                                            cores and packages of those CPUs
+                                            (x86 only)
+
+Every sample is appended to a time series file (see `hepscore.timeseries`),
+and a summary of the run is returned when sampling stops.  The summaries of
+the runs of a workload explain runs scoring well below the others, see
+`explain_outliers`.  Entries missing from sysfs (virtual machines,
+containers, other architectures) are left out of the summaries.
+
+Copyright 2019-2021 CERN. See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+
+import glob
+import logging
+import math
+import os
+import statistics
+
+from hepscore import sampler, topology
+
+logger = logging.getLogger(__name__)
+
+SYSFS_CPU = topology.SYSFS_CPU
+SYSFS_THERMAL = '/sys/class/thermal'
+NAN = float('nan')
+OUTLIER_DEFICIT = 0.03  # relative score deficit of a run from the workload median
+FREQ_DEFICIT = 0.03  # relative frequency deficit of a run explaining an outlier
+HOT_MARGIN = 5.0  # degrees below the lowest trip point of a zone counted as hot
+LIMIT_TRIPS = ('passive', 'hot', 'critical')  # trip points where cooling throttles
+
+
+def _number(path, scale=1.0):
+    value = sampler.read(path)
+    try:
+        return int(value) / scale
+    except (TypeError, ValueError):
+        return NAN
+
+
+def thermal_zones(sysfs_thermal=SYSFS_THERMAL):
+    """Thermal zones of the host
+
+    Args:
+        sysfs_thermal (str, optional): thermal class directory of sysfs
+
+    Returns:
+        list[dict]: 'zone' (eg thermal_zone0), 'type' (eg x86_pkg_temp),
+        'path' of the temperature and 'limit_c', the lowest passive, hot or
+        critical trip point in degrees Celsius (None if there is none)
+    """
+    zones = []
+    paths = glob.glob(os.path.join(sysfs_thermal, 'thermal_zone[0-9]*'))
+    for path in sorted(paths, key=lambda zpath: int(zpath.rsplit('zone', 1)[1])):
+        if sampler.read(os.path.join(path, 'temp')) is None:
+            continue
+        limits = []
+        for trip in glob.glob(os.path.join(path, 'trip_point_[0-9]*_type')):
+            if sampler.read(trip) in LIMIT_TRIPS:
+                limit = _number(trip[:-len('type')] + 'temp', 1000.0)
+                if limit > 0:
+                    limits.append(limit)
+        zones.append({'zone': os.path.basename(path),
+                      'type': sampler.read(os.path.join(path, 'type')) or 'unknown',
+                      'path': os.path.join(path, 'temp'),
+                      'limit_c': min(limits) if limits else None})
+    return zones
+
+
+def describe(cpus=None, sysfs_cpu=SYSFS_CPU):
+    """Frequency scaling setup of CPUs, for the environment of the report
+
+    Args:
+        cpus (list[int], optional): CPUs to describe. Default: the CPUs
+                                    hepscore is allowed to run on
+        sysfs_cpu (str, optional): cpu directory of sysfs
+
+    Returns:
+        dict: 'driver' and 'governors' of cpufreq, 'min_mhz' and 'max_mhz'
+        of the hardware, and 'boost' (turbo enabled) when known; empty
+        without cpufreq
+    """
+    if cpus is None:
+        cpus = os.sched_getaffinity(0)
+    info = {}
+    governors = set()
+    lows, highs = [], []
+    for cpu in sorted(cpus):
+        base = os.path.join(sysfs_cpu, 'cpu%d' % cpu, 'cpufreq')
+        driver = sampler.read(os.path.join(base, 'scaling_driver'))
+        if driver is None:
+            continue
+        info['driver'] = driver
+        governors.add(sampler.read(os.path.join(base, 'scaling_governor')) or 'unknown')
+        lows.append(_number(os.path.join(base, 'cpuinfo_min_freq'), 1000.0))
+        highs.append(_number(os.path.join(base, 'cpuinfo_max_freq'), 1000.0))
+    if not info:
+        return info
+
+    info['governors'] = sorted(governors)
+    lows = [low for low in lows if not math.isnan(low)]
+    highs = [high for high in highs if not math.isnan(high)]
+    if lows:
+        info['min_mhz'] = min(lows)
+    if highs:
+        info['max_mhz'] = max(highs)
+    boost = sampler.read(os.path.join(sysfs_cpu, 'cpufreq', 'boost'))
+    no_turbo = sampler.read(os.path.join(sysfs_cpu, 'intel_pstate', 'no_turbo'))
+    if boost is not None:
+        info['boost'] = boost == '1'
+    elif no_turbo is not None:
+        info['boost'] = no_turbo == '0'
+    return info
+
+
+class StateReader():
+    """Read the frequency of CPUs, the thermal zones and the throttle counters"""
+
+    def __init__(self, cpus=None, sysfs_cpu=SYSFS_CPU, sysfs_thermal=SYSFS_THERMAL):
+        """Args:
+            cpus (list[int], optional): CPUs the workload runs on. Default:
+                                        the CPUs hepscore is allowed to run on
+            sysfs_cpu (str, optional): cpu directory of sysfs
+            sysfs_thermal (str, optional): thermal class directory of sysfs
+        """
+        if cpus is None:
+            cpus = os.sched_getaffinity(0)
+        self.cpus = sorted(cpus)
+        self.freq_paths = [path for path in
+                           (os.path.join(sysfs_cpu, 'cpu%d' % cpu, 'cpufreq', 'scaling_cur_freq')
+                            for cpu in self.cpus)
+                           if os.path.exists(path)]
+        self.zones = thermal_zones(sysfs_thermal)
+
+        # counters are per core and per package, seen from each of their CPUs
+        topo = topology.read_topology(self.cpus, sysfs_cpu)['cpus']
+        cores, packages = {}, {}
+        for cpu in self.cpus:
+            cores.setdefault(topo[cpu]['core'], cpu)
+            packages.setdefault(topo[cpu]['package'], cpu)
+        self.throttle_paths = {}
+        for scope, owners in (('core', cores), ('package', packages)):
+            paths = [os.path.join(sysfs_cpu, 'cpu%d' % cpu, 'thermal_throttle',
+                                  scope + '_throttle_count')
+                     for cpu in sorted(owners.values())]
+            self.throttle_paths[scope] = [path for path in paths if os.path.exists(path)]
+
+        self.columns = (['monotonic', 'freq_mean_mhz', 'freq_min_mhz', 'freq_max_mhz']
+                        + [zone['zone'] + '_c' for zone in self.zones]
+                        + ['core_throttles', 'package_throttles'])
+
+    def sample(self):
+        """Current state, one value per column after 'monotonic'
+
+        Returns:
+            tuple: mean, lowest and highest frequency (MHz), temperature of
+            each zone (degrees Celsius) and total core and package throttle
+            counts; NaN for what sysfs does not provide
+        """
+        freqs = [freq for freq in (_number(path, 1000.0) for path in self.freq_paths)
+                 if not math.isnan(freq)]
+        if freqs:
+            row = [sum(freqs) / len(freqs), min(freqs), max(freqs)]
+        else:
+            row = [NAN, NAN, NAN]
+        row += [_number(zone['path'], 1000.0) for zone in self.zones]
+        for scope in ('core', 'package'):
+            counts = [_number(path) for path in self.throttle_paths[scope]]
+            row.append(sum(counts) if counts else NAN)
+        return tuple(row)
+
+
+class StateSampler(sampler.Sampler):
+    """Sample the CPU state during a run in a background thread"""
+
+    name = 'cpustate'
+    description = 'CPU state'
+
+    def __init__(self, store=None, interval=1.0, cpus=None, sysfs_cpu=SYSFS_CPU,
+                 sysfs_thermal=SYSFS_THERMAL):
+        """Args:
+            store (str, optional): time series file receiving the samples
+            interval (float, optional): seconds between samples. Default: 1.0
+            cpus (list[int], optional): CPUs the workload runs on
+            sysfs_cpu (str, optional): cpu directory of sysfs
+            sysfs_thermal (str, optional): thermal class directory of sysfs
+        """
+        self.reader = StateReader(cpus, sysfs_cpu, sysfs_thermal)
+        super().__init__(store, interval, self.reader.columns,
+                         {'cpus': self.reader.cpus,
+                          'zones': {zone['zone']: zone['type'] for zone in self.reader.zones}})
+        self.freq_sum = 0.0
+        self.freq_samples = 0
+        self.freq_min = math.inf
+        self.freq_max = -math.inf
+        self.temp_max = {}
+
+    def sample(self):
+        """Sample the CPU state
+
+        Returns:
+            tuple: see `StateReader.sample`
+        """
+        values = self.reader.sample()
+        if not math.isnan(values[0]):
+            self.freq_sum += values[0]
+            self.freq_samples += 1
+            self.freq_min = min(self.freq_min, values[1])
+            self.freq_max = max(self.freq_max, values[2])
+        for zone, temp in zip(self.reader.zones, values[3:-2]):
+            if not math.isnan(temp):
+                self.temp_max[zone['zone']] = max(temp, self.temp_max.get(zone['zone'], temp))
+        return values
+
+    def summary(self):
+        """Frequency, temperature and throttling over the run
+
+        Returns:
+            dict: number of samples, mean, lowest and highest frequency of
+            the CPUs of the run (MHz), highest temperature of each zone type
+            and overall (degrees Celsius), whether a zone came within
+            HOT_MARGIN of its trip point, and the core and package throttle
+            events during the run; empty if no sample was taken
+        """
+        if self.last is None:
+            return {}
+        summary = {'samples': self.samples}
+        if self.freq_samples:
+            summary.update({'freq_mean_mhz': round(self.freq_sum / self.freq_samples, 1),
+                            'freq_min_mhz': round(self.freq_min, 1),
+                            'freq_max_mhz': round(self.freq_max, 1)})
+        if self.temp_max:
+            temps = {}
+            hot = False
+            for zone in self.reader.zones:
+                if zone['zone'] not in self.temp_max:
+                    continue
+                temp = self.temp_max[zone['zone']]
+                temps[zone['type']] = max(temp, temps.get(zone['type'], temp))
+                if zone['limit_c'] is not None and temp >= zone['limit_c'] - HOT_MARGIN:
+                    hot = True
+            summary['temp_max_c'] = {ztype: round(temp, 1) for ztype, temp in temps.items()}
+            summary['temp_peak_c'] = round(max(temps.values()), 1)
+            summary['near_trip_point'] = hot
+        for pos, scope in ((-2, 'core'), (-1, 'package')):
+            if not math.isnan(self.last[pos]):
+                summary[scope + '_throttles'] = int(self.last[pos] - self.first[pos])
+        return summary
+
+
+def workload_summary(runs):
+    """Summary of the CPU state over all runs of a workload
+
+    Args:
+        runs (dict): run name -> summary, see `StateSampler.summary`
+
+    Returns:
+        dict: mean frequency over the runs and its lowest and highest run
+        values (MHz), peak temperature, and total throttle events; empty if
+        no run has a summary
+    """
+    runs = [run for run in runs.values() if run]
+    summary = {}
+    freqs = [run['freq_mean_mhz'] for run in runs if 'freq_mean_mhz' in run]
+    if freqs:
+        summary.update({'freq_mean_mhz': round(statistics.mean(freqs), 1),
+                        'freq_run_min_mhz': min(freqs),
+                        'freq_run_max_mhz': max(freqs)})
+    temps = [run['temp_peak_c'] for run in runs if 'temp_peak_c' in run]
+    if temps:
+        summary['temp_peak_c'] = max(temps)
+    for scope in ('core', 'package'):
+        counts = [run[scope + '_throttles'] for run in runs if scope + '_throttles' in run]
+        if counts:
+            summary[scope + '_throttles'] = sum(counts)
+    return summary
+
+
+def explain_outliers(scores, states):
+    """Runs of a workload scoring well below its median, and the likely cause
+
+    A run is an outlier when its score is more than OUTLIER_DEFICIT below
+    the median score of the workload.  Its CPU state explains it when:
+
+        throttled        throttle events were counted during the run
+        hot              a thermal zone came close to its trip point
+        low_frequency    the mean frequency of the run was more than
+                         FREQ_DEFICIT below the median of the runs
+
+    Args:
+        scores (dict): run name -> score
+        states (dict): run name -> CPU state summary, see `StateSampler.summary`
+
+    Returns:
+        dict: run name -> {'deficit' (relative to the median score),
+        'causes' (list, empty if the CPU state does not explain it)}
+    """
+    if len(scores) < 2:
+        return {}
+    median = statistics.median(scores.values())
+    if median <= 0:
+        return {}
+    freqs = [state['freq_mean_mhz'] for state in states.values()
+             if state and 'freq_mean_mhz' in state]
+    median_freq = statistics.median(freqs) if freqs else None
+
+    outliers = {}
+    for run, score in sorted(scores.items()):
+        deficit = (median - score) / median
+        if deficit <= OUTLIER_DEFICIT:
+            continue
+        state = states.get(run) or {}
+        causes = []
+        if state.get('core_throttles', 0) > 0 or state.get('package_throttles', 0) > 0:
+            causes.append('throttled')
+        if state.get('near_trip_point'):
+            causes.append('hot')
+        if median_freq and 'freq_mean_mhz' in state and \
+                state['freq_mean_mhz'] < median_freq * (1 - FREQ_DEFICIT):
+            causes.append('low_frequency')
+        outliers[run] = {'deficit': round(deficit, 4), 'causes': causes}
+    return outliers
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+energy.py - Energy accounting of HEPscore runs from PDU power samples
+
+Copyright 2019-2021 CERN. See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+
+import numpy as np
+
+# Energy entry of runs and workloads that ran at the same time as others
+CONCURRENT = {'unavailable': 'concurrent runs'}
+
+
+def node_power(samples):
+    """Combine per-outlet power samples into the power drawn by the node
+
+    Each outlet is linearly interpolated onto the union of all sample
+    timestamps, and the outlets are summed.
+
+    Args:
+        samples (list[tuple]): (timestamp, watts, outlet index) samples
+
+    Returns:
+        2-tuple (ndarray, ndarray): sorted timestamps, node power in watts
+    """
+    data = np.asarray(samples, dtype=np.float64).reshape(-1, 3)
+    if data.shape[0] == 0:
+        return np.empty(0), np.empty(0)
+
+    times = np.unique(data[:, 0])
+    watts = np.zeros_like(times)
+    for outlet in np.unique(data[:, 2]):
+        series = data[data[:, 2] == outlet]
+        order = np.argsort(series[:, 0], kind='stable')
+        watts += np.interp(times, series[order, 0], series[order, 1])
+
+    return times, watts
+
+
+def integrate_windows(times, watts, starts, ends):
+    """Integrate power over time windows with the trapezoidal rule
+
+    Power is linearly interpolated at the window edges, and windows are
+    clipped to the sampled time range.
+
+    Args:
+        times (ndarray): sorted sample timestamps (seconds)
+        watts (ndarray): power at each timestamp
+        starts (array-like): start of each window
+        ends (array-like): end of each window
+
+    Returns:
+        3-tuple (ndarray, ndarray, ndarray): energy (joules), mean and peak
+        power (watts) of each window; NaN where no power was sampled
+    """
+    starts = np.asarray(starts, dtype=np.float64)
+    ends = np.asarray(ends, dtype=np.float64)
+    nan = np.full(starts.shape, np.nan)
+    if times.size < 2:
+        return nan, nan.copy(), nan.copy()
+
+    # cumulative energy at each sample
+    cumulative = np.concatenate(([0.0], np.cumsum(np.diff(times) * (watts[1:] + watts[:-1]) / 2)))
+
+    def energy_at(t):
+        idx = np.clip(np.searchsorted(times, t, side='right') - 1, 0, times.size - 2)
+        w_t = np.interp(t, times, watts)
+        return cumulative[idx] + (t - times[idx]) * (watts[idx] + w_t) / 2
+
+    lo_t = np.clip(starts, times[0], times[-1])
+    hi_t = np.clip(ends, times[0], times[-1])
+    covered = hi_t - lo_t
+    joules = np.where(covered > 0, energy_at(hi_t) - energy_at(lo_t), np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(covered > 0, joules / covered, np.nan)
+
+    # peak over samples inside the window, and the interpolated edges
+    lo = np.searchsorted(times, lo_t, side='left')
+    hi = np.searchsorted(times, hi_t, side='right')
+    padded = np.append(watts, -np.inf)
+    inner = np.maximum.reduceat(padded, np.column_stack((lo, hi)).ravel())[::2]
+    inner = np.where(hi > lo, inner, -np.inf)
+    peak = np.maximum(inner, np.maximum(np.interp(lo_t, times, watts),
+                                        np.interp(hi_t, times, watts)))
+    peak = np.where(covered > 0, peak, np.nan)
+
+    return joules, mean, peak
+
+
+def _entry(j, m, p, score=None):
+    """Energy entry of a window, empty if no power was sampled in it"""
+    if np.isnan(j):
+        return {}
+    res = {'joules': round(float(j), 1),
+           'mean_watts': round(float(m), 2),
+           'peak_watts': round(float(p), 2)}
+    if score is not None and m > 0 and score >= 0:
+        res['score_per_watt'] = round(float(score / m), 6)
+    return res
+
+
+def overlapping(windows):
+    """Whether any two of the (start, end) windows overlap in time"""
+    ordered = sorted(windows)
+    return any(start < end for (_, end), (start, _) in zip(ordered, ordered[1:]))
+
+
+def energy_report(samples, run_windows, scores, total_window, final_score):
+    """Energy, mean and peak power, and score per watt of a HEPscore run
+
+    The samples are the power of the whole node.  When runs overlap in time
+    (packed workloads), that power cannot be told apart between them: the
+    runs and workloads get the CONCURRENT entry, and only the whole run is
+    integrated, once.
+
+    Args:
+        samples (list[tuple]): (timestamp, watts, outlet index) power samples
+        run_windows (dict): {benchmark: {run name: (start, end)}} in the
+                            timebase of the samples
+        scores (dict): {benchmark: workload score}
+        total_window (tuple): (start, end) of the whole run
+        final_score (float): HEPscore of the run
+
+    Returns:
+        2-tuple (dict, dict): {benchmark: {'runs': {run name: energy},
+                              'total': energy}}, energy of the whole run
+    """
+    times, watts = node_power(samples)
+
+    keys = [(bmk, run) for bmk in run_windows for run in run_windows[bmk]]
+    if overlapping([run_windows[bmk][run] for bmk, run in keys]):
+        workloads = {bmk: {'runs': {run: dict(CONCURRENT) for run in run_windows[bmk]},
+                           'total': dict(CONCURRENT)}
+                     for bmk in run_windows}
+        joules, mean, peak = integrate_windows(times, watts, [total_window[0]],
+                                               [total_window[1]])
+        return workloads, _entry(joules[0], mean[0], peak[0], final_score)
+
+    bounds = np.array([run_windows[bmk][run] for bmk, run in keys] + [total_window],
+                      dtype=np.float64).reshape(-1, 2)
+    joules, mean, peak = integrate_windows(times, watts, bounds[:, 0], bounds[:, 1])
+
+    workloads = {}
+    for i, (bmk, run) in enumerate(keys):
+        workloads.setdefault(bmk, {'runs': {}})['runs'][run] = _entry(joules[i], mean[i],
+                                                                      peak[i])
+
+    for bmk in workloads:
+        idx = [i for i, key in enumerate(keys) if key[0] == bmk and not np.isnan(joules[i])]
+        if not idx:
+            workloads[bmk]['total'] = {}
+            continue
+        duration = float(np.sum(np.clip(bounds[idx, 1], times[0], times[-1]) -
+                                np.clip(bounds[idx, 0], times[0], times[-1])))
+        total_j = float(np.sum(joules[idx]))
+        workloads[bmk]['total'] = _entry(total_j, total_j / duration, np.max(peak[idx]),
+                                         scores.get(bmk))
+
+    return workloads, _entry(joules[-1], mean[-1], peak[-1], final_score)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+engine.py - Container engine capability probe
+
+Finding the version, implementation (apptainer or singularity, podman or
+docker) and `--unsquash` support of the container engine means running it
+several times.  The probe is done once per session, and its result is kept
+in a small cache file keyed by the path, size and modification time of the
+engine binary, so that later sessions on the same node do not run the
+engine again until it is upgraded.
+
+Copyright 2019-2021 CERN. See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+
+from hepscore import paths
+
+logger = logging.getLogger(__name__)
+
+CACHE_FILE = paths.ENGINE_CACHE
+PROBE_TIMEOUT = 60  # seconds an engine may take to answer --version or --help
+UNKNOWN = {'engine': 'unknown', 'version': '0.0', 'unsquash': False}
+
+
+def userns_supported():
+    """Checks for user namespace support of the host
+
+    Returns:
+        bool: True if unprivileged user namespaces can be created
+    """
+    proc_muns = "/proc/sys/user/max_user_namespaces"
+    dockerenv = "/.dockerenv"
+    podmanenv = "/run/.containerenv"
+
+    if os.path.isfile(dockerenv) or os.path.isfile(podmanenv):
+        logger.debug("Running inside of Docker. Not enabling user namespaces.")
+        return False
+
+    try:
+        with open(proc_muns, mode='r') as userns_file:
+            max_usrns = int(userns_file.read())
+        return bool(max_usrns)
+    except (OSError, ValueError):
+        logger.debug("Cannot open/read from %s, assuming user namespace support disabled",
+                     proc_muns)
+        return False
+
+
+def _output(command):
+    """Combined output of command, '' if it cannot be run"""
+    try:
+        return subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                              timeout=PROBE_TIMEOUT).stdout.decode('utf-8', 'replace')
+    except (subprocess.SubprocessError, OSError) as err:
+        logger.debug("Failed to run %s: %s", ' '.join(command), err)
+        return ''
+
+
+def probe_binary(cec, binary):
+    """Run an engine binary to find its capabilities
+
+    Args:
+        cec (str): 'singularity' or 'docker'
+        binary (str): path of the engine binary
+
+    Returns:
+        dict: 'engine' (implementation), 'version' and 'unsquash' (bool)
+    """
+    for line in _output([binary, '--version']).splitlines():
+        version = re.sub(r'^[^0-9]*', '', line).strip()
+        if version and version[0].isdigit():
+            break
+    else:
+        logger.error("Error fetching %s version", cec)
+        return dict(UNKNOWN)
+
+    engimpl = cec
+    unsquash = False
+    if cec == 'singularity':
+        if 'apptainer' in line:
+            engimpl = 'apptainer'
+            unsquash = '--unsquash' in _output([binary, 'run', '--help'])
+    elif cec == 'docker':
+        if 'podman' in _output([binary, '--help']):
+            engimpl = 'podman'
+    return {'engine': engimpl, 'version': version, 'unsquash': unsquash}
+
+
+def _read_cache(cache_file):
+    try:
+        with open(cache_file, mode='r') as cfile:
+            cache = json.load(cfile)
+        return cache if isinstance(cache, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_cache(cache_file, cache):
+    tmp = "%s.%d.tmp" % (cache_file, os.getpid())
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        with open(tmp, mode='w') as cfile:
+            json.dump(cache, cfile, indent=1)
+        os.replace(tmp, cache_file)
+    except OSError as err:
+        logger.debug("Failed to write engine cache %s: %s", cache_file, err)
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+
+def probe(cec, cache_file=CACHE_FILE):
+    """Capabilities of a container engine, from the cache when it is current
+
+    Args:
+        cec (str): 'singularity' or 'docker'
+        cache_file (str, optional): cache of earlier probes, None not to use
+                                    one. Default: CACHE_FILE
+
+    Returns:
+        dict: 'engine' (implementation), 'version', 'unsquash' (bool),
+        'userns' (bool, whether the host supports user namespaces) and
+        'binary' (path of the engine, None if it is not installed)
+    """
+    caps = {'binary': shutil.which(cec), 'userns': userns_supported()}
+    if caps['binary'] is None:
+        logger.error("Could not locate %s on the system. Please check your path!", cec)
+        caps.update(UNKNOWN)
+        return caps
+
+    info = os.stat(caps['binary'])
+    key = {'mtime': info.st_mtime_ns, 'size': info.st_size}
+    cache = _read_cache(cache_file) if cache_file else {}
+    entry = cache.get(caps['binary'])
+    if isinstance(entry, dict) and all(entry.get(k) == v for k, v in key.items()) \
+            and all(k in entry for k in UNKNOWN):
+        logger.debug("Using cached capabilities of %s", caps['binary'])
+        caps.update({k: entry[k] for k in UNKNOWN})
+        return caps
+
+    found = probe_binary(cec, caps['binary'])
+    caps.update(found)
+    if cache_file and found['engine'] != UNKNOWN['engine']:
+        # reread, in case another session probed a different engine meanwhile
+        cache = _read_cache(cache_file)
+        cache[caps['binary']] = dict(found, **key)
+        _write_cache(cache_file, cache)
+    return caps
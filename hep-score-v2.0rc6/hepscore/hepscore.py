@@ -7,7 +7,8 @@ of this distribution. For licensing information, see the COPYING file at
 the top-level directory of this distribution.
 """
 
-import asyncio
+import collections
+import concurrent.futures
 import threading
 import glob
 import hashlib
@@ -17,6 +18,7 @@ import math
 import multiprocessing
 import operator
 import os
+import queue
 import re
 import shutil
 import stat
@@ -24,34 +26,23 @@ import subprocess
 import sys
 import time
 import yaml
-from hepscore import __version__
-from pysnmp.hlapi.v3arch.asyncio import *
+from hepscore import cpustate, engine, topology, trace
 
 logger = logging.getLogger(__name__)
 scoresData = []
 config_path = '/'.join(os.path.split(__file__)[:-1]) + "/etc"
 
-async def getPowerReadings(interval,IPs,stop,power,oid):
-    if (len(IPs) == 0):
-        return
-    engine = SnmpEngine()
-    while not stop.is_set():
-        for i in range(0,len(IPs)):
-            transport = await UdpTransportTarget.create((IPs[i], 161))
-            errorIndication, errorStatus, errorIndex, varBinds = await get_cmd(engine,
-                    CommunityData('LHCsnmpL88k', mpModel=1),
-                    transport,
-                    ContextData(),
-                    ObjectType(ObjectIdentity(oid[i]+".5")))
-            if errorIndication:
-                print(f"SNMP error: {errorIndication}")
-            elif errorStatus:
-                print(f"SNMP error: {errorStatus.prettyPrint()}")
-            else:
-                for varBind in varBinds:
-                    power.append((time.time(), float(varBind[1])))
-        await asyncio.sleep(interval)
-      
+LOG_CHUNK = 1 << 16  # bytes read from the container output pipe at once
+LOG_BUFFER = 1 << 20  # write buffer of the per-run log file
+LOG_TAIL = 100  # lines of output kept to report failures
+POWER_SERIES = 'power.hsts'  # power samples, in resultsdir
+POWER_INDEX = 'power.json'  # timing and scores of the sampled run, in resultsdir
+TELEMETRY_SERIES = '.telemetry.hsts'  # resource usage samples of a run, next to its directory
+CPUSTATE_SERIES = '.cpustate.hsts'  # frequency and temperature samples of a run, likewise
+CHECKPOINT = 'checkpoint.json'  # completed workloads, to resume a run, in resultsdir
+TARGET_SPREAD = 0.02  # default relative spread of run scores in adaptive mode
+CI_SEED = 0  # seed of the bootstrap, so that the same scores give the same interval
+
 def list_named_confs():
     """Return list of available built-in configurations
 
@@ -123,6 +114,8 @@ def median_tuple(vals):
 def weighted_geometric_mean(vals, weights=None):
     """Return geometric mean of floats, with optional weighting
 
+    Computed in log space, see `hepscore.stats.weighted_geometric_mean`.
+
     Args:
         vals (list[float]): List of float(scores)
         weights (list[float], optional): [description]. Defaults to None.
@@ -130,32 +123,112 @@ def weighted_geometric_mean(vals, weights=None):
     Returns:
         float: the weighted geometric mean
     """
+    if weights is not None and len(vals) != len(weights):
+        return 0
+    if len(vals) == 0:
+        return 0
 
-    if weights is None:
-        weights = []
-        for i in vals:
-            weights.append(1.0)
+    # numpy, like the SNMP stack and the catalogue, is only loaded on the
+    # code paths that need it, to keep the command line quick to start
+    from hepscore import stats
+    return float(stats.weighted_geometric_mean(vals, weights))
 
-    if len(vals) != len(weights):
-        return 0
 
-    # Ensure we're dealing with floats
-    vals = [float(x) for x in vals]
-    weights = [float(x) for x in weights]
+def cpu_model(cpuinfo='/proc/cpuinfo'):
+    """Return the CPU model name of the host, '' if unknown
 
-    total_weight = sum(weights)
-    if total_weight == 0:
-        return 0
+    Args:
+        cpuinfo (str, optional): path of the cpuinfo file. Default: /proc/cpuinfo
+    """
+    models = {}
+    try:
+        with open(cpuinfo, mode='r') as cfile:
+            for line in cfile:
+                key, _, val = line.partition(':')
+                models.setdefault(key.strip(), val.strip())
+    except OSError:
+        return ''
+    # x86, POWER and s390x/older ARM kernels name the CPU differently
+    for key in ('model name', 'cpu', 'machine', 'Hardware', 'Processor'):
+        if models.get(key):
+            return models[key]
+    return ''
+
+
+def cpuset_str(cpuset):
+    """Return the cpu-list representation of a cpuset (eg "0-3,8")
+
+    Args:
+        cpuset (list[int]): CPU numbers
+
+    Returns:
+        str: cpu-list string as accepted by taskset and docker
+    """
+    ranges = []
+    for cpu in sorted(cpuset):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+
+    return ','.join(str(lo) if lo == hi else "%d-%d" % (lo, hi) for lo, hi in ranges)
 
-    weighted_vals = [vals[i] ** weights[i] for i in range(len(vals))]
 
-    total_val = 1
-    for val in weighted_vals:
-        total_val *= val
+def tee_output(stream, line_sink, raw_sink=None, tail=None, first_output=None):
+    """Copy container output to log files as it is produced
 
-    weighted_gmean = total_val ** (1.0 / total_weight)
+    Output is read in large chunks and never decoded.  `line_sink` only
+    receives complete lines, so that logs of concurrent workloads appended to
+    the same file do not interleave mid-line; `raw_sink` receives the output
+    as read.
 
-    return weighted_gmean
+    Args:
+        stream (file): binary output pipe of the container
+        line_sink (file): unbuffered binary file, eg the aggregate log
+        raw_sink (file, optional): binary file, eg the per-run log
+        tail (collections.deque, optional): receives the last lines of output
+        first_output (callable, optional): called once, when output is first read
+
+    Returns:
+        bool: True if the output reports that no space is left on device
+    """
+    fd = stream.fileno()
+    partial = b''
+    no_space = False
+
+    while True:
+        chunk = os.read(fd, LOG_CHUNK)
+        if not chunk:
+            break
+        if first_output is not None:
+            first_output()
+            first_output = None
+        if raw_sink is not None:
+            raw_sink.write(chunk)
+
+        eol = chunk.rfind(b'\n')
+        if eol < 0:
+            partial += chunk
+            if len(partial) > LOG_BUFFER:
+                # do not hold on to arbitrarily long lines
+                line_sink.write(partial)
+                partial = b''
+            continue
+        lines = partial + chunk[:eol + 1]
+        partial = chunk[eol + 1:]
+
+        line_sink.write(lines)
+        if b'no space left on device' in lines:
+            no_space = True
+        if tail is not None:
+            tail.extend(lines.splitlines()[-tail.maxlen:])
+
+    if partial:
+        line_sink.write(partial)
+        if tail is not None:
+            tail.append(partial)
+
+    return no_space
 
 
 class HEPscore():
@@ -168,12 +241,25 @@ class HEPscore():
     clean = False
     clean_files = False
     userns = False
+    engine_caps = None
+    image_cache = None
+    image_cache_size = None
+    _image_cache = None
     ncores = 0  # ncores==0 is interpreted as default. hepscore does not force changes in the wl configs
+    packed = 0  # packed<=1 runs the workloads one after another
+    placement = 'none'
+    smt = None
+    reserve_cores = 0
+    layout = None
+    numactl = None
+    durations = {}
+    prefetch = False
+    _prefetch_pool = None
     addarch = False
-    valid_uris = ['docker', 'shub', 'dir', 'oras', 'https']
+    valid_uris = ['docker', 'shub', 'dir', 'tar', 'oras', 'https']
     valid_curis = {
             'docker' : ['docker'],
-            'singularity'    : ['oras', 'docker', 'shub', 'dir', 'https']
+            'singularity'    : ['oras', 'docker', 'shub', 'dir', 'tar', 'https']
     }
     scache = ""
     unpack = ""
@@ -182,10 +268,15 @@ class HEPscore():
     results = []
     weights = []
     score = -1
-    oid = []
-    IP = []
-
-    def __init__(self, config, resultsdir, oids, IPs):
+    power_interval = 1.0
+    telemetry_interval = 1.0
+    power_daemon = None
+    resume = False
+    catalog_db = None
+    tracer = None
+    trace_file = None
+
+    def __init__(self, config, resultsdir, oids=None, IPs=None):
         """HEPSCORE: a HEP benchmark SCORE generator
 
         This class orchestrates HEP benchmarks (as docker or singularity images).
@@ -199,8 +290,11 @@ class HEPscore():
         Args:
             config (dict): Nested dict object with benchmark and parsing configurations
             resultsdir (str): Path to output results
+            oids (list, optional): PDU outlet number of each power supply of the host
+            IPs (list, optional): PDU address of each power supply of the host
         """
         self.resultsdir = os.path.abspath(resultsdir)
+        self.tracer = trace.Tracer()
 
         if 'hepscore_benchmark' in config:
             logger.warning("Deprecated 'hepscore_benchmark' key found in configuration."
@@ -210,9 +304,18 @@ class HEPscore():
         if 'hepscore' not in config:
             logger.error("Required 'hepscore' key not in configuration!")
             sys.exit(1)
-        for od in oids:
-            self.oid.append(".1.3.6.1.4.1.13742.6.5.4.3.1.4.1."+str(od))
-        self.IP = IPs
+        self.oid = [str(od) for od in (oids or [])]
+        self.IP = list(IPs or [])
+        self.power = []
+        self.power_anchor = {}
+        self.power_index = {}
+        self.bench_time = {}
+        self.run_windows = {}
+        self.run_window = ()
+        self.bench_scores = {}
+        self.checkpoint = {}
+        self.resumed = set()  # benchmarks with runs from before a resume
+        self._checkpoint_lock = threading.Lock()
         self.confobj = config['hepscore']
         self.settings = self.confobj['settings']
         self.tmpdir = self.resultsdir + '/tmp'
@@ -242,8 +345,8 @@ class HEPscore():
         if 'addarch' in self.settings:
             self.addarch = self.settings['addarch']
 
-        # Allow overrides of ncores and registry via options
-        for optov in ('ncores', 'registry'):
+        # Allow overrides of ncores, packed, placement and registry via options
+        for optov in ('ncores', 'packed', 'placement', 'smt', 'reserve_cores', 'registry'):
             if optov in self.options:
                 self.settings[optov] = self.options[optov]
 
@@ -258,6 +361,29 @@ class HEPscore():
             self.ncores=0
             self.settings['ncores'] = self.ncores
 
+        # Only record 'packed' (and change the hash) when workloads really run concurrently
+        if int(self.settings.get('packed', 0)) > 1:
+            self.packed = int(self.settings['packed'])
+        else:
+            self.settings.pop('packed', None)
+
+        # Likewise for the placement of the workloads on the cores
+        if self.settings.get('placement', 'none') != 'none':
+            self.placement = self.settings['placement']
+        else:
+            self.settings.pop('placement', None)
+        if self.settings.get('smt'):
+            self.smt = self.settings['smt']
+        else:
+            self.settings.pop('smt', None)
+        if int(self.settings.get('reserve_cores', 0)) > 0:
+            self.reserve_cores = int(self.settings['reserve_cores'])
+        else:
+            self.settings.pop('reserve_cores', None)
+
+        if 'durations' in self.options:
+            self.durations = self._read_durations(self.options['durations'])
+
         if 'clean' in self.options:
             self.clean = self.options['clean']
             if self.clean and self.cec == 'singularity':
@@ -270,6 +396,39 @@ class HEPscore():
         if 'userns' in self.options:
             self.userns = self.options['userns']
 
+        if 'prefetch' in self.options:
+            self.prefetch = self.options['prefetch']
+
+        if 'power_interval' in self.options:
+            self.power_interval = float(self.options['power_interval'])
+        if 'power_daemon' in self.options:
+            self.power_daemon = self.options['power_daemon']
+        if 'telemetry_interval' in self.options:
+            try:
+                self.telemetry_interval = float(self.options['telemetry_interval'])
+            except ValueError:
+                logger.error("telemetry_interval must be a number of seconds")
+                sys.exit(1)
+
+        if 'resume' in self.options:
+            self.resume = self.options['resume']
+
+        if 'image_cache' in self.options:
+            self.image_cache = self.options['image_cache']
+        if 'image_cache_size' in self.options:
+            try:
+                self.image_cache_size = float(self.options['image_cache_size'])
+            except ValueError:
+                logger.error("image_cache_size must be a number of GB")
+                sys.exit(1)
+
+        if 'catalog' in self.options:
+            self.catalog_db = self.options['catalog']
+
+        if 'trace' in self.options:
+            self.trace_file = self.options['trace'] or os.path.join(self.resultsdir,
+                                                                    trace.TRACE_FILE)
+
         self.confobj.pop('options', None)
         self.validate_conf()
         # Update confobj for logging purposes once registry is resolved
@@ -366,50 +525,200 @@ class HEPscore():
 
         return path
 
-    def _proc_results(self, benchmark):
-        """Process benchmark results"""
+    def _read_durations(self, report):
+        """Read per-benchmark wall time from a previous hepscore report
 
-        results = {}
-        bench_conf = self.confobj['benchmarks'][benchmark]
-        runs = int(self.confobj['settings']['repetitions'])
+        Args:
+            report (str): path to a JSON or YAML hepscore report
+
+        Returns:
+            dict: total duration (seconds) of all runs of each benchmark
+        """
+        prior = read_yaml(report)
+        if isinstance(prior, dict) and 'hepscore' in prior:
+            prior = prior['hepscore']
+        if not isinstance(prior, dict) or not isinstance(prior.get('benchmarks'), dict):
+            logger.warning("No benchmark durations found in %s", report)
+            return {}
+
+        durations = {}
+        for bmk, bmk_conf in prior['benchmarks'].items():
+            if not isinstance(bmk_conf, dict):
+                continue
+            runs = [v for k, v in bmk_conf.items()
+                    if re.match(r'^run[0-9]+$', k) and isinstance(v, dict)]
+            if runs:
+                durations[bmk] = sum(float(run.get('duration', 0)) for run in runs)
+
+        return durations
+
+    def _schedule_order(self, benchmarks):
+        """Order benchmarks longest-first using recorded durations
 
+        Benchmarks without a recorded duration are started first, in
+        configuration order, as their run time is unknown.
+        """
+        unknown = [bmk for bmk in benchmarks if bmk not in self.durations]
+        known = sorted([bmk for bmk in benchmarks if bmk in self.durations],
+                       key=lambda bmk: self.durations[bmk], reverse=True)
+        return unknown + known
+
+    def _summary_paths(self, benchmark):
+        """Return the summary file of each run of a benchmark, by run number"""
+        bench_conf = self.confobj['benchmarks'][benchmark]
         if 'results_file' in bench_conf:
             benchmark_summary = bench_conf['results_file']
         else:
             benchmark_summary = benchmark + '_summary.json'
 
-        gpaths = sorted(glob.glob(self.resultsdir + "/" + benchmark + "/run*/" + benchmark_summary))
-        logger.debug("Looking for results in %s", gpaths)
-        i = -1
-        for gpath in gpaths:
-            i += 1
-            logger.debug("Opening file %s", gpath)
+        gpaths = {}
+        for gpath in glob.glob(self.resultsdir + "/" + benchmark + "/run*/" + benchmark_summary):
+            run_num = os.path.basename(os.path.dirname(gpath))[len('run'):]
+            if run_num.isdigit():
+                gpaths[int(run_num)] = gpath
+        return dict(sorted(gpaths.items()))
 
-            try:
-                with open(gpath, mode='r') as jfile:
-                    lines = jfile.read()
-                    jscore = json.loads(lines)
-            except OSError:
-                logger.error("Failure reading from %s", gpath)
-                continue
-            except json.JSONDecodeError as loc:
-                logger.error("Malformed JSON: %s", loc.msg)
-                continue
+    def _read_summary(self, gpath):
+        """Read the summary JSON of a run
 
-            json_required_keys = ['app', 'run_info', 'report']
-            key_issue = False
-            for k in json_required_keys:
-                kstr = k
-                if k not in jscore.keys():
-                    key_issue = True
-                elif k == 'report':
-                    if (not isinstance(jscore[k], dict)) or self.scorekey not in jscore[k].keys():
-                        key_issue = True
-                        kstr = k + '[' + self.scorekey + ']'
-                if key_issue:
-                    logger.error("Required key '%s' not in JSON!", kstr)
+        Args:
+            gpath (str): path of the summary file
 
+        Returns:
+            dict: summary, or None if it cannot be read or lacks required keys
+        """
+        logger.debug("Opening file %s", gpath)
+
+        try:
+            with open(gpath, mode='r') as jfile:
+                lines = jfile.read()
+                jscore = json.loads(lines)
+        except OSError:
+            logger.error("Failure reading from %s", gpath)
+            return None
+        except json.JSONDecodeError as loc:
+            logger.error("Malformed JSON: %s", loc.msg)
+            return None
+
+        json_required_keys = ['app', 'run_info', 'report']
+        key_issue = False
+        for k in json_required_keys:
+            kstr = k
+            if k not in jscore.keys():
+                key_issue = True
+            elif k == 'report':
+                if (not isinstance(jscore[k], dict)) or self.scorekey not in jscore[k].keys():
+                    key_issue = True
+                    kstr = k + '[' + self.scorekey + ']'
             if key_issue:
+                logger.error("Required key '%s' not in JSON!", kstr)
+
+        if key_issue:
+            return None
+        return jscore
+
+    def _run_score(self, benchmark, jscore, runstr):
+        """Score of one run of a benchmark
+
+        Args:
+            benchmark (str): benchmark name
+            jscore (dict): summary of the run, see `_read_summary`
+            runstr (str): run name, for logging
+
+        Returns:
+            float: geometric mean of the sub-scores relative to the reference
+            scores, or None if a sub-score is not reported
+        """
+        bench_conf = self.confobj['benchmarks'][benchmark]
+        sub_results = []
+        for sub_bmk in bench_conf['ref_scores'].keys():
+            if sub_bmk not in jscore['report'][self.scorekey]:
+                logger.error("Sub-score not reported for %s in %s!",
+                             sub_bmk, runstr)
+                return None
+            sub_results.append(float(jscore['report'][self.scorekey][sub_bmk]))
+
+        from hepscore import stats
+        return float(stats.workload_scores(sub_results, list(bench_conf['ref_scores'].values())))
+
+    def _adaptive_repetitions(self):
+        """Minimum and maximum number of runs, and target relative spread
+
+        Adaptive repetitions are enabled by setting `max_repetitions`; the
+        minimum is then `repetitions`.
+
+        Returns:
+            3-tuple (int, int, float): or None if repetitions are fixed
+        """
+        settings = self.confobj['settings']
+        if 'max_repetitions' not in settings:
+            return None
+        minimum = int(settings['repetitions'])
+        return (minimum, max(minimum, int(settings['max_repetitions'])),
+                float(settings.get('target_spread', TARGET_SPREAD)))
+
+    def _more_runs(self, benchmark, runs, adaptive):
+        """Number of runs needed for the scores of a benchmark to converge
+
+        Args:
+            benchmark (str): benchmark name
+            runs (int): number of runs currently planned
+            adaptive (tuple): see `_adaptive_repetitions`
+
+        Returns:
+            int: runs, plus one if the scores so far spread more than the target
+        """
+        scores = []
+        for i, gpath in self._summary_paths(benchmark).items():
+            jscore = self._read_summary(gpath)
+            if jscore is not None:
+                score = self._run_score(benchmark, jscore, 'run' + str(i))
+                if score is not None:
+                    scores.append(score)
+
+        from hepscore import stats
+        spread = float(stats.relative_spread(scores))
+        if len(scores) < runs or len(scores) >= adaptive[1] or spread <= adaptive[2]:
+            return runs
+        logger.info("%s: scores spread by %.2f%% (target %.2f%%), adding a run",
+                    benchmark, 100 * spread, 100 * adaptive[2])
+        return len(scores) + 1
+
+    def _explain_outliers(self, benchmark, results):
+        """Summarise the CPU state of the runs of a benchmark, and flag low scores
+
+        Args:
+            benchmark (str): benchmark name
+            results (dict): run number -> score
+        """
+        bench_conf = self.confobj['benchmarks'][benchmark]
+        states = {'run' + str(i): bench_conf.get('run' + str(i), {}).get('cpu_state')
+                  for i in results}
+        summary = cpustate.workload_summary(states)
+        if summary:
+            bench_conf['cpu_state'] = summary
+
+        outliers = cpustate.explain_outliers({'run' + str(i): score
+                                              for i, score in results.items()}, states)
+        for runstr, outlier in outliers.items():
+            logger.warning("%s: %s scored %.1f%% below the median (%s)", benchmark, runstr,
+                           100 * outlier['deficit'],
+                           ', '.join(outlier['causes']) or "not explained by the CPU state")
+        if outliers:
+            bench_conf['outliers'] = outliers
+
+    def _proc_results(self, benchmark):
+        """Process benchmark results"""
+
+        results = {}
+        bench_conf = self.confobj['benchmarks'][benchmark]
+        runs = int(self.confobj['settings']['repetitions'])
+
+        gpaths = self._summary_paths(benchmark)
+        logger.debug("Looking for results in %s", list(gpaths.values()))
+        for i, gpath in gpaths.items():
+            jscore = self._read_summary(gpath)
+            if jscore is None:
                 continue
 
             runstr = 'run' + str(i)
@@ -417,38 +726,44 @@ class HEPscore():
                 bench_conf[runstr] = {}
             bench_conf[runstr]['report'] = jscore['report']
 
-            if i == 0:
+            if 'app' not in bench_conf:
                 bench_conf['app'] = jscore['app']
                 bench_conf['run_info'] = jscore['run_info']
 
-            sub_results = []
-            for sub_bmk in bench_conf['ref_scores'].keys():
-                if sub_bmk not in jscore['report'][self.scorekey]:
-                    logger.error("Sub-score not reported for %s in %s!",
-                                 sub_bmk, runstr)
-                    key_issue = True
-                    continue
-                sub_score = float(jscore['report'][self.scorekey][sub_bmk])
-                sub_score = sub_score / bench_conf['ref_scores'][sub_bmk]
-                sub_score = round(sub_score, 4)
-                sub_results.append(sub_score)
-
-            if key_issue:
+            score = self._run_score(benchmark, jscore, runstr)
+            if score is None:
                 continue
 
-            score = weighted_geometric_mean(sub_results)
-
-            results[i] = round(score, 4)
+            results[i] = score
             logger.debug(results[i])
             scoresData.append(results[i])
         if len(results) == 0:
             logger.warning("No results: fail")
             return -1
 
-        if len(results) != runs:
+        adaptive = self._adaptive_repetitions()
+        if adaptive is not None:
+            if not adaptive[0] <= len(results) <= adaptive[1]:
+                logger.error("Expected %d to %d scores, got %d!",
+                             adaptive[0], adaptive[1], len(results))
+                return -1
+            from hepscore import stats
+            summary = stats.summarize(list(results.values()), seed=CI_SEED)
+            spread = float(summary['spread'])
+            bench_conf['stats'] = {'runs': len(results),
+                                   'spread': round(spread, 4),
+                                   'mad': round(float(summary['mad']), 4),
+                                   'converged': spread <= adaptive[2],
+                                   'ci95': [round(float(bound), 4) for bound in summary['ci']]}
+            if spread > adaptive[2]:
+                logger.warning("%s: scores still spread by %.2f%% after %d runs",
+                               benchmark, 100 * spread, len(results))
+        elif len(results) != runs:
             logger.error("Expected %d scores, got %d!", runs, len(results))
             return -1
 
+        self._explain_outliers(benchmark, results)
+
         final_result, final_run = median_tuple(results)
 
         # Insert wl-score from chosen run
@@ -479,6 +794,257 @@ class HEPscore():
 
         return final_result
 
+    def _image_registry(self, benchmark):
+        """Return the registry of a benchmark, allowing per-benchmark overrides"""
+        bench_conf = self.confobj['benchmarks'][benchmark]
+        if 'registry' in bench_conf.keys():
+            return self._drop_uri(bench_conf['registry'])
+        return self.registry
+
+    def _image_version(self, benchmark):
+        """Return the image tag of a benchmark, with architecture if requested"""
+        bcver = self.confobj['benchmarks'][benchmark]['version']
+        if self.addarch and self.cec == "singularity" and \
+                self._image_registry(benchmark).find("docker://") != 0:
+            bcver = bcver + "_" + self.confobj['environment']['arch']
+        return bcver
+
+    def _image_name(self, benchmark):
+        """Return the full image reference of a benchmark"""
+        return self._image_registry(benchmark) + '/' + benchmark + ':' + \
+            self._image_version(benchmark)
+
+    def _image_target(self, benchmark):
+        """Path of the SIF file of benchmark in the results directory"""
+        return os.path.join(self.resultsdir, 'images',
+                            benchmark + '_' + self._image_version(benchmark) + '.sif')
+
+    def _pull_image(self, benchmark):
+        """Pull (or build) the image of a benchmark ahead of its execution
+
+        Singularity images are pulled to a SIF file in the results directory,
+        Docker images into the local image store.  Local (dir) registries are
+        used in place, images of tar registries are taken from the archive.
+
+        Args:
+            benchmark (str): benchmark name
+
+        Returns:
+            2-tuple (str, dict): image reference to run, pull timing
+        """
+        image = self._image_name(benchmark)
+        pull_info = {}
+
+        if self.cec == 'singularity':
+            if image.find('tar://') == 0:
+                return self._archive_image(benchmark, image)
+            if image.find('://') < 0:
+                logger.debug("Not prefetching local image %s", image)
+                return image, pull_info
+            if self._image_cache is not None:
+                return self._cached_image(benchmark, image)
+            target = self._image_target(benchmark)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            command = ['singularity', 'pull']
+            if self.clean:
+                # the shared cache may be removed by _container_rm during the pull
+                command.append('--disable-cache')
+            command.extend([target, image])
+        else:
+            target = image
+            command = ['docker', 'pull', image]
+
+        logger.debug("Prefetching %s", command)
+        starttime = time.time()
+        try:
+            pullf = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   check=False)
+        except (subprocess.SubprocessError, OSError):
+            logger.warning("Failed to prefetch %s, it will be pulled at run time", image)
+            return image, pull_info
+        endtime = time.time()
+
+        if pullf.returncode != 0:
+            logger.warning("Failed to prefetch %s, it will be pulled at run time", image)
+            logger.debug(pullf.stdout.decode('utf-8', errors='replace'))
+            return image, pull_info
+
+        pull_info = {'start_at': time.ctime(starttime),
+                     'end_at': time.ctime(endtime),
+                     'duration': round(endtime - starttime, 3)}
+        logger.info("Prefetched %s in %.1fs", image, endtime - starttime)
+        return target, pull_info
+
+    def _traced_pull(self, benchmark, phase='pull'):
+        """`_pull_image`, timed as a pull (or prefetch) phase"""
+        with self.tracer.span(benchmark, phase) as args:
+            image, pull_info = self._pull_image(benchmark)
+            args.update({key: pull_info[key] for key in ('cache', 'method') if key in pull_info})
+        return image, pull_info
+
+    def _archive_image(self, benchmark, image):
+        """Expose the SIF of benchmark from a tar archive of images
+
+        A tar registry is the path of an uncompressed image archive, such as
+        those made by archive_images.py; the image is never extracted from
+        it, see `sifarchive`.
+
+        Args:
+            benchmark (str): benchmark name
+            image (str): tar://ARCHIVE/NAME:VERSION image reference
+
+        Returns:
+            2-tuple (str, dict): image to run (None if it cannot be read from
+            the archive), exposure timing and method
+        """
+        import tarfile
+        from hepscore import sifarchive
+
+        archive, name = image[len('tar://'):].rsplit('/', 1)
+        target = self._image_target(benchmark)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        starttime = time.time()
+        try:
+            method = sifarchive.expose(archive, name, target)
+        except (OSError, KeyError, tarfile.TarError) as err:
+            logger.error("Failed to read %s from image archive %s: %s", name, archive, err)
+            # the tar:// reference itself cannot be run
+            return None, {}
+        endtime = time.time()
+
+        logger.info("Image %s from %s (%s) in %.1fs", name, archive, method,
+                    endtime - starttime)
+        return target, {'start_at': time.ctime(starttime),
+                        'end_at': time.ctime(endtime),
+                        'duration': round(endtime - starttime, 3),
+                        'archive': archive,
+                        'method': method}
+
+    def _image_key(self, benchmark):
+        """Key of the image of benchmark in the image cache"""
+        from hepscore import imagecache
+        return imagecache.image_key(self._image_name(benchmark),
+                                    self.confobj['environment']['arch'])
+
+    def _cached_image(self, benchmark, image):
+        """Get the SIF of benchmark from the image cache, pulling it on a miss
+
+        Args:
+            benchmark (str): benchmark name
+            image (str): image reference
+
+        Returns:
+            2-tuple (str, dict): image to run, pull timing and cache outcome
+        """
+        def pull(target):
+            # the image cache replaces the singularity cache
+            command = ['singularity', 'pull', '--disable-cache', target, image]
+            logger.debug("Pulling %s", command)
+            try:
+                pullf = subprocess.run(command, stdout=subprocess.PIPE,
+                                       stderr=subprocess.STDOUT, check=False)
+            except (subprocess.SubprocessError, OSError):
+                return False
+            if pullf.returncode != 0:
+                logger.debug(pullf.stdout.decode('utf-8', errors='replace'))
+            return pullf.returncode == 0
+
+        starttime = time.time()
+        try:
+            path, hit = self._image_cache.get(self._image_key(benchmark), pull)
+        except OSError as err:
+            logger.warning("Image cache failure for %s: %s", image, err)
+            path, hit = None, False
+        endtime = time.time()
+        if path is None:
+            logger.warning("Failed to pull %s to the image cache, it will be pulled at run time",
+                           image)
+            return image, {}
+
+        logger.info("Image %s: cache %s, %.1fs", image, 'hit' if hit else 'miss',
+                    endtime - starttime)
+        return path, {'start_at': time.ctime(starttime),
+                      'end_at': time.ctime(endtime),
+                      'duration': round(endtime - starttime, 3),
+                      'cache': 'hit' if hit else 'miss',
+                      'digest': os.path.basename(path)[:-len('.sif')]}
+
+    def _start_prefetch(self, order):
+        """Start pulling images in the background, in execution order"""
+        self._prefetch_pool = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._prefetch_lock = threading.Lock()
+        self._prefetch_queue = list(order)
+        self._prefetch_futures = {}
+        self._prefetch_next()
+
+    def _prefetch_next(self, benchmark=None):
+        """Queue the pull of benchmark, or of the next image in execution order"""
+        with self._prefetch_lock:
+            if benchmark is None:
+                if not self._prefetch_queue:
+                    return
+                benchmark = self._prefetch_queue[0]
+            if benchmark in self._prefetch_queue:
+                self._prefetch_queue.remove(benchmark)
+                self._prefetch_futures[benchmark] = \
+                    self._prefetch_pool.submit(self._traced_pull, benchmark, 'prefetch')
+
+    def _stop_prefetch(self):
+        """Wait for outstanding pulls and drop unused prefetched images"""
+        if self._prefetch_pool is not None:
+            self._prefetch_pool.shutdown(wait=True)
+            for benchmark in list(self._prefetch_futures):
+                self._release_image(benchmark)
+            self._prefetch_pool = None
+        try:
+            os.rmdir(os.path.join(self.resultsdir, 'images'))
+        except OSError:
+            pass
+
+    def _fetch_image(self, benchmark):
+        """Return the image to run for benchmark
+
+        When prefetching, waits for the image pull to complete and starts
+        pulling the image needed next.
+
+        Returns:
+            str: image reference, or None if no image can be run
+        """
+        if self._prefetch_pool is None:
+            if self._image_cache is None and \
+                    self._image_registry(benchmark).find('tar://') != 0:
+                return self._image_name(benchmark)
+            image, pull_info = self._traced_pull(benchmark)
+            if pull_info:
+                self.confobj['benchmarks'][benchmark]['image_pull'] = pull_info
+            return image
+
+        self._prefetch_next(benchmark)
+        self._prefetch_next()
+        with self.tracer.span(benchmark, 'pull_wait'):
+            image, pull_info = self._prefetch_futures[benchmark].result()
+        if pull_info:
+            self.confobj['benchmarks'][benchmark]['image_pull'] = pull_info
+        return image
+
+    def _release_image(self, benchmark):
+        """Delete the prefetched or archived SIF of benchmark once its runs are done"""
+        if self._image_cache is not None:
+            self._image_cache.release(self._image_key(benchmark))
+        if self._prefetch_pool is not None and benchmark in self._prefetch_futures:
+            image, _ = self._prefetch_futures.pop(benchmark).result()
+        elif self._image_registry(benchmark).find('tar://') == 0:
+            image = self._image_target(benchmark)
+        else:
+            return
+        if image and image.endswith('.sif') and os.path.exists(image) and \
+                image.find(os.path.join(self.resultsdir, 'images') + '/') == 0:
+            logger.debug("Removing prefetched image %s", image)
+            try:
+                os.remove(image)
+            except OSError:
+                logger.warning("Failed to remove prefetched image %s", image)
+
     def _container_rm(self, image):
         """Remove container image"""
         if self.clean is False:
@@ -510,29 +1076,23 @@ class HEPscore():
 
         return True
 
+    def _engine(self):
+        """Capabilities of the container engine, probed once per session
+
+        Returns:
+            dict: see `hepscore.engine.probe`
+        """
+        if self.engine_caps is None:
+            self.engine_caps = engine.probe(self.cec)
+        return self.engine_caps
+
     def check_userns(self):
         """Checks for user namespace support for Singularity.
 
         Returns:
             bool: singularity namespace support
         """
-        proc_muns = "/proc/sys/user/max_user_namespaces"
-        dockerenv = "/.dockerenv"
-        podmanenv = "/run/.containerenv"
-
-        if os.path.isfile(dockerenv) or os.path.isfile(podmanenv):
-            logger.debug("%s running inside of Docker. Not enabling user namespaces.",
-                         self.__class__)
-            return False
-
-        try:
-            with open(proc_muns, mode='r') as userns_file:
-                max_usrns = int(userns_file.read())
-            return bool(max_usrns)
-        except OSError:
-            logger.debug("Cannot open/read from %s, assuming user namespace support disabled",
-                         proc_muns)
-            return False
+        return self._engine()['userns']
 
     def _get_usernamespace_flag(self):
         """User namespace flag needed to support nested singularity"""
@@ -544,14 +1104,7 @@ class HEPscore():
 
     def check_unsquash(self):
         """Check if --unsquash is supported"""
-        if self.cec != "docker" and 'apptainer_version' in self.confobj['environment']:
-            hcmd = "singularity run --help".split()
-            hout = subprocess.Popen(hcmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            for line in hout.stdout.readlines():
-                if '--unsquash' in line.decode('utf-8'):
-                    return True
-
-            return False
+        return self._engine()['unsquash']
 
     def _get_unsquash_flag(self):
         """If we're running in apptainer that supports it, pass --unsquash"""
@@ -567,45 +1120,35 @@ class HEPscore():
         Returns:
             str: Version as reported by containment (eg `singularity --version`)
         """
-        commands = {'docker': "docker --version",
-                    'singularity': "singularity --version"}
-        command = commands[self.cec].split(' ')
+        caps = self._engine()
+        return [caps['engine'], caps['version']]
 
-        try:
-            cmdf = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            engimpl = self.cec
-            for line in cmdf.stdout.readlines():
-                dline = line.decode('utf-8')
-                dline_ver = re.sub(r'^[^0-9]*', '', dline)
-                if len(dline_ver) > 0 and dline_ver[0].isdigit():
-                    if self.cec == 'singularity':
-                        if 'apptainer' in dline:
-                            engimpl = 'apptainer'
-                    elif self.cec == 'docker':
-                        helpout = subprocess.Popen(['docker', '--help'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-                        for hline in helpout.stdout.readlines():
-                            if 'podman' in hline.decode('utf-8'):
-                                engimpl = 'podman'
-                                break
-                    return [engimpl, str(dline_ver.strip('\n'))]
+    def _run_benchmark(self, benchmark, mock, times, cpuset=None, mems=None):
+        """Run a benchark from the configuration
 
-        except subprocess.SubprocessError:
-            logger.error("Error fetching %s version", self.cec)
-        except OSError:
-            logger.error("Could not locate %s on the system. Please check your path!", self.cec)
-        return ['unknown', '0.0']
+        Args:
+            benchmark (str): benchmark name
+            mock (bool): replay prior results instead of running containers
+            times (dict): start/end time of each run, updated in place
+            cpuset (list[int], optional): pin the container to these CPUs
+                                          and load only as many cores
+            mems (list[int], optional): bind the memory of the container
+                                        to these NUMA nodes
+        """
+        if benchmark in self.checkpoint.get('workloads', {}):
+            # completed before the run was resumed
+            return self.checkpoint['workloads'][benchmark]['score']
 
-    def _run_benchmark(self, benchmark, mock, times):
-        """Run a benchark from the configuration"""
+        bench_start = self.tracer.now()
         bench_conf = self.confobj['benchmarks'][benchmark]
         # Arguments of each workload that are ignored
         bad_args = [ "resultsdir",  "--resultsdir", "-w", "-W"]
         options_string = " -W"
-        output_logs = []
         bmark_keys = ''
-        bmark_registry = self.registry
         result = 0
         gpu_flag = ""
+        pin_flag = ""
+        pin_prefix = ""
         cmdf = None
 
         runs = int(self.confobj['settings']['repetitions'])
@@ -615,23 +1158,32 @@ class HEPscore():
             retries = int(self.confobj['settings']['retries'])
         else:
             retries = 0
-        successful_runs = 0
         retry_count = 0
+        done = self._resume_runs(benchmark) if self.resume and not mock else []
+        if done:
+            self.resumed.add(benchmark)
+        successful_runs = len(done)
+        adaptive = self._adaptive_repetitions()
+        max_runs = adaptive[1] if adaptive is not None else runs
+        # run numbers still to use, skipping those completed before resuming
+        attempts = [i for i in range(max_runs + retries + len(done)) if i not in done]
+        attempts = attempts[:max(max_runs - len(done), 0) + retries]
 
-        # Allow registry overrides in the benchmark configuration
         if 'registry' in bench_conf.keys():
-            bmark_registry = self._drop_uri(bench_conf['registry'])
             logger.info("Overriding registry for this container: %s", bench_conf['registry'])
 
-        bcver = bench_conf['version']
-        if self.addarch and self.cec == "singularity" and \
-                bmark_registry.find("docker://") != 0:
-            bcver = bcver + "_" + self.confobj['environment']['arch']
+        bcver = self._image_version(benchmark)
 
-        tmp = "Executing " + str(runs) + " run"
-        if runs > 1:
+        tmp = "Executing " + str(max(runs - len(done), 0)) + " run"
+        if adaptive is not None:
+            tmp = "Executing " + str(max(runs - len(done), 0)) + " to " + \
+                str(max(max_runs - len(done), 0)) + " run"
+        if max_runs - len(done) > 1:
             tmp += 's'
         logger.info("%s of %s", tmp, benchmark + " [" + bcver + "]")
+        if done:
+            logger.info("Resuming: runs %s of %s already completed",
+                        ', '.join(str(i) for i in done), benchmark)
 
         if 'args' in bench_conf.keys():
             bmark_keys = bench_conf['args'].keys()
@@ -647,7 +1199,23 @@ class HEPscore():
             else:
                 gpu_flag = "--gpus all "
 
-        if self.ncores != 0:
+        if cpuset is not None:
+            logger.info("Pinning %s to cores %s", benchmark, cpuset_str(cpuset))
+            options_string += " --ncores %s" % len(cpuset)
+            bad_args.extend(["ncores", "--ncores", "-n"])
+            if mems is not None:
+                logger.info("Binding the memory of %s to NUMA nodes %s",
+                            benchmark, cpuset_str(mems))
+            if self.cec == 'docker':
+                pin_flag = "--cpuset-cpus=" + cpuset_str(cpuset) + " "
+                if mems is not None:
+                    pin_flag += "--cpuset-mems=" + cpuset_str(mems) + " "
+            elif mems is not None and self.numactl:
+                pin_prefix = self.numactl + " --physcpubind=" + cpuset_str(cpuset) + \
+                    " --membind=" + cpuset_str(mems) + " "
+            else:
+                pin_prefix = "taskset -c " + cpuset_str(cpuset) + " "
+        elif self.ncores != 0:
             logger.info("Enforcing run of each workload on only %s cores", self.ncores)
             options_string += " --ncores %s" % self.ncores
             bad_args.extend(["ncores", "--ncores", "-n"])
@@ -670,30 +1238,48 @@ class HEPscore():
                     options_string = options_string + ' ' + option_arg
 
         try:
-            lfile = open(log, mode='a')
+            lfile = open(log, mode='ab', buffering=0)
         except OSError:
             logger.error("failure to open %s", log)
             return -1
 
-        benchmark_name = bmark_registry + '/' + benchmark + ':' + bcver
-        benchmark_complete = benchmark_name + options_string
+        with self.tracer.span(benchmark, 'resolve'):
+            benchmark_name = self._image_name(benchmark)
+        if mock:
+            benchmark_complete = benchmark_name + options_string
+        else:
+            image = self._fetch_image(benchmark)
+            if image is None:
+                logger.error("No image to run %s", benchmark)
+                lfile.close()
+                self._release_image(benchmark)
+                return -1
+            benchmark_complete = image + options_string
         self.confobj['settings']['replay'] = mock
 
         if self.cec == 'singularity' and self.scache != "":
             logger.debug("Creating singularity cache %s", self.scache)
             try:
-                os.makedirs(self.scache)
+                os.makedirs(self.scache, exist_ok=True)
                 os.environ['SINGULARITY_CACHEDIR'] = os.environ['APPTAINER_CACHEDIR'] = self.scache
             except OSError:
                 logger.error("Failed to create Singularity cache dir %s", self.scache)
                 sys.exit(1)
 
-        for i in range(runs + retries):
-            if successful_runs == runs:
+        for i in attempts:
+            if adaptive is not None and successful_runs >= runs:
+                runs = self._more_runs(benchmark, runs, adaptive)
+            if successful_runs >= runs:
                 break
 
             run_dir = self.resultsdir + "/" + benchmark + "/run" + str(i)
             log_filepath = run_dir + "/" + self.cec + "_logs"
+            cid_flag = ""
+            if self.telemetry_interval > 0 and self.cec == 'docker' and not mock:
+                # the sampler finds the cgroup of the container through its id
+                cid_flag = "--cidfile " + run_dir + ".cid "
+                if os.path.exists(run_dir + ".cid"):
+                    os.remove(run_dir + ".cid")
 
             if self.confobj['settings']['replay'] is False:
                 os.makedirs(run_dir)
@@ -701,10 +1287,10 @@ class HEPscore():
                     os.chmod(run_dir, stat.S_ISVTX | stat.S_IRWXU |
                              stat.S_IRWXG | stat.S_IRWXO)
 
-            commands = {'docker': "docker run --rm --network=host -v " + run_dir
+            commands = {'docker': "docker run --rm --network=host " + cid_flag + "-v " + run_dir
                                   + ":/results -v " + self.tmpdir + ":/tmp -v " + self.tmpdir
-                                  + ":/var/tmp " + gpu_flag,
-                        'singularity': "singularity run -i -c -e -B " + run_dir
+                                  + ":/var/tmp " + gpu_flag + pin_flag,
+                        'singularity': pin_prefix + "singularity run -i -c -e -B " + run_dir
                                        + ":/results -B " + self.tmpdir + ":/tmp -B "
                                        + self.tmpdir + ":/var/tmp "
                                        + self._get_unsquash_flag()
@@ -720,11 +1306,16 @@ class HEPscore():
 
             bench_conf[runstr] = {}
             starttime = time.time()
+            mono_start = time.monotonic()
             times[benchmark+runstr+"start"] = starttime
             bench_conf[runstr]['start_at'] = time.ctime(starttime)
-            
+            if cpuset is not None:
+                bench_conf[runstr]['cpuset'] = cpuset_str(cpuset)
+            if mems is not None:
+                bench_conf[runstr]['mems'] = cpuset_str(mems)
 
             if not mock:
+                spawn = self.tracer.now()
                 try:
                     cmdf = subprocess.Popen(command, stdout=subprocess.PIPE,
                                             stderr=subprocess.STDOUT)
@@ -743,21 +1334,51 @@ class HEPscore():
                     logger.error("Retrying...")
                     continue
 
-                line = cmdf.stdout.readline()
-                while line:
-                    try:
-                        decoded_line = line.decode('utf-8')
-                    except UnicodeEncodeError:
-                        # Ignore decode errors, for example from special characters
-                        pass
-                    output_logs.insert(0, decoded_line)
-                    lfile.write(decoded_line)
-                    lfile.flush()
-                    line = cmdf.stdout.readline()
-                    if line[-25:] == "no space left on device.\n":
-                        logger.error("Docker: No space left on device.")
+                sampler = None
+                state_sampler = None
+                if self.telemetry_interval > 0:
+                    from hepscore import telemetry
+                    sampler = telemetry.RunSampler(run_dir + TELEMETRY_SERIES,
+                                                   self.telemetry_interval,
+                                                   pid=cmdf.pid if self.cec == 'singularity' else None,
+                                                   cidfile=run_dir + ".cid" if cid_flag else None,
+                                                   engine=self._engine()['binary'] or self.cec)
+                    sampler.start()
+                    state_sampler = cpustate.StateSampler(run_dir + CPUSTATE_SERIES,
+                                                          self.telemetry_interval, cpus=cpuset)
+                    state_sampler.start()
+
+                try:
+                    run_log = open(log_filepath, mode='wb', buffering=LOG_BUFFER)
+                except OSError:
+                    logger.warning("Failed to write logs to file!")
+                    run_log = None
+
+                output_tail = collections.deque(maxlen=LOG_TAIL)
+                first_output = []
+                if tee_output(cmdf.stdout, lfile, run_log, output_tail,
+                              lambda: first_output.append(self.tracer.now())):
+                    logger.error("%s: No space left on device.", self.cec)
 
                 cmdf.wait()
+                exited = self.tracer.now()
+                started = first_output[0] if first_output else exited
+                self.tracer.add(benchmark, 'container_start', spawn, started, run=runstr)
+                self.tracer.add(benchmark, 'workload', started, exited, run=runstr)
+                bench_conf[runstr]['phases'] = {'container_start': round((started - spawn) / 1e9, 3),
+                                                'workload': round((exited - started) / 1e9, 3)}
+                if run_log is not None:
+                    run_log.close()
+                if sampler is not None:
+                    usage = sampler.stop()
+                    if usage:
+                        bench_conf[runstr]['telemetry'] = usage
+                    if cid_flag and os.path.exists(run_dir + ".cid"):
+                        os.remove(run_dir + ".cid")
+                if state_sampler is not None:
+                    state = state_sampler.stop()
+                    if state:
+                        bench_conf[runstr]['cpu_state'] = state
 
                 if self.cec == 'docker':
                     os.chmod(run_dir, stat.S_IRWXU | stat.S_IRGRP |
@@ -766,26 +1387,20 @@ class HEPscore():
                 self._check_return_code(cmdf.returncode)
                 if cmdf.returncode > 0:
                     logger.error("%s output logs:", self.cec)
-                    for line in list(reversed(output_logs))[-100:]:
-                        logger.error(line.strip('\n'))
+                    for line in output_tail:
+                        logger.error(line.decode('utf-8', errors='replace').rstrip('\n'))
                 else:
                     successful_runs += 1
 
-                try:
-                    with open(log_filepath, 'w') as log_file:
-                        for line in reversed(output_logs):
-                            log_file.write('%s' % line)
-                except OSError:
-                    logger.warning("Failed to write logs to file!")
-
             else:
-                time.sleep(1)
                 successful_runs += 1
 
             endtime = time.time()
+            mono_end = time.monotonic()
             bench_conf[runstr]['end_at'] = time.ctime(endtime)
-            bench_conf[runstr]['duration'] = math.floor(endtime) - math.floor(starttime)
+            bench_conf[runstr]['duration'] = round(mono_end - mono_start, 3)
             times[benchmark+runstr+"end"] = endtime
+            self.run_windows.setdefault(benchmark, {})[runstr] = (mono_start, mono_end)
             if not mock and cmdf.returncode != 0:
                 logger.error("running %s failed.  Exit status %s", benchmark, cmdf.returncode)
 
@@ -796,10 +1411,20 @@ class HEPscore():
                 logger.warning("Retrying...")
 
         lfile.close()
-        self._container_rm(benchmark_name)
+        with self.tracer.span(benchmark, 'cleanup'):
+            self._release_image(benchmark)
+            if self.packed > 1:
+                # Other workloads may still be using the shared image cache
+                self._deferred_rm.append(benchmark_name)
+            else:
+                self._container_rm(benchmark_name)
         logger.info("")
 
-        proc_result = self._proc_results(benchmark)
+        with self.tracer.span(benchmark, 'results'):
+            proc_result = self._proc_results(benchmark)
+        if result != -1 and proc_result >= 0 and not mock:
+            self._save_checkpoint(benchmark, proc_result)
+        self.tracer.add(benchmark, 'benchmark', bench_start, self.tracer.now())
         return proc_result if result != -1 else result
 
     def _check_return_code(self, return_code):
@@ -810,6 +1435,57 @@ class HEPscore():
         else:
             logger.debug("%s terminated without errors", self.cec)
 
+    def _energy_report(self, score):
+        """Add energy consumed by each run, workload and the whole run to confobj
+
+        Runs that overlapped in time (packed workloads) are marked as
+        unavailable, see `energy.energy_report`.  Power was not sampled
+        before a run was resumed, so the energy of the whole run and of the
+        workloads with runs from before the resume are left out.
+
+        Args:
+            score (float): final score of the run
+        """
+        from hepscore import energy
+        workloads, total = energy.energy_report(self.power, self.run_windows,
+                                                self.bench_scores, self.run_window, score)
+        if any(wl_energy['total'] == energy.CONCURRENT for wl_energy in workloads.values()):
+            logger.info("Workloads ran concurrently: energy is only reported for the whole run")
+        for benchmark, wl_energy in workloads.items():
+            bench_conf = self.confobj['benchmarks'][benchmark]
+            for runstr, run_energy in wl_energy['runs'].items():
+                if run_energy and runstr in bench_conf:
+                    bench_conf[runstr]['energy'] = run_energy
+            if wl_energy['total'] and benchmark not in self.resumed:
+                bench_conf['energy'] = wl_energy['total']
+        if self.resumed:
+            logger.warning("Resumed run: no energy reported for the whole run, nor for %s, "
+                           "as power was not sampled before the resume",
+                           ', '.join(sorted(self.resumed)))
+        elif total:
+            self.confobj['energy'] = total
+            logger.info("Energy: %s J, mean power %s W", total['joules'], total['mean_watts'])
+        else:
+            logger.warning("Not enough power samples to compute the energy of the run")
+
+    def _power_series(self):
+        """Name of the power series file, not overwriting one of a resumed run"""
+        name = POWER_SERIES
+        base, ext = os.path.splitext(POWER_SERIES)
+        resumed = 0
+        while os.path.exists(os.path.join(self.resultsdir, name)):
+            resumed += 1
+            name = "%s.%d%s" % (base, resumed, ext)
+        return name
+
+    def _write_power_index(self):
+        """Write the timing and scores of the run next to its power samples"""
+        try:
+            with open(os.path.join(self.resultsdir, POWER_INDEX), mode='w') as index:
+                json.dump(self.power_index, index)
+        except OSError as err:
+            logger.warning("Failed to write %s: %s", POWER_INDEX, err)
+
     def gen_score(self):
         """Generates output score into HEPscore.confobj based on method defined in config."""
         method = self.allowed_methods[self.confobj['settings']['method']]
@@ -828,11 +1504,13 @@ class HEPscore():
         else:
             self.confobj['score'] = float(fres)
             self.confobj['status'] = 'success'
-        with open("power.json", "r") as f:
-            powerData = json.load(f)
-        powerData["score"] = [float(fres)]
-        with open("power.json", "w") as f:
-            json.dump(powerData, f)
+
+        if self.power:
+            self._energy_report(self.confobj['score'])
+
+        if self.power_index:
+            self.power_index['score'] = [float(fres)]
+            self._write_power_index()
 
     def write_output(self, outtype, outfile=None):
         """Writes summary results in selected `outtype` to `outfile`
@@ -862,12 +1540,13 @@ class HEPscore():
             raise ValueError("outtype must be 'json' or 'yaml'")
 
         try:
-            jfile = open(outfile, mode='w')
-            if outtype == 'yaml':
-                jfile.write(yaml.safe_dump(outobj, sort_keys=False))
-            else:
-                jfile.write(json.dumps(outobj))
-            jfile.close()
+            with self.tracer.span(os.path.basename(outfile), 'output'):
+                jfile = open(outfile, mode='w')
+                if outtype == 'yaml':
+                    jfile.write(yaml.safe_dump(outobj, sort_keys=False))
+                else:
+                    jfile.write(json.dumps(outobj))
+                jfile.close()
             logger.debug("Output file with detailed results: %s",outfile)
         except OSError:
             logging.error("Failed to create summary output %s", outfile)
@@ -876,10 +1555,34 @@ class HEPscore():
             logging.error("Invalid output object")
             sys.exit(2)
 
+        if self.trace_file:
+            try:
+                self.tracer.write_chrome(self.trace_file)
+                logger.info("Trace of the run phases: %s", self.trace_file)
+            except OSError as err:
+                logger.warning("Failed to write trace %s: %s", self.trace_file, err)
+
+        if self.catalog_db:
+            self._update_catalog(outfile)
+
         if len(self.results) == 0 or self.results[-1] < 0:
             logger.error("Results = %s.", self.results)
             sys.exit(2)
 
+    def _update_catalog(self, outfile):
+        """Record the report written to outfile in the results catalogue"""
+        import sqlite3
+        from hepscore import catalog
+        try:
+            conn = catalog.connect(self.catalog_db)
+            try:
+                catalog.record(conn, self.confobj, self.resultsdir, outfile)
+            finally:
+                conn.close()
+            logger.debug("Recorded results in catalogue %s", self.catalog_db)
+        except (sqlite3.Error, OSError) as err:
+            logger.warning("Failed to record results in catalogue %s: %s", self.catalog_db, err)
+
     def validate_conf(self):
         """Parses constructor configuration dict for valid values
 
@@ -917,12 +1620,22 @@ class HEPscore():
                             logger.error("Configuration: only 'geometric_mean' method is "
                                          "currently supported")
                             sys.exit(1)
-                    if subkey in ('repetitions', 'retries'):
+                    if subkey in ('repetitions', 'max_repetitions', 'retries', 'packed',
+                                  'reserve_cores'):
                         val = self.confobj[key][subkey]
                         if (not isinstance(val, int)) or val < 0:
                             logger.error("Configuration: '%s' configuration parameter must "
                                          "be a positive integer", subkey)
                             sys.exit(1)
+                    if subkey == 'placement' and \
+                            self.confobj[key][subkey] not in topology.POLICIES:
+                        logger.error("Configuration: 'placement' configuration parameter "
+                                     "must be one of %s", ', '.join(topology.POLICIES))
+                        sys.exit(1)
+                    if subkey == 'smt' and self.confobj[key][subkey] not in topology.SMT_MODES:
+                        logger.error("Configuration: 'smt' configuration parameter "
+                                     "must be one of %s", ', '.join(topology.SMT_MODES))
+                        sys.exit(1)
                     if subkey == 'addarch':
                         try:
                             bool(self.confobj[key][subkey])
@@ -930,6 +1643,13 @@ class HEPscore():
                             logger.error("Configuration: 'addarch' configuration parameter "
                                          "must be a bool")
                             sys.exit(1)
+                    if subkey == 'target_spread':
+                        try:
+                            float(self.confobj[key][subkey])
+                        except ValueError:
+                            logger.error("Configuration: 'target_spread' configuration parameter "
+                                         "must be a float")
+                            sys.exit(1)
                     if subkey == 'scaling':
                         try:
                             float(self.confobj[key][subkey])
@@ -998,6 +1718,216 @@ class HEPscore():
 
         return self.confobj
 
+    def _continue_fail(self):
+        """Whether to keep running other benchmarks after a failure"""
+        return self.confobj['settings'].get('continue_fail', False) is not False
+
+    def _save_checkpoint(self, benchmark=None, result=None):
+        """Record a completed benchmark in the checkpoint file of resultsdir
+
+        The configuration, report entries, scores and run times of each
+        completed benchmark are kept, so that an interrupted run can be
+        resumed without running it again.  The file is replaced atomically.
+
+        Args:
+            benchmark (str, optional): completed benchmark
+            result (float, optional): its score
+        """
+        with self._checkpoint_lock:
+            if benchmark is not None:
+                prefix = benchmark + 'run'
+                self.checkpoint['workloads'][benchmark] = {
+                    'score': result,
+                    'conf': self.confobj['benchmarks'][benchmark],
+                    'wl-scores': self.confobj['wl-scores'].get(benchmark, {}),
+                    'times': {k: v for k, v in list(self.bench_time.items())
+                              if k.startswith(prefix)}}
+            path = os.path.join(self.resultsdir, CHECKPOINT)
+            try:
+                with open(path + '.tmp', mode='w') as cfile:
+                    json.dump(self.checkpoint, cfile)
+                os.replace(path + '.tmp', path)
+            except OSError as err:
+                logger.warning("Failed to write checkpoint %s: %s", path, err)
+
+    def _load_checkpoint(self):
+        """Restore the benchmarks completed before a run was interrupted
+
+        Exits if there is no checkpoint in resultsdir, or if it was written
+        for a different configuration.
+        """
+        path = os.path.join(self.resultsdir, CHECKPOINT)
+        try:
+            with open(path, mode='r') as cfile:
+                saved = json.load(cfile)
+        except (OSError, ValueError) as err:
+            logger.error("Cannot resume from %s: %s", path, err)
+            sys.exit(1)
+
+        if saved.get('config_hash') != self.checkpoint['config_hash']:
+            logger.error("Cannot resume: configuration hash %s differs from the one of the "
+                         "interrupted run (%s)", self.checkpoint['config_hash'],
+                         saved.get('config_hash'))
+            sys.exit(1)
+
+        for benchmark, workload in saved['workloads'].items():
+            if benchmark not in self.confobj['benchmarks']:
+                continue
+            logger.info("Resuming: %s already completed with score %s",
+                        benchmark, workload['score'])
+            self.confobj['benchmarks'][benchmark] = workload['conf']
+            self.confobj['wl-scores'][benchmark] = workload['wl-scores']
+            self.bench_time.update(workload['times'])
+            self.checkpoint['workloads'][benchmark] = workload
+            self.resumed.add(benchmark)
+
+    def _resume_runs(self, benchmark):
+        """Find the runs of a benchmark completed before a run was interrupted
+
+        Run directories without a valid summary are renamed to
+        .runN.interrupted so that the run can be repeated.
+
+        Args:
+            benchmark (str): benchmark name
+
+        Returns:
+            list[int]: numbers of the valid runs
+        """
+        bench_dir = os.path.join(self.resultsdir, benchmark)
+        bench_conf = self.confobj['benchmarks'][benchmark]
+        summaries = self._summary_paths(benchmark)
+        done = []
+        for run_dir in sorted(glob.glob(os.path.join(bench_dir, 'run*'))):
+            run_num = os.path.basename(run_dir)[len('run'):]
+            if not run_num.isdigit():
+                continue
+            run_num = int(run_num)
+            jscore = self._read_summary(summaries[run_num]) if run_num in summaries else None
+            if jscore is not None and all(sub_bmk in jscore['report'][self.scorekey]
+                                          for sub_bmk in bench_conf.get('ref_scores', {})):
+                done.append(run_num)
+                continue
+
+            moved = os.path.join(bench_dir, '.run%d.interrupted' % run_num)
+            suffix = 0
+            while os.path.exists(moved):
+                suffix += 1
+                moved = os.path.join(bench_dir, '.run%d.interrupted.%d' % (run_num, suffix))
+            logger.info("Moving incomplete %s to %s", run_dir, moved)
+            os.rename(run_dir, moved)
+
+        return sorted(done)
+
+    def _place_workloads(self):
+        """Split the available cores into one slot per concurrent workload
+
+        Sets `layout` (see `topology.place`) when workloads are packed or a
+        placement policy is selected, and records the topology of the host
+        and the chosen layout in the environment of the report.
+        """
+        topo = topology.read_topology()
+        environment = self.confobj['environment']
+        environment['topology'] = topology.describe(topo)
+        environment['topology']['node_cpus'] = {node: cpuset_str(cpus)
+                                            for node, cpus in topo['nodes'].items()}
+
+        if self.placement == 'none' and self.smt is None and self.reserve_cores == 0 \
+                and self.packed <= 1:
+            return
+        slots = self.packed
+        if slots <= 1:
+            # one workload per NUMA node, or one at a time
+            slots = len(topo['nodes']) if self.placement == 'numa' else 1
+            if slots > 1:
+                self.packed = slots
+        if slots > 1 and self.ncores:
+            logger.warning("Ignoring ncores=%d: with %d workloads at a time, each workload "
+                           "loads the cores of its slot", self.ncores, slots)
+        if self.placement == 'numa' and slots > len(topo['nodes']) and \
+                slots % len(topo['nodes']):
+            logger.info("%d workloads at a time do not divide over %d NUMA nodes: "
+                        "some nodes run one more workload, on fewer cores",
+                        slots, len(topo['nodes']))
+        self.layout = topology.place(topo, slots, self.placement, self.smt,
+                                     self.reserve_cores, self.ncores if slots == 1 else 0)
+        if not self.layout['slots']:
+            logger.error("No cores left to run the workloads on")
+            sys.exit(1)
+
+        if self.cec == 'singularity' and \
+                any(slot['mems'] is not None for slot in self.layout['slots']):
+            self.numactl = shutil.which('numactl')
+            if self.numactl is None:
+                logger.warning("numactl not found: the memory of the workloads will not be "
+                               "bound to their NUMA nodes")
+
+        environment['placement'] = {
+            'policy': self.placement,
+            'smt': self.smt,
+            'reserved': cpuset_str(self.layout['reserved']),
+            'slots': [{'cpus': cpuset_str(slot['cpus']),
+                       'mems': cpuset_str(slot['mems']) if slot['mems'] is not None else None}
+                      for slot in self.layout['slots']]}
+        logger.info("Placement:           %s", ' '.join(
+            slot['cpus'] + ('' if slot['mems'] is None else '@' + slot['mems'])
+            for slot in environment['placement']['slots']))
+
+    def _run_packed(self, mock, times):
+        """Run benchmarks concurrently, each pinned to its own cpuset
+
+        The available cores are split into `packed` disjoint slots (see
+        `layout`) and benchmarks are started longest-first as slots become
+        free.
+
+        Args:
+            mock (bool): replay prior results instead of running containers
+            times (dict): start/end time of each run, updated in place
+
+        Returns:
+            dict: benchmark result, or None if it was never started
+        """
+        slots = self.layout['slots']
+        if len(slots) < self.packed:
+            logger.warning("Only %d cores available: running %d workloads at a time",
+                           len(slots), len(slots))
+        logger.info("Running up to %d workloads concurrently on cores %s",
+                    len(slots), ' '.join(cpuset_str(slot['cpus']) for slot in slots))
+
+        free_slots = queue.Queue()
+        for slot in slots:
+            free_slots.put(slot)
+        abort = threading.Event()
+        self._deferred_rm = []
+
+        def run_pinned(benchmark):
+            if abort.is_set():
+                return None
+            slot = free_slots.get()
+            try:
+                res = self._run_benchmark(benchmark, mock, times, slot['cpus'], slot['mems'])
+            finally:
+                free_slots.put(slot)
+            if res < 0 and not self._continue_fail():
+                abort.set()
+            return res
+
+        order = self._schedule_order(list(self.confobj['benchmarks']))
+        logger.debug("Packed execution order: %s", order)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(slots)) as pool:
+            futures = {bmk: pool.submit(run_pinned, bmk) for bmk in order}
+        results = {bmk: fut.result() for bmk, fut in futures.items()}
+
+        for image in self._deferred_rm:
+            with self.tracer.span(image, 'cleanup'):
+                self._container_rm(image)
+
+        # Keep wl-scores in configuration order, as in a sequential run
+        self.confobj['wl-scores'] = {bmk: self.confobj['wl-scores'][bmk]
+                                     for bmk in self.confobj['benchmarks']
+                                     if bmk in self.confobj['wl-scores']}
+
+        return results
+
     def run(self, mock=False):
         """Run the benchmarks defined in the constructor config dict
 
@@ -1005,12 +1935,19 @@ class HEPscore():
             mock (bool, optional): Skips the run call to the benchmarks, used for testing.
                                    Default: False.
 
+        Power samples taken during the run are stored in `power`, with
+        monotonic timestamps related to wall-clock time by `power_anchor`.
+        The start and end time of each benchmark run are stored in
+        `bench_time`, and on the monotonic clock in `run_windows`.
+        Both are also written to `resultsdir`: the samples as a time series
+        file (see `hepscore.timeseries`), the timing in a JSON index.
+
         Returns:
             int: 0 on success, -1 on error
         """
 
         # check rundir is empty
-        if os.listdir(self.resultsdir) and not mock:
+        if os.listdir(self.resultsdir) and not mock and not self.resume:
             logger.error("Results directory is not empty!")
             sys.exit(1)
 
@@ -1024,23 +1961,27 @@ class HEPscore():
         sysinfo = os.uname()
         sysname = ' '.join(sysinfo)
         starttime = time.time()
+        mono_start = time.monotonic()
         curtime = time.asctime(time.localtime(starttime))
-        power = []
-        benchTime = {}
-        
-    
+        benchTime = self.bench_time
+
         impl,ver = self.get_version()
         exec_ver = impl + "_version"
 
         self.confobj['environment'] = {'system': sysname, 
                                        'arch': sysinfo.machine,
+                                       'cpu_model': cpu_model(),
                                        'start_at': curtime, 
                                        exec_ver: ver,
                                        'available_cores': len(os.sched_getaffinity(0)), # (BMK-1407)  
                                         }
+        cpu_freq = cpustate.describe()
+        if cpu_freq:
+            self.confobj['environment']['cpu_freq'] = cpu_freq
 
         logger.info("%s Benchmark", self.confobj['settings']['name'])
         logger.info("Config Hash:         %s", self.confobj['app_info']['config_hash'])
+        from hepscore import __version__
         logger.info("HEPscore version:    %s", __version__)
         logger.info("System:              %s", sysname)
         logger.info("Container Execution: %s", self.cec)
@@ -1052,6 +1993,13 @@ class HEPscore():
         self.confobj['wl-scores'] = {}
         self.confobj['app_info']['hepscore_ver'] = __version__
 
+        if not mock:
+            self.checkpoint = {'config_hash': self.confobj['app_info']['config_hash'],
+                               'workloads': {}}
+            if self.resume:
+                self._load_checkpoint()
+            self._save_checkpoint()
+
         if mock is True:
             logging.info("NOTE: Replaying prior results")
         else:
@@ -1066,14 +2014,14 @@ class HEPscore():
                 try:
                     self.unpack = self.resultsdir + '/unpack'
                     logger.debug("Creating singularity unpack directory %s", self.unpack)
-                    os.makedirs(self.unpack)
+                    os.makedirs(self.unpack, exist_ok=self.resume)
                     os.environ['SINGULARITY_TMPDIR'] = os.environ['APPTAINER_TMPDIR'] = self.unpack
                 except OSError:
                     logger.error("Failed to create Singularity unpack dir %s", self.unpack)
                     sys.exit(1)
 
             try:
-                os.makedirs(self.tmpdir)
+                os.makedirs(self.tmpdir, exist_ok=self.resume)
                 if self.cec == 'docker':
                     os.chmod(self.tmpdir, stat.S_ISVTX | stat.S_IRWXU |
                              stat.S_IRWXG | stat.S_IRWXO)
@@ -1081,32 +2029,93 @@ class HEPscore():
                 logger.error("Failed to create tmpdir %s", self.tmpdir)
                 sys.exit(1)
 
+        if self.image_cache and not mock:
+            if self.cec == 'singularity':
+                from hepscore import imagecache
+                try:
+                    self._image_cache = imagecache.ImageCache(
+                        self.image_cache, self.image_cache_size or imagecache.DEFAULT_SIZE)
+                    logger.info("Image cache:         %s", self._image_cache.root)
+                except OSError as err:
+                    logger.warning("Not using image cache %s: %s", self.image_cache, err)
+            else:
+                logger.warning("The image cache is only used with singularity")
+
+        self._place_workloads()
+
+        sampler = None
+        if self.IP and not mock:
+            from hepscore import power
+            sampler = power.PowerSampler(self.IP, [power.OUTLET_OID + od for od in self.oid],
+                                         self.power_interval,
+                                         os.path.join(self.resultsdir, self._power_series()),
+                                         self.power_daemon)
+            sampler.start()
+
+        if self.prefetch and not mock:
+            order = [bmk for bmk in self.confobj['benchmarks']
+                     if bmk not in self.checkpoint['workloads']]
+            if self.packed > 1:
+                order = self._schedule_order(order)
+            self._start_prefetch(order)
+
         res = 0
         have_failure = False
+        if self.packed > 1:
+            packed_res = self._run_packed(mock, benchTime)
         for benchmark in self.confobj['benchmarks']:
-            res = self._run_benchmark(benchmark, mock, benchTime)
+            if self.packed > 1:
+                res = packed_res[benchmark]
+                if res is None:
+                    # never started, after another workload failed
+                    continue
+            elif self.layout is not None:
+                res = self._run_benchmark(benchmark, mock, benchTime,
+                                          self.layout['slots'][0]['cpus'],
+                                          self.layout['slots'][0]['mems'])
+            else:
+                res = self._run_benchmark(benchmark, mock, benchTime)
             if res < 0:
                 have_failure = True
                 # set error to first benchmark encountered
                 if 'error' not in self.confobj.keys():
                     self.confobj['error'] = benchmark
-                if 'continue_fail' not in self.confobj['settings'].keys() or \
-                        self.confobj['settings']['continue_fail'] is False:
+                if not self._continue_fail():
                     break
             self.results.append(res)
+            self.bench_scores[benchmark] = res
             bench_conf = self.confobj['benchmarks'][benchmark]
             if 'weight' in bench_conf:
                 self.weights.append(bench_conf['weight'])
             else:
                 self.weights.append(1.0)
                 bench_conf['weight'] = 1.0
-                
-        with open("power.json", "w") as f:
-            json.dump({"power": power, "benchtime": benchTime, "scores": scoresData}, f)
-        
+
+        self._stop_prefetch()
+
+        self.run_window = (mono_start, time.monotonic())
+        if sampler is not None:
+            self.power = sampler.stop()
+            self.power_anchor = sampler.anchor
+            logger.info("Collected %d power samples", len(self.power))
+            self.confobj['environment']['power_sampling'] = sampler.summary()
+        if self._image_cache is not None:
+            self.confobj['environment']['image_cache'] = self._image_cache.summary()
+
+        if not mock:
+            self.power_index = {'series': os.path.basename(sampler.store)
+                                          if sampler is not None else None,
+                                'anchor': self.power_anchor,
+                                'benchtime': benchTime,
+                                'run_windows': self.run_windows,
+                                'scores': scoresData}
+            self._write_power_index()
+
         endtime= time.time()
         self.confobj['environment']['end_at'] = time.asctime(time.localtime(endtime))
-        self.confobj['environment']['duration'] = math.floor(endtime) - math.floor(starttime)
+        self.confobj['environment']['duration'] = round(time.monotonic() - mono_start, 3)
+        # scoring and writing the report come later, and are only in the trace
+        self.confobj['environment']['overhead'] = self.tracer.breakdown()
 
         if not mock:
             try:
@@ -1127,7 +2136,7 @@ class HEPscore():
             logger.error("BENCHMARK FAILURE")
             self.confobj['score'] = -1
             self.confobj['status'] = 'failed'
-            return -1, power, benchTime, scoresData
+            return -1
 
-        return 0, power, benchTime, scoresData
+        return 0
 # End of HEPscore class
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+imagecache.py - Node-level content-addressed cache of SIF images
+
+Images pulled by hepscore are kept in a directory shared by every hepscore
+run of the node, so that the next run does not download them again:
+
+    ROOT/blobs/SHA256.sif   image files, named by the digest of their content
+    ROOT/refs/KEY.json      image reference (registry/name:version and
+                            architecture) -> digest, KEY is the SHA256 of it
+    ROOT/tmp/               images being pulled
+    ROOT/locks/KEY.lock     serialises the pulls of an image
+    ROOT/lock               serialises updates of blobs and refs
+
+Images are pulled to ROOT/tmp and renamed into place, so that concurrent
+runs never see a partial image, and runs needing the same missing image
+wait for a single pull.  The modification time of a blob records its last
+use.  When the blobs exceed the size cap, the least recently used ones are
+evicted, except those a run holds a shared lock on while it uses them.
+
+Copyright 2019-2021 CERN. See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+
+from hepscore import paths
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = paths.IMAGE_CACHE
+DEFAULT_SIZE = 100  # GB
+CHUNK = 1 << 20  # bytes hashed at once
+STALE_PULL = 86400  # seconds after which a leftover partial pull is deleted
+
+
+def image_key(image, arch):
+    """Cache key of an image reference built for arch"""
+    return "%s|%s" % (image, arch)
+
+
+def file_digest(path):
+    """SHA256 hex digest of the content of a file"""
+    sha = hashlib.sha256()
+    with open(path, mode='rb') as ifile:
+        for chunk in iter(lambda: ifile.read(CHUNK), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class ImageCache():
+    """Content-addressed image cache with a size cap and LRU eviction"""
+
+    def __init__(self, root=CACHE_DIR, max_size=DEFAULT_SIZE):
+        """Args:
+            root (str, optional): cache directory. Default: CACHE_DIR
+            max_size (float, optional): size cap in GB. Default: DEFAULT_SIZE
+        """
+        self.root = os.path.abspath(root)
+        self.max_bytes = int(float(max_size) * 1e9)
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'evicted_bytes': 0,
+                      'pulled_bytes': 0}
+        self._held = {}
+        for sub in ('blobs', 'refs', 'tmp', 'locks'):
+            os.makedirs(os.path.join(self.root, sub), exist_ok=True)
+
+    def _ref_path(self, key):
+        return os.path.join(self.root, 'refs',
+                            hashlib.sha256(key.encode('utf-8')).hexdigest() + '.json')
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, 'blobs', digest + '.sif')
+
+    def _lock(self, key=None):
+        """Exclusive lock on the cache, or on the pulls of key
+
+        The lock is released when the returned file is closed.
+        """
+        if key is None:
+            path = os.path.join(self.root, 'lock')
+        else:
+            path = os.path.join(self.root, 'locks',
+                                hashlib.sha256(key.encode('utf-8')).hexdigest() + '.lock')
+        lfile = open(path, mode='a')
+        fcntl.flock(lfile, fcntl.LOCK_EX)
+        return lfile
+
+    def _open_blob(self, key):
+        """Take a shared lock on the blob of key
+
+        Returns:
+            2-tuple (str, file): blob path and the file holding the lock,
+            (None, None) if key is not cached
+        """
+        try:
+            with open(self._ref_path(key), mode='r') as rfile:
+                digest = json.load(rfile)['digest']
+            path = self._blob_path(digest)
+            bfile = open(path, mode='rb')
+        except (OSError, ValueError, KeyError, TypeError):
+            return None, None
+        fcntl.flock(bfile, fcntl.LOCK_SH)
+        # the blob may have been evicted while waiting for the lock
+        if not os.path.exists(path) or os.stat(path).st_ino != os.fstat(bfile.fileno()).st_ino:
+            bfile.close()
+            return None, None
+        os.utime(path)
+        return path, bfile
+
+    def get(self, key, pull):
+        """Return the cached image of key, pulling it on a miss
+
+        The image is locked against eviction until `release` is called with
+        the same key.
+
+        Args:
+            key (str): see `image_key`
+            pull (callable): pull(target) writes the image to the path target,
+                             and returns True on success
+
+        Returns:
+            2-tuple (str, bool): path of the image, None if the pull failed,
+            and whether it was a cache hit
+        """
+        path, bfile = self._open_blob(key)
+        if path is None:
+            with self._lock(key):
+                # another run may have pulled it while we waited for the lock
+                path, bfile = self._open_blob(key)
+                if path is None:
+                    path, bfile = self._populate(key, pull)
+                    if path is None:
+                        return None, False
+                    self.stats['misses'] += 1
+                    self._held[key] = bfile
+                    return path, False
+
+        self.stats['hits'] += 1
+        self._held[key] = bfile
+        return path, True
+
+    def _populate(self, key, pull):
+        """Pull the image of key into the cache, with the lock of key held"""
+        fd, tmp = tempfile.mkstemp(suffix='.sif', dir=os.path.join(self.root, 'tmp'))
+        os.close(fd)
+        os.unlink(tmp)
+        try:
+            if not pull(tmp) or not os.path.isfile(tmp):
+                return None, None
+            digest = file_digest(tmp)
+            path = self._blob_path(digest)
+            self.stats['pulled_bytes'] += os.path.getsize(tmp)
+
+            with self._lock():
+                if os.path.exists(path):
+                    # same content under another reference
+                    os.utime(path)
+                else:
+                    os.rename(tmp, path)
+                bfile = open(path, mode='rb')
+                fcntl.flock(bfile, fcntl.LOCK_SH)
+
+                ref = self._ref_path(key)
+                with open(ref + '.tmp', mode='w') as rfile:
+                    json.dump({'key': key, 'digest': digest}, rfile)
+                os.replace(ref + '.tmp', ref)
+                self._evict()
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+        return path, bfile
+
+    def release(self, key):
+        """Allow the image of key to be evicted again"""
+        bfile = self._held.pop(key, None)
+        if bfile is not None:
+            bfile.close()
+
+    def _evict(self):
+        """Delete least recently used blobs not in use above the size cap
+
+        Called with the cache lock held.
+        """
+        now = time.time()
+        for entry in os.scandir(os.path.join(self.root, 'tmp')):
+            if entry.stat().st_mtime < now - STALE_PULL:
+                logger.debug("Removing partial pull %s", entry.path)
+                os.unlink(entry.path)
+
+        blobs = []
+        for entry in os.scandir(os.path.join(self.root, 'blobs')):
+            info = entry.stat()
+            blobs.append((info.st_mtime, info.st_size, entry.path))
+        total = sum(size for _, size, _ in blobs)
+
+        evicted = set()
+        for _, size, path in sorted(blobs):
+            if total <= self.max_bytes:
+                break
+            with open(path, mode='rb') as bfile:
+                try:
+                    fcntl.flock(bfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue  # in use by a run
+                os.unlink(path)
+            logger.info("Evicted %s from the image cache", os.path.basename(path))
+            evicted.add(os.path.basename(path)[:-len('.sif')])
+            total -= size
+            self.stats['evictions'] += 1
+            self.stats['evicted_bytes'] += size
+
+        if evicted:
+            for entry in os.scandir(os.path.join(self.root, 'refs')):
+                try:
+                    with open(entry.path, mode='r') as rfile:
+                        stale = json.load(rfile)['digest'] in evicted
+                except (OSError, ValueError, KeyError):
+                    stale = True
+                if stale:
+                    os.unlink(entry.path)
+
+    def size(self):
+        """Bytes used by the cached images"""
+        return sum(entry.stat().st_size for entry in os.scandir(os.path.join(self.root, 'blobs')))
+
+    def summary(self):
+        """Cache statistics of this session, for the report"""
+        summary = dict(self.stats)
+        summary.update({'path': self.root, 'size': self.size(), 'max_size': self.max_bytes})
+        return summary
@@ -6,10 +6,8 @@ of this distribution. For licensing information, see the COPYING file at
 the top-level directory of this distribution.
 """
 import socket
-import urllib3.util.connection
 import subprocess
 import base64
-import requests
 import argparse
 import logging
 import os
@@ -19,6 +17,7 @@ import time
 import yaml
 import json
 import hepscore.hepscore as hepscore
+from hepscore import paths
 from datetime import datetime
 
 logger = logging.getLogger()
@@ -34,6 +33,18 @@ exit_status_dict = {
     'Error failed outdir creation': 7,
 }
 
+class VersionAction(argparse.Action):
+    """Print the version and exit, looking it up only when it is asked for"""
+
+    def __init__(self, option_strings, dest=argparse.SUPPRESS, help=None):
+        super().__init__(option_strings, dest=dest, default=argparse.SUPPRESS, nargs=0,
+                         help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        from hepscore import __version__
+        print(parser.prog, __version__)
+        parser.exit()
+
 def parse_args(args):
 
     """Parse passed argv list."""
@@ -68,6 +79,12 @@ def parse_args(args):
         Run using the workload containers in a local directory:
         $ hep-score --registry dir:///home/bmk/hs23-workloads /tmp
 
+        Run using the workload containers of an image archive, without extracting it:
+        $ hep-score --registry tar:///home/bmk/x86_64_0123abcd.tar /tmp
+
+        Run four workloads at a time, longest first according to a previous report:
+        $ hep-score -j 4 -d /tmp/HEPscore_01Jan2024_000000/HEPScore23.json /tmp
+
         Included benchmark configuraton files available in:
         ''' + hepscore.config_path)
     )
@@ -79,12 +96,14 @@ def parse_args(args):
                         nargs='?', default=False,
                         help="specify container platform for benchmark execution "
                              "(singularity [default], or docker).")
-    parser.add_argument("-i", "--container_uri", choices=['docker', 'shub', 'dir', 'oras', 'https'],
+    parser.add_argument("-i", "--container_uri", choices=['docker', 'shub', 'dir', 'tar', 'oras', 'https'],
                         nargs='?', default=False,
                         help="specify container registry type "
-                             "(oras, docker, shub, dir, https).")
+                             "(oras, docker, shub, dir, tar, https).")
     parser.add_argument("-S", "--userns", action='store_true',
                         help="enable user namespace for Singularity, if supported.")
+    parser.add_argument("-P", "--prefetch", action='store_true',
+                        help="pull the image of the next workload while the current one runs.")
     parser.add_argument("-c", "--clean", action='store_true',
                         help="clean residual container images from system after run.")
     parser.add_argument("-C", "--clean_files", action='store_true',
@@ -99,19 +118,65 @@ def parse_args(args):
                         help="override the configured registry.")
     parser.add_argument("-n", "--ncores", nargs='?', default=None,
                         help="custom number of cores to be loaded. This parameter will change the hash function")
+    parser.add_argument("-j", "--packed", nargs='?', default=None,
+                        help="run up to PACKED workloads concurrently, each pinned to "
+                             "its own share of the available cores. This parameter will "
+                             "change the hash function")
+    parser.add_argument("--placement", choices=['none', 'numa'], default=None,
+                        help="placement of the workloads on the cores: 'numa' keeps each "
+                             "workload and its memory on a NUMA node, running one workload "
+                             "per node unless --packed is given. This parameter will change "
+                             "the hash function")
+    parser.add_argument("--smt", choices=['pack', 'spread'], default=None,
+                        help="give workloads whole cores with their SMT siblings ('pack'), "
+                             "or one thread per core first ('spread'). This parameter will "
+                             "change the hash function")
+    parser.add_argument("--reserve_cores", nargs='?', default=None,
+                        help="keep this many cores, with their SMT siblings, free of "
+                             "workloads for housekeeping. This parameter will change the "
+                             "hash function")
+    parser.add_argument("-d", "--durations", nargs='?', default=None,
+                        help="previous hepscore report used to start the longest "
+                             "workloads first in packed mode.")
     parser.add_argument("-r", "--replay", action='store_true',
                         help="replay output using existing results directory OUTDIR.")
+    parser.add_argument("-u", "--resume", action='store_true',
+                        help="resume an interrupted run in existing results directory OUTDIR, "
+                             "running only the missing workloads and repetitions.")
     parser.add_argument("-o", "--outfile", nargs='?', default=False,
                         help="specify summary output file path/name.")
     parser.add_argument("-y", "--yaml", action='store_true',
                         help="create YAML summary output instead of JSON.")
     parser.add_argument("-p", "--print", action='store_true',
                         help="print configuration and exit.")
-    parser.add_argument("-V", "--version", action='version',
-                        version="%(prog)s " + hepscore.__version__)
+    parser.add_argument("-V", "--version", action=VersionAction,
+                        help="show program's version number and exit")
     parser.add_argument("-v", "--verbose", action='store_true',
                         help="enables verbose mode. Display debug messages.")
-    parser.add_argument("-t", "--token", action="append")
+    parser.add_argument("-t", "--token", action="append",
+                        help="GitHub token used to upload power and timing data.")
+    parser.add_argument("--power_interval", nargs='?', default=None,
+                        help="seconds between PDU power samples (default 1).")
+    parser.add_argument("--power_daemon", nargs='?', default=None,
+                        help="receive PDU power samples from the hep-score-pdud daemon "
+                             "at unix:PATH or HOST:PORT instead of polling the PDUs.")
+    parser.add_argument("--telemetry_interval", nargs='?', default=None,
+                        help="seconds between samples of the CPU, memory and I/O usage of "
+                             "each workload container, and of the CPU frequency and "
+                             "temperature (default 1, 0 to disable).")
+    parser.add_argument("--image_cache", nargs='?', default=None,
+                        const=paths.IMAGE_CACHE,
+                        help="keep Singularity images in the node-level cache IMAGE_CACHE, "
+                             "shared by hepscore runs (default: ~/.cache/hepscore/images).")
+    parser.add_argument("--image_cache_size", nargs='?', default=None,
+                        help="size cap of the image cache in GB (default 100); least "
+                             "recently used images are evicted.")
+    parser.add_argument("--trace", nargs='?', default=None, const='',
+                        help="write the timeline of the run phases as Chrome trace events "
+                             "to TRACE (default: trace.json in the results directory).")
+    parser.add_argument("--catalog", nargs='?', default=None, const=paths.CATALOG,
+                        help="record the results in the SQLite catalogue CATALOG "
+                             "(default: " + paths.CATALOG + ").")
     arg_dict = vars(parser.parse_args(args))
     return arg_dict
 
@@ -131,6 +196,11 @@ def check_args(args):
               "See usage: 'hep-score --help'")
         sys.exit(exit_status_dict['Error missing outdir'])
 
+    # FAIL if both replay and resume are requested
+    if args.get('replay') and args.get('resume'):
+        logger.error('Cannot both replay and resume a run')
+        sys.exit(exit_status_dict['Error 2 config passed'])
+
     # FAIL if both a configuration file and a built-in configuration are specified
     if args['conffile']!='' and args['builtinconf']!='':
         logger.error('Cannot specify both a configuration file and a built-in configuration')
@@ -148,7 +218,7 @@ def main():
             )
             serial_number = result.stdout.strip()
             return serial_number
-        except subprocess.CalledProcessError as e:
+        except (subprocess.CalledProcessError, OSError):
             return "none"
 
     """Command-line entry point. Parses arguments to construct configuration dict."""
@@ -219,7 +289,7 @@ def main():
         active_config[usekey]['options'] = {}
     for arg in user_args:
         if user_args[arg] != None:
-            if arg == 'ncores':
+            if arg in ('ncores', 'packed', 'reserve_cores'):
                 sval = int(user_args[arg])
             else:
                 sval = user_args[arg]
@@ -228,11 +298,11 @@ def main():
                 print("NOTICE - overriding config registry with " + sval)
 
             active_config[usekey]['options'][arg] = sval
-    print(get_dell_serial_linux)
-    # check replay outdir actually contains a run...
-    if args['replay']:
+    # check replay or resume outdir actually contains a run...
+    if args['replay'] or args['resume']:
         if not os.path.isdir(outdir):
-            logging.error("Replay did not find a valid directory at " + outdir)
+            logging.error("%s did not find a valid directory at %s",
+                          "Replay" if args['replay'] else "Resume", outdir)
             sys.exit(exit_status_dict['Error missing resultdir'])
         else:
             resultsdir = outdir
@@ -249,24 +319,40 @@ def main():
             logger.error("Failed creating output directory %s. Do you have write permission?",
                          resultsdir)
             sys.exit(exit_status_dict['Error failed outdir creation'])
-    with open('etc/data.yaml', 'r') as file:
+    # PDU addresses and outlets powering this host, keyed by serial number
+    serial = get_dell_serial_linux()
+    with open(os.path.join(hepscore.config_path, 'data.yaml'), 'r') as file:
         filed = yaml.safe_load(file)
-    hep_score = hepscore.HEPscore(active_config, resultsdir,filed[get_dell_serial_linux()][1],filed[get_dell_serial_linux()][0])
-    result, power, bench, other = hep_score.run(args['replay'])
+    if serial in filed:
+        pdu_ips, pdu_outlets = filed[serial][0], filed[serial][1]
+    else:
+        logger.warning("No PDU outlets known for host %s: power will not be sampled", serial)
+        pdu_ips, pdu_outlets = [], []
+
+    hep_score = hepscore.HEPscore(active_config, resultsdir, pdu_outlets, pdu_ips)
+    result = hep_score.run(args['replay'])
     if result >= 0:
         hep_score.gen_score()
     hep_score.write_output(outtype, args['outfile'])
+
+    if not args['token']:
+        return
+
+    import requests
+    import urllib3.util.connection
+
     def ipv4_only_create_connection(address, *args, **kwargs):
     # Remove unsupported kwargs (like socket_options)
         kwargs.pop('socket_options', None)
         return socket.create_connection((socket.gethostbyname(address[0]), address[1]), *args, **kwargs)
 
     urllib3.util.connection.create_connection = ipv4_only_create_connection
-    powerData = f"[power:{power},data:{bench},other:{other}]"
-    fileName = f"{get_dell_serial_linux()}+{datetime.now()}"
+    powerData = f"[power:{hep_score.power},anchor:{hep_score.power_anchor}," \
+                f"data:{hep_score.bench_time},other:{hepscore.scoresData}]"
+    fileName = f"{serial}+{datetime.now()}"
 
     url = f"https://api.github.com/repos/Codemeister14/HEPscoreData/contents/{fileName}.txt"
-    headers = {"Authorization": f"token {args['token']}"}
+    headers = {"Authorization": f"token {args['token'][-1]}"}
     data = {
         "message": "commited",
         "content": base64.b64encode(powerData.encode()).decode(),
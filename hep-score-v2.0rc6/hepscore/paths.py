@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""
+paths.py - Default locations of the files hepscore keeps between runs
+
+Only the standard library is imported, so that the command line can show
+these defaults without loading the modules that use them.
+
+Copyright 2019-2021 CERN. See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+
+import os
+
+CACHE_HOME = os.path.join(os.environ.get('XDG_CACHE_HOME',
+                                         os.path.join(os.path.expanduser('~'), '.cache')),
+                          'hepscore')
+ENGINE_CACHE = os.path.join(CACHE_HOME, 'engines.json')  # see `hepscore.engine`
+IMAGE_CACHE = os.path.join(CACHE_HOME, 'images')  # see `hepscore.imagecache`
+CATALOG = os.environ.get(  # see `hepscore.catalog`
+    'HEPSCORE_CATALOG', os.path.join(os.path.expanduser('~'), '.hepscore', 'catalog.sqlite'))
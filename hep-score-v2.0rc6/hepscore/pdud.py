@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+pdud.py - PDU polling daemon shared by the hosts of a rack
+
+The daemon polls every configured PDU once per tick for all of its
+outlets, and publishes the samples to subscribers over a unix or TCP
+socket, so that hosts benchmarked at the same time do not each poll the
+same PDUs.  The protocol is newline-delimited JSON:
+
+- the subscriber sends {"outlets": [[pdu, outlet], ...]}, or {} for all
+  outlets
+- the daemon answers {"interval": seconds, "outlets": [[pdu, outlet], ...],
+  "missing": [[pdu, outlet], ...]} with the requested outlets it does not poll
+- the daemon then sends {"time": wall clock, "pdu": pdu, "outlet": outlet,
+  "watts": watts} for every sample of a subscribed outlet
+
+Run it with:
+
+    $ hep-score-pdud --listen unix:/run/hep-score-pdud.sock --listen 0.0.0.0:8161
+
+and subscribe hepscore to it with `hep-score --power_daemon ADDRESS`.
+
+Copyright 2019-2021 CERN. See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import signal
+import threading
+import time
+import yaml
+from hepscore.power import OUTLET_OID, daemon_address, getPowerReadings, pdu_address
+
+logger = logging.getLogger(__name__)
+
+MAX_BACKLOG = 1 << 20  # bytes queued for a subscriber before it is dropped
+HELLO_TIMEOUT = 10.0  # seconds a subscriber has to send its request
+
+
+def load_outlets(path):
+    """Return every PDU outlet listed in a hepscore data.yaml file
+
+    Hosts without a valid PDU address or outlet number (such as the
+    'Error' and 'Not Specified' entries of the shipped map) are skipped
+    with a warning.
+
+    Args:
+        path (str): file mapping host serial numbers to PDU addresses and outlets
+
+    Returns:
+        list[tuple]: unique (PDU address, outlet number) pairs
+    """
+    with open(path, 'r') as yfile:
+        hosts = yaml.safe_load(yfile) or {}
+
+    outlets = []
+    for host, entry in hosts.items():
+        try:
+            IPs, numbers = entry
+            pairs = list(zip(IPs, numbers))
+        except (TypeError, ValueError):
+            logger.warning("Skipping host %s: no PDU addresses and outlets", host)
+            continue
+        for ip, num in pairs:
+            try:
+                valid = bool(pdu_address(ip)[0])
+                num = str(int(num))
+            except (AttributeError, TypeError, ValueError):
+                valid = False
+            if not valid:
+                logger.warning("Skipping outlet %s:%s of host %s: not a PDU address and "
+                               "outlet number", ip, num, host)
+                continue
+            if (ip, num) not in outlets:
+                outlets.append((ip, num))
+    return outlets
+
+
+class PDUDaemon():
+    """Poll PDU outlets and publish the samples to subscribers"""
+
+    def __init__(self, outlets, interval=1.0):
+        """Args:
+            outlets (list[tuple]): (PDU address, outlet number) pairs to poll
+            interval (float, optional): seconds between polls. Default: 1.0
+        """
+        self.outlets = [(ip, str(num)) for ip, num in outlets]
+        self.interval = float(interval)
+        self.subscribers = {}
+        self.stats = {}
+        self.clock = {}
+        self.anchor = {}
+        self._index = {outlet: i for i, outlet in enumerate(self.outlets)}
+
+    def put(self, sample):
+        """Publish a (monotonic timestamp, watts, outlet index) sample"""
+        timestamp, watts, i = sample
+        ip, num = self.outlets[i]
+        line = (json.dumps({'time': self.anchor['wall'] + timestamp - self.anchor['monotonic'],
+                            'pdu': ip, 'outlet': num, 'watts': watts}) + '\n').encode()
+
+        for writer, wanted in list(self.subscribers.items()):
+            if wanted is not None and i not in wanted:
+                continue
+            if writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+                logger.warning("Dropping subscriber %s: not reading samples",
+                               writer.get_extra_info('peername'))
+                del self.subscribers[writer]
+                writer.close()
+                continue
+            writer.write(line)
+
+    async def _subscribe(self, reader, writer):
+        peer = writer.get_extra_info('peername') or 'unix socket'
+        try:
+            request = json.loads(await asyncio.wait_for(reader.readline(), HELLO_TIMEOUT)
+                                 or b'{}')
+            if request.get('outlets') is None:
+                wanted = None
+                served, missing = self.outlets, []
+            else:
+                requested = [(ip, str(num)) for ip, num in request['outlets']]
+                served = [outlet for outlet in requested if outlet in self._index]
+                missing = [outlet for outlet in requested if outlet not in self._index]
+                wanted = {self._index[outlet] for outlet in served}
+            writer.write((json.dumps({'interval': self.interval, 'outlets': served,
+                                      'missing': missing}) + '\n').encode())
+            logger.info("Subscriber %s: %d outlets", peer, len(served))
+            self.subscribers[writer] = wanted
+
+            # subscribers send nothing more: wait for them to disconnect
+            while await reader.read(4096):
+                pass
+        except (OSError, ValueError, TypeError, asyncio.TimeoutError) as err:
+            logger.warning("Subscriber %s: %s", peer, err)
+        finally:
+            self.subscribers.pop(writer, None)
+            writer.close()
+            logger.info("Subscriber %s left", peer)
+
+    async def _listen(self, address):
+        kind, where = daemon_address(address)
+        if kind == 'unix':
+            if os.path.exists(where):
+                os.unlink(where)
+            return await asyncio.start_unix_server(self._subscribe, path=where)
+        return await asyncio.start_server(self._subscribe, *where)
+
+    async def run(self, addresses, stop):
+        """Listen for subscribers and poll the PDUs until stop is set
+
+        Args:
+            addresses (list[str]): addresses to listen on, unix:PATH or HOST:PORT
+            stop (threading.Event): ends polling when set
+        """
+        servers = [await self._listen(address) for address in addresses]
+        self.anchor = {'wall': time.time(), 'monotonic': time.monotonic()}
+        logger.info("Polling %d outlets of %d PDUs every %ss, serving %s", len(self.outlets),
+                    len({ip for ip, _ in self.outlets}), self.interval, ', '.join(addresses))
+        try:
+            await getPowerReadings(self.interval, [ip for ip, _ in self.outlets], stop, self,
+                                   [OUTLET_OID + num for _, num in self.outlets],
+                                   self.stats, self.clock)
+        finally:
+            for server in servers:
+                server.close()
+            for writer in list(self.subscribers):
+                writer.close()
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="PDU polling daemon for hepscore")
+    parser.add_argument('-f', '--outlets_file',
+                        default=os.path.join(os.path.dirname(__file__), 'etc', 'data.yaml'),
+                        help="host to PDU outlet map (default: the one shipped with hepscore)")
+    parser.add_argument('-O', '--outlet', action='append', default=[],
+                        help="poll PDU:OUTLET instead of the outlets of the map; repeatable")
+    parser.add_argument('-l', '--listen', action='append',
+                        help="address to serve, unix:PATH or HOST:PORT; repeatable "
+                             "(default: unix:/tmp/hep-score-pdud.sock)")
+    parser.add_argument('-i', '--interval', type=float, default=1.0,
+                        help="seconds between polls (default 1)")
+    parser.add_argument('-v', '--verbose', action='store_true', help="display debug messages")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s %(name)s %(levelname)s %(message)s')
+    if args.outlet:
+        outlets = [tuple(outlet.rsplit(':', 1)) for outlet in args.outlet]
+    else:
+        outlets = load_outlets(args.outlets_file)
+
+    stop = threading.Event()
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        await PDUDaemon(outlets, args.interval).run(
+            args.listen or ['unix:/tmp/hep-score-pdud.sock'], stop)
+
+    asyncio.run(serve())
+
+
+if __name__ == '__main__':
+    main()
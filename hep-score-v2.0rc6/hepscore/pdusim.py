@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+"""
+pdusim.py - Simulated SNMP PDUs, and a throughput benchmark of the power sampler
+
+The simulator answers SNMPv2c GET requests for the outlet active power
+OIDs polled by `hepscore.power`, with configurable latency, jitter, packet
+loss and power waveform.  It stands in for the PDUs of `etc/data.yaml` in
+tests and benchmarks:
+
+    $ hep-score-pdusim serve --pdus 2 --outlets 24 --latency 0.005
+    $ hep-score-pdusim bench --outlets 1,10,100 --interval 1,0.1,0
+
+Copyright 2019-2021 CERN. See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import random
+import resource
+import subprocess
+import sys
+import time
+from pyasn1.codec.ber import decoder, encoder
+from pyasn1.error import PyAsn1Error
+from pysnmp.proto import api
+from hepscore.power import COMMUNITY, OUTLET_OID, PowerSampler
+
+logger = logging.getLogger(__name__)
+
+OUTLET_PREFIX = tuple(int(n) for n in OUTLET_OID.strip('.').split('.'))
+POWER_SENSOR = 5
+WAVEFORMS = ('constant', 'sine', 'square', 'sawtooth', 'noise')
+
+
+class PDUSimulator(asyncio.DatagramProtocol):
+    """SNMPv2c agent serving the active power of simulated PDU outlets"""
+
+    def __init__(self, outlets=2, latency=0.0, jitter=0.0, loss=0.0, waveform='constant',
+                 base=200.0, amplitude=50.0, period=60.0, community=COMMUNITY, seed=None):
+        """Args:
+            outlets (int, optional): number of outlets, numbered from 1. Default: 2
+            latency (float, optional): seconds before answering a request. Default: 0
+            jitter (float, optional): latency varies uniformly by +/- jitter seconds.
+                                      Default: 0
+            loss (float, optional): fraction of requests left unanswered. Default: 0
+            waveform (str, optional): one of WAVEFORMS. Default: 'constant'
+            base (float, optional): mean power of an outlet in watts. Default: 200
+            amplitude (float, optional): amplitude of the waveform in watts. Default: 50
+            period (float, optional): period of the waveform in seconds. Default: 60
+            community (str, optional): SNMP community served. Default: COMMUNITY
+            seed (int, optional): seed of the random latency, loss and noise
+
+        Raises:
+            ValueError: if waveform is not known
+        """
+        if waveform not in WAVEFORMS:
+            raise ValueError("Unknown waveform %s: use one of %s" % (waveform, ', '.join(WAVEFORMS)))
+        self.outlets = int(outlets)
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.loss = float(loss)
+        self.waveform = waveform
+        self.base = float(base)
+        self.amplitude = float(amplitude)
+        self.period = float(period)
+        self.community = community
+        self.requests = 0
+        self.dropped = 0
+        self.transport = None
+        self._rng = random.Random(seed)
+        self._start = time.monotonic()
+
+    def power(self, outlet, now=None):
+        """Return the power drawn by an outlet
+
+        Args:
+            outlet (int): outlet number
+            now (float, optional): monotonic time. Default: current time
+
+        Returns:
+            int: power in watts
+        """
+        if now is None:
+            now = time.monotonic()
+        # each outlet is out of phase with the others
+        phase = 2 * math.pi * (now - self._start) / self.period + outlet
+
+        if self.waveform == 'sine':
+            level = math.sin(phase)
+        elif self.waveform == 'square':
+            level = 1.0 if math.sin(phase) >= 0 else -1.0
+        elif self.waveform == 'sawtooth':
+            level = 2 * ((phase / (2 * math.pi)) % 1) - 1
+        elif self.waveform == 'noise':
+            level = self._rng.gauss(0, 1)
+        else:
+            level = 0.0
+
+        return max(0, int(round(self.base + self.amplitude * level)))
+
+    def respond(self, data):
+        """Build the response to a GET request
+
+        Args:
+            data (bytes): SNMP message
+
+        Returns:
+            bytes: encoded response, or None if the request is not answered
+        """
+        pmod = api.PROTOCOL_MODULES[api.decodeMessageVersion(data)]
+        request, _ = decoder.decode(data, asn1Spec=pmod.Message())
+        if str(pmod.apiMessage.get_community(request)) != self.community:
+            return None
+        request_pdu = pmod.apiMessage.get_pdu(request)
+        if not request_pdu.isSameTypeWith(pmod.GetRequestPDU()):
+            return None
+
+        response = pmod.apiMessage.get_response(request)
+        now = time.monotonic()
+        varbinds = []
+        for oid, _ in pmod.apiPDU.get_varbinds(request_pdu):
+            name = tuple(oid)
+            outlet = name[len(OUTLET_PREFIX)] if len(name) == len(OUTLET_PREFIX) + 2 else 0
+            if name[:len(OUTLET_PREFIX)] == OUTLET_PREFIX and name[-1] == POWER_SENSOR \
+                    and 1 <= outlet <= self.outlets:
+                varbinds.append((oid, pmod.Gauge32(self.power(outlet, now))))
+            else:
+                varbinds.append((oid, pmod.NoSuchInstance('')))
+        pmod.apiPDU.set_varbinds(pmod.apiMessage.get_pdu(response), varbinds)
+
+        return encoder.encode(response)
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.requests += 1
+        if self.loss and self._rng.random() < self.loss:
+            self.dropped += 1
+            return
+        try:
+            response = self.respond(data)
+        except (PyAsn1Error, KeyError) as err:
+            logger.debug("Ignoring malformed request from %s: %s", addr, err)
+            return
+        if response is None:
+            return
+
+        delay = max(0.0, self.latency + self._rng.uniform(-self.jitter, self.jitter))
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self.transport.sendto, response, addr)
+        else:
+            self.transport.sendto(response, addr)
+
+
+async def serve(host='127.0.0.1', port=0, **kwargs):
+    """Start a simulated PDU on the running event loop
+
+    Args:
+        host (str, optional): address to listen on. Default: 127.0.0.1
+        port (int, optional): UDP port, 0 for any free port. Default: 0
+        **kwargs: PDUSimulator options
+
+    Returns:
+        2-tuple (PDUSimulator, str): the simulator, and its address as host:port
+    """
+    transport, simulator = await asyncio.get_running_loop().create_datagram_endpoint(
+        lambda: PDUSimulator(**kwargs), local_addr=(host, port))
+    sockname = transport.get_extra_info('sockname')
+    return simulator, "%s:%d" % (sockname[0], sockname[1])
+
+
+async def _serve_forever(args):
+    options = _sim_options(args)
+    for i in range(args.pdus):
+        _, address = await serve(args.host, args.port + i if args.port else 0, **options)
+        print(address, flush=True)
+    await asyncio.Event().wait()
+
+
+def _sim_options(args):
+    return {'outlets': args.outlets, 'latency': args.latency, 'jitter': args.jitter,
+            'loss': args.loss, 'waveform': args.waveform, 'base': args.base,
+            'amplitude': args.amplitude, 'period': args.period, 'seed': args.seed}
+
+
+def bench_sampler(addresses, outlets, interval, duration):
+    """Sample simulated PDUs and measure the sampler
+
+    Args:
+        addresses (list[str]): host:port of each simulated PDU
+        outlets (int): outlets sampled, spread evenly over the PDUs
+        interval (float): seconds between polls, 0 to poll back to back
+        duration (float): seconds to sample for
+
+    Returns:
+        dict: samples and ticks per second, poll period error (seconds),
+              late and missed ticks, and CPU used by the sampler (percent)
+    """
+    IPs = [addresses[i % len(addresses)] for i in range(outlets)]
+    oids = [OUTLET_OID + str(i // len(addresses) + 1) for i in range(outlets)]
+    sampler = PowerSampler(IPs, oids, interval)
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.monotonic()
+    sampler.start()
+    time.sleep(duration)
+    samples = sampler.stop()
+    elapsed = time.monotonic() - start
+    used = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = (used.ru_utime - usage.ru_utime) + (used.ru_stime - usage.ru_stime)
+
+    summary = sampler.summary()
+    result = {'outlets': outlets, 'interval': interval,
+              'samples_per_s': round(len(samples) / elapsed, 1),
+              'ticks_per_s': round(summary.get('ticks', 0) / elapsed, 1),
+              'late_ticks': summary.get('late_ticks', 0),
+              'missed_ticks': summary.get('missed_ticks', 0),
+              'errors': sum(pdu['errors'] for pdu in summary['pdus'].values()),
+              'cpu_percent': round(100 * cpu / elapsed, 2)}
+
+    # deviation of the period between consecutive polls of the first outlet
+    stamps = sorted(s[0] for s in samples if s[2] == 0)
+    periods = [b - a for a, b in zip(stamps, stamps[1:])]
+    if interval > 0 and periods:
+        errors = sorted(abs(p - interval) for p in periods)
+        result['period_error_mean'] = round(sum(errors) / len(errors), 6)
+        result['period_error_max'] = round(errors[-1], 6)
+
+    return result
+
+
+def _bench(args):
+    cmd = [sys.executable, '-m', 'hepscore.pdusim', 'serve', '--pdus', str(args.pdus)]
+    for opt, value in _sim_options(args).items():
+        if value is not None and opt != 'outlets':
+            cmd += ['--' + opt, str(value)]
+    # every PDU serves enough outlets for the largest case
+    cmd += ['--outlets', str(max(args.outlets) // args.pdus + 1)]
+
+    # the simulators run in their own process, out of the CPU measurement
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True) as sim:
+        try:
+            addresses = [sim.stdout.readline().strip() for _ in range(args.pdus)]
+            results = [bench_sampler(addresses, outlets, interval, args.duration)
+                       for outlets in args.outlets for interval in args.interval]
+        finally:
+            sim.terminate()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    columns = ('outlets', 'interval', 'samples_per_s', 'ticks_per_s', 'late_ticks',
+               'missed_ticks', 'errors', 'period_error_mean', 'period_error_max',
+               'cpu_percent')
+    print('  '.join(columns))
+    for res in results:
+        print('  '.join('%*s' % (len(col), res.get(col, '-')) for col in columns))
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Simulated SNMP PDUs")
+    sub = parser.add_subparsers(dest='command', required=True)
+    serve_p = sub.add_parser('serve', help="run simulated PDUs, printing their addresses")
+    bench_p = sub.add_parser('bench', help="benchmark the power sampler")
+
+    def floats(text):
+        return [float(v) for v in text.split(',')]
+
+    for sub_p in (serve_p, bench_p):
+        sub_p.add_argument('--pdus', type=int, default=1, help="number of PDUs (default 1)")
+        sub_p.add_argument('--latency', type=float, default=0.0,
+                           help="response latency in seconds (default 0)")
+        sub_p.add_argument('--jitter', type=float, default=0.0,
+                           help="latency jitter in seconds (default 0)")
+        sub_p.add_argument('--loss', type=float, default=0.0,
+                           help="fraction of requests dropped (default 0)")
+        sub_p.add_argument('--waveform', choices=WAVEFORMS, default='constant',
+                           help="outlet power waveform (default constant)")
+        sub_p.add_argument('--base', type=float, default=200.0,
+                           help="mean outlet power in watts (default 200)")
+        sub_p.add_argument('--amplitude', type=float, default=50.0,
+                           help="waveform amplitude in watts (default 50)")
+        sub_p.add_argument('--period', type=float, default=60.0,
+                           help="waveform period in seconds (default 60)")
+        sub_p.add_argument('--seed', type=int, default=None, help="random seed")
+    serve_p.add_argument('--host', default='127.0.0.1', help="listen address (default 127.0.0.1)")
+    serve_p.add_argument('--port', type=int, default=0,
+                         help="UDP port of the first PDU, the next ones follow (default: any)")
+    serve_p.add_argument('--outlets', type=int, default=2, help="outlets per PDU (default 2)")
+    bench_p.add_argument('--outlets', type=lambda t: [int(v) for v in t.split(',')],
+                         default=[1, 10, 100], help="outlet counts (default 1,10,100)")
+    bench_p.add_argument('--interval', type=floats, default=[1.0, 0.1, 0.0],
+                         help="poll intervals, 0 polls back to back (default 1,0.1,0)")
+    bench_p.add_argument('--duration', type=float, default=10.0,
+                         help="seconds per case (default 10)")
+    bench_p.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    if args.command == 'serve':
+        try:
+            asyncio.run(_serve_forever(args))
+        except KeyboardInterrupt:
+            pass
+    else:
+        _bench(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+power.py - PDU power sampling during HEPscore runs
+
+Copyright 2019-2021 CERN. See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+
+import asyncio
+import json
+import logging
+import queue
+import threading
+import time
+from hepscore.timeseries import TimeSeriesWriter
+from pysnmp.hlapi.v3arch.asyncio import CommunityData, ContextData, EndOfMibView, \
+    NoSuchInstance, NoSuchObject, ObjectIdentity, ObjectType, SnmpEngine, UdpTransportTarget, \
+    get_cmd
+
+logger = logging.getLogger(__name__)
+
+OUTLET_OID = ".1.3.6.1.4.1.13742.6.5.4.3.1.4.1."
+COMMUNITY = 'LHCsnmpL88k'
+SNMP_PORT = 161
+LATE_TOLERANCE = 0.1  # fraction of the interval a poll may start after its tick
+
+
+RECONNECT_DELAY = 1.0  # seconds between attempts to reach the power daemon
+
+
+def pdu_address(ip):
+    """Split a PDU address of the form host[:port] into (host, port)"""
+    host, _, port = ip.partition(':')
+    return host, int(port) if port else SNMP_PORT
+
+
+def daemon_address(address):
+    """Split a power daemon address of the form unix:PATH or HOST:PORT
+
+    Returns:
+        2-tuple (str, str or tuple): 'unix' and a socket path, or 'tcp'
+        and (host, port)
+    """
+    if address.startswith('unix:'):
+        return 'unix', address[len('unix:'):]
+    host, _, port = address.rpartition(':')
+    return 'tcp', (host or 'localhost', int(port))
+
+
+def outlet_number(oid):
+    """Return the outlet number of an outlet OID, as written in etc/data.yaml"""
+    return oid[len(OUTLET_OID):] if oid.startswith(OUTLET_OID) else oid
+
+
+async def _poll_pdu(engine, transport, outlets, oid, power, stats):
+    """Read all outlets served by one PDU in a single request
+
+    Failed requests and outlets without a power reading (eg NoSuchInstance
+    for an outlet the PDU does not have) are counted in stats and skipped,
+    so that they do not end the polling of the other PDUs.
+    """
+    objects = [ObjectType(ObjectIdentity(oid[i] + ".5")) for i in outlets]
+    start = time.perf_counter()
+    try:
+        errorIndication, errorStatus, errorIndex, varBinds = await get_cmd(
+            engine,
+            CommunityData(COMMUNITY, mpModel=1),
+            transport,
+            ContextData(),
+            *objects)
+    except Exception as err:  # pylint: disable=broad-except
+        stats['errors'] += 1
+        logger.warning("SNMP error: %s", err)
+        return
+    latency = time.perf_counter() - start
+    now = time.monotonic()
+
+    stats['polls'] += 1
+    stats['latency_total'] += latency
+    stats['latency_max'] = max(stats['latency_max'], latency)
+    if errorIndication:
+        stats['errors'] += 1
+        logger.warning("SNMP error: %s", errorIndication)
+    elif errorStatus:
+        stats['errors'] += 1
+        logger.warning("SNMP error: %s", errorStatus.prettyPrint())
+    else:
+        for i, varBind in zip(outlets, varBinds):
+            try:
+                if isinstance(varBind[1], (NoSuchInstance, NoSuchObject, EndOfMibView)):
+                    raise ValueError(varBind[1].__class__.__name__)
+                watts = float(varBind[1])
+            except (TypeError, ValueError) as err:
+                stats['invalid'] += 1
+                if i not in stats.setdefault('invalid_outlets', set()):
+                    stats['invalid_outlets'].add(i)
+                    logger.warning("No power reading for outlet %s: %s", oid[i], err)
+                continue
+            power.put((now, watts, i))
+
+
+async def getPowerReadings(interval, IPs, stop, power, oid, stats=None, clock=None):
+    """Poll PDU outlet power every interval until stop is set
+
+    Each PDU is queried once per poll for all of its outlets, and all PDUs
+    are queried concurrently over a transport kept for the whole run.
+    Polls are scheduled on fixed ticks of the monotonic clock, so that the
+    sampling period does not depend on the SNMP round trip time.  Ticks
+    that cannot be honoured because the previous poll overran are skipped.
+
+    Args:
+        interval (float): seconds between polls
+        IPs (list[str]): PDU address of each outlet, as host[:port]
+        stop (threading.Event): ends sampling when set
+        power (queue.SimpleQueue): receives (monotonic timestamp, watts, outlet index)
+        oid (list[str]): outlet OID of each outlet, without the sensor suffix
+        stats (dict, optional): receives polls, errors and latency per PDU
+        clock (dict, optional): receives the number of polled, late and missed ticks
+    """
+    if len(IPs) == 0:
+        return
+    if stats is None:
+        stats = {}
+    if clock is None:
+        clock = {}
+
+    # outlets served by each PDU
+    pdus = {}
+    for i, ip in enumerate(IPs):
+        pdus.setdefault(ip, []).append(i)
+
+    engine = SnmpEngine()
+    transports = {}
+    for ip in pdus:
+        transports[ip] = await UdpTransportTarget.create(pdu_address(ip))
+        stats[ip] = {'polls': 0, 'errors': 0, 'invalid': 0, 'latency_total': 0.0,
+                     'latency_max': 0.0}
+
+    clock.update({'ticks': 0, 'late': 0, 'missed': 0, 'max_lateness': 0.0})
+    start = time.monotonic()
+    tick = 0
+    while not stop.is_set():
+        deadline = start + tick * interval
+        now = time.monotonic()
+        if now < deadline:
+            await asyncio.sleep(deadline - now)
+            now = time.monotonic()
+
+        lateness = now - deadline
+        if interval > 0 and lateness >= interval:
+            # the previous poll overran: skip to the current tick
+            missed = int(lateness // interval)
+            clock['missed'] += missed
+            tick += missed
+            lateness -= missed * interval
+        if interval > 0 and lateness > LATE_TOLERANCE * interval:
+            clock['late'] += 1
+        clock['max_lateness'] = max(clock['max_lateness'], lateness)
+        clock['ticks'] += 1
+        tick += 1
+
+        await asyncio.gather(*[_poll_pdu(engine, transports[ip], outlets, oid, power, stats[ip])
+                               for ip, outlets in pdus.items()])
+
+
+async def _open_daemon(address):
+    kind, where = daemon_address(address)
+    if kind == 'unix':
+        return await asyncio.open_unix_connection(where)
+    return await asyncio.open_connection(*where)
+
+
+async def subscribePowerReadings(address, IPs, stop, power, oid, anchor, stats=None):
+    """Receive PDU outlet power from a polling daemon until stop is set
+
+    The daemon (see `hepscore.pdud`) publishes one JSON line per outlet
+    sample, timestamped on the wall clock.  Samples are moved onto the
+    monotonic clock with `anchor`, which assumes the clocks of the daemon
+    and of this host are synchronised.  The connection is re-established
+    if it drops.
+
+    Args:
+        address (str): daemon address, unix:PATH or HOST:PORT
+        IPs (list[str]): PDU address of each outlet
+        stop (threading.Event): ends sampling when set
+        power (queue.SimpleQueue): receives (monotonic timestamp, watts, outlet index)
+        oid (list[str]): outlet OID of each outlet
+        anchor (dict): 'wall' and 'monotonic' time taken at the same instant
+        stats (dict, optional): receives the number of samples and errors,
+                                and the age of samples on receipt
+    """
+    if stats is None:
+        stats = {}
+    stats.update({'polls': 0, 'errors': 0, 'latency_total': 0.0, 'latency_max': 0.0})
+    outlets = [[ip, outlet_number(od)] for ip, od in zip(IPs, oid)]
+    index = {tuple(outlet): i for i, outlet in enumerate(outlets)}
+
+    while not stop.is_set():
+        try:
+            reader, writer = await _open_daemon(address)
+        except OSError as err:
+            stats['errors'] += 1
+            logger.warning("Cannot reach power daemon %s: %s", address, err)
+            await asyncio.sleep(RECONNECT_DELAY)
+            continue
+
+        try:
+            writer.write((json.dumps({'outlets': outlets}) + '\n').encode())
+            hello = json.loads(await reader.readline() or b'{}')
+            if hello.get('missing'):
+                logger.warning("Power daemon does not poll outlets %s", hello['missing'])
+            while not stop.is_set():
+                try:
+                    line = await asyncio.wait_for(reader.readline(), RECONNECT_DELAY)
+                except asyncio.TimeoutError:
+                    continue
+                if not line:
+                    raise ConnectionError("connection closed by daemon")
+                sample = json.loads(line)
+                i = index.get((sample['pdu'], sample['outlet']))
+                if i is None:
+                    continue
+                age = time.time() - sample['time']
+                power.put((anchor['monotonic'] + sample['time'] - anchor['wall'],
+                           float(sample['watts']), i))
+                stats['polls'] += 1
+                stats['latency_total'] += age
+                stats['latency_max'] = max(stats['latency_max'], age)
+        except (OSError, ValueError, KeyError) as err:
+            stats['errors'] += 1
+            logger.warning("Power daemon %s: %s", address, err)
+            await asyncio.sleep(RECONNECT_DELAY)
+        finally:
+            writer.close()
+
+
+class _Recorder():
+    """Queue samples for the caller and append them to a series file"""
+
+    def __init__(self, samples, writer):
+        self.samples = samples
+        self.writer = writer
+
+    def put(self, sample):
+        self.samples.put(sample)
+        self.writer.append(sample)
+
+
+class PowerSampler():
+    """Sample PDU outlet power in a background thread
+
+    The sampler runs its own asyncio event loop on a dedicated thread.
+    Samples are handed over through a queue and collected by `stop()`,
+    and optionally appended to a time series file as they arrive.  The
+    PDUs are polled directly, or the samples are received from a polling
+    daemon shared by the hosts of a rack.
+    """
+
+    def __init__(self, IPs, oids, interval=1.0, store=None, daemon=None):
+        """Args:
+            IPs (list[str]): PDU address of each outlet
+            oids (list[str]): outlet OID of each outlet
+            interval (float, optional): seconds between polls. Default: 1.0
+            store (str, optional): time series file receiving the samples
+            daemon (str, optional): address of a polling daemon, unix:PATH or
+                                    HOST:PORT, to subscribe to instead of polling
+        """
+        self.IPs = list(IPs)
+        self.oids = list(oids)
+        self.interval = float(interval)
+        self.store = store
+        self.daemon = daemon
+        self.samples = queue.SimpleQueue()
+        self.stats = {}
+        self.clock = {}
+        self.anchor = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        sink = self.samples
+        writer = None
+        if self.store is not None:
+            try:
+                writer = TimeSeriesWriter(self.store, ('monotonic', 'watts', 'outlet'),
+                                          {'anchor': self.anchor, 'interval': self.interval,
+                                           'IPs': self.IPs, 'oids': self.oids})
+                sink = _Recorder(self.samples, writer)
+            except OSError as err:
+                logger.error("Cannot store power samples in %s: %s", self.store, err)
+        if self.daemon:
+            sampling = subscribePowerReadings(self.daemon, self.IPs, self._stop, sink, self.oids,
+                                              self.anchor, self.stats.setdefault(self.daemon, {}))
+        else:
+            sampling = getPowerReadings(self.interval, self.IPs, self._stop,
+                                        sink, self.oids, self.stats, self.clock)
+        try:
+            asyncio.run(sampling)
+        except Exception as err:  # pylint: disable=broad-except
+            logger.error("Power sampling stopped: %s", err)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def start(self):
+        """Start sampling"""
+        if len(self.IPs) != len(self.oids):
+            logger.error("PDU addresses and outlets do not match: not sampling power")
+            return
+        if self.daemon:
+            logger.info("Receiving power of %d PDU outlets from %s", len(self.IPs), self.daemon)
+        else:
+            logger.info("Sampling power of %d PDU outlets every %ss",
+                        len(self.IPs), self.interval)
+        # relates the monotonic sample timestamps to wall-clock time
+        self.anchor = {'wall': time.time(), 'monotonic': time.monotonic()}
+        self._thread = threading.Thread(target=self._sample, name='power-sampler',
+                                        daemon=True)
+        self._thread.start()
+
+    def drain(self):
+        """Return and remove the samples collected so far
+
+        Returns:
+            list[tuple]: (monotonic timestamp, watts, outlet index) samples
+        """
+        samples = []
+        while True:
+            try:
+                samples.append(self.samples.get_nowait())
+            except queue.Empty:
+                return samples
+
+    def stop(self):
+        """Stop sampling and return all remaining samples
+
+        Returns:
+            list[tuple]: (monotonic timestamp, watts, outlet index) samples
+        """
+        self._stop.set()
+        if self._thread is not None:
+            # allow for an in-flight poll, which may time out and retry
+            self._thread.join(self.interval + 15)
+            if self._thread.is_alive():
+                logger.warning("Power sampler did not stop in time")
+        return self.drain()
+
+    def summary(self):
+        """Summarise polling of each PDU
+
+        Returns:
+            dict: sampling interval, number of polled, late and missed ticks,
+                  and per PDU the number of polls, errors and outlet
+                  readings without a value, mean and maximum round trip
+                  (seconds), and the highest sample rate (Hz) the slowest
+                  PDU allows
+        """
+        pdus = {}
+        slowest = 0.0
+        for ip, pdu in dict(self.stats).items():
+            mean = pdu['latency_total'] / pdu['polls'] if pdu['polls'] else 0.0
+            slowest = max(slowest, mean)
+            pdus[ip] = {'polls': pdu['polls'],
+                        'errors': pdu['errors'],
+                        'invalid': pdu.get('invalid', 0),
+                        'latency_mean': round(mean, 6),
+                        'latency_max': round(pdu['latency_max'], 6)}
+
+        summary = {'interval': self.interval, 'pdus': pdus}
+        if self.clock:
+            summary['ticks'] = self.clock['ticks']
+            summary['late_ticks'] = self.clock['late']
+            summary['missed_ticks'] = self.clock['missed']
+            summary['max_lateness'] = round(self.clock['max_lateness'], 6)
+        if self.daemon:
+            # latencies are the age of the samples received from the daemon
+            summary['daemon'] = self.daemon
+        elif slowest > 0:
+            summary['max_rate'] = round(1.0 / slowest, 3)
+        return summary
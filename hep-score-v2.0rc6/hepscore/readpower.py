@@ -4,8 +4,12 @@ import base64
 import sys
 from datetime import datetime
 import socket
+import json
+import os
 import urllib3.util.connection
+from hepscore.timeseries import load_series
 token = sys.argv[1]
+resultsdir = sys.argv[2] if len(sys.argv) > 2 else "."
 def ipv4_only_create_connection(address, *args, **kwargs):
     kwargs.pop('socket_options', None)
     return socket.create_connection((socket.gethostbyname(address[0]), address[1]), *args, **kwargs)
@@ -39,8 +43,13 @@ data = {
 res = requests.put(url, headers=headers, json=data)
 res.raise_for_status()
 print(" File committed")
-with open("power.json", "r") as f:
-    powerData = f.read()
+with open(os.path.join(resultsdir, "power.json"), "r") as f:
+    index = json.load(f)
+if index.get("series"):
+    meta, series = load_series(os.path.join(resultsdir, index["series"]))
+    index["power"] = [(t, w, int(o)) for t, w, o in
+                      zip(*(series[c].tolist() for c in meta["columns"]))]
+powerData = json.dumps(index)
 
 fileName2 = f"{get_dell_serial_linux()}+{datetime.now()}"
 
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+rescore.py - Rescore many HEPscore results directories at once
+
+Every HEPscore results directory found under the given trees is rescored
+with the reference scores, weights and scaling of a configuration, without
+replaying the runs one directory at a time.  The workload summaries are
+parsed by a pool of processes, and the scores of all directories are then
+computed together with `hepscore.stats`:
+
+    $ hep-score-rescore -f new-refs.yaml -o scores.csv /archive/fleet
+
+Copyright 2019-2021 CERN. See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import glob
+import json
+import logging
+import math
+import os
+import sys
+import numpy as np
+import hepscore.hepscore as hepscore
+from hepscore import stats
+
+logger = logging.getLogger(__name__)
+
+SCOREKEY = 'wl-scores'
+
+
+def workload_layout(confobj):
+    """Summary file name and sub-scores of each configured workload
+
+    Args:
+        confobj (dict): 'hepscore' section of a configuration
+
+    Returns:
+        dict: {benchmark: (summary file name, [sub-score names])}
+    """
+    layout = {}
+    for benchmark, bench_conf in confobj['benchmarks'].items():
+        if benchmark.startswith('.'):
+            continue
+        summary = bench_conf.get('results_file', benchmark + '_summary.json')
+        layout[benchmark] = (summary, list(bench_conf['ref_scores']))
+    return layout
+
+
+def find_results(trees, benchmarks):
+    """Find results directories, holding a directory for any of benchmarks
+
+    Args:
+        trees (list[str]): directories to search
+        benchmarks (list[str]): benchmark names
+
+    Returns:
+        list[str]: sorted results directories
+    """
+    found = []
+    for tree in trees:
+        for dirpath, dirnames, _ in os.walk(tree):
+            if any(bmk in dirnames for bmk in benchmarks):
+                found.append(dirpath)
+                # do not look for results inside a results directory
+                dirnames[:] = []
+    return sorted(found)
+
+
+def _host(resultsdir):
+    """Host name recorded in the report of a results directory, if any"""
+    for report in glob.glob(os.path.join(resultsdir, '*.json')):
+        try:
+            with open(report, mode='r') as jfile:
+                system = json.load(jfile)['environment']['system']
+            return system.split(' ')[1]
+        except (OSError, ValueError, KeyError, TypeError, IndexError):
+            continue
+    return ''
+
+
+def read_results(resultsdir, layout):
+    """Read the sub-scores of every run in a results directory
+
+    Args:
+        resultsdir (str): results directory
+        layout (dict): see `workload_layout`
+
+    Returns:
+        dict: 'resultsdir', 'host', and 'runs': {benchmark: list of sub-score
+        lists, NaN for a missing sub-score}
+    """
+    runs = {}
+    for benchmark, (summary, subs) in layout.items():
+        runs[benchmark] = []
+        for gpath in sorted(glob.glob(os.path.join(resultsdir, benchmark, 'run*', summary))):
+            try:
+                with open(gpath, mode='r') as jfile:
+                    scores = json.load(jfile)['report'][SCOREKEY]
+                runs[benchmark].append([float(scores.get(sub, math.nan)) for sub in subs])
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as err:
+                logger.debug("Ignoring %s: %s", gpath, err)
+
+    return {'resultsdir': resultsdir, 'host': _host(resultsdir), 'runs': runs}
+
+
+def rescore(results, confobj):
+    """Score a batch of results directories
+
+    Workload scores are the median of the run scores, as in a HEPscore
+    run, and are not valid unless the expected number of runs have all
+    their sub-scores.
+
+    Args:
+        results (list[dict]): see `read_results`
+        confobj (dict): 'hepscore' section of a configuration
+
+    Returns:
+        2-tuple (list[str], ndarray): benchmarks, and the scores of each
+        results directory, shape (directories, benchmarks + 1); the last
+        column is the final score.  Invalid scores are NaN.
+    """
+    settings = confobj['settings']
+    layout = workload_layout(confobj)
+    benchmarks = list(layout)
+    repetitions = int(settings['repetitions'])
+    max_runs = max(repetitions, int(settings.get('max_repetitions', repetitions)))
+
+    wl_scores = np.full((len(results), len(benchmarks)), np.nan)
+    for col, benchmark in enumerate(benchmarks):
+        refs = [confobj['benchmarks'][benchmark]['ref_scores'][sub] for sub in layout[benchmark][1]]
+        width = max([len(res['runs'][benchmark]) for res in results] + [1])
+        subs = np.full((len(results), width, len(refs)), np.nan)
+        for row, res in enumerate(results):
+            if res['runs'][benchmark]:
+                subs[row, :len(res['runs'][benchmark])] = res['runs'][benchmark]
+
+        run_scores = stats.workload_scores(subs, refs)
+        valid = ~np.isnan(run_scores)
+        count = valid.sum(axis=1)
+        ok = (count == repetitions) if max_runs == repetitions else \
+            (count >= repetitions) & (count <= max_runs)
+        # rows without any valid run are not scored: keep nanmedian quiet
+        median = np.nanmedian(np.where(count[:, None] > 0, run_scores, 0.0), axis=1)
+        wl_scores[:, col] = np.where(ok, median, np.nan)
+
+    weights = [float(confobj['benchmarks'][bmk].get('weight', 1.0)) for bmk in benchmarks]
+    final = stats.suite_scores(wl_scores, weights, float(settings.get('scaling', 1.0)))
+    return benchmarks, np.column_stack((wl_scores, final))
+
+
+def write_table(results, benchmarks, scores, out, fmt='csv'):
+    """Write one row of scores per results directory
+
+    Args:
+        results (list[dict]): see `read_results`
+        benchmarks (list[str]): benchmark names
+        scores (ndarray): see `rescore`
+        out (file): output stream
+        fmt (str, optional): 'csv' or 'json'. Default: 'csv'
+    """
+    rows = []
+    for res, row in zip(results, scores):
+        entry = {'resultsdir': res['resultsdir'], 'host': res['host']}
+        entry.update({bmk: None if math.isnan(val) else round(float(val), 4)
+                      for bmk, val in zip(benchmarks, row[:-1])})
+        entry['score'] = None if math.isnan(row[-1]) else float(row[-1])
+        entry['status'] = 'failed' if entry['score'] is None else 'success'
+        rows.append(entry)
+
+    if fmt == 'json':
+        json.dump(rows, out, indent=1)
+        out.write('\n')
+        return
+
+    writer = csv.DictWriter(out, ['resultsdir', 'host'] + benchmarks + ['score', 'status'])
+    writer.writeheader()
+    writer.writerows(rows)
+
+
+def main(argv=None):
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description="Rescore HEPscore results directories")
+    parser.add_argument('trees', nargs='+', metavar='TREE',
+                        help="directories searched for HEPscore results directories")
+    parser.add_argument('-f', '--conffile', default=None,
+                        help="configuration providing the reference scores, weights and "
+                             "scaling (default: the default HEPscore configuration)")
+    parser.add_argument('-b', '--builtinconf', default=None,
+                        help="use the named built-in configuration")
+    parser.add_argument('-o', '--outfile', default=None, help="output file (default: stdout)")
+    parser.add_argument('-J', '--jobs', type=int, default=None,
+                        help="processes parsing results (default: one per core)")
+    parser.add_argument('--json', action='store_true', help="write JSON instead of CSV")
+    parser.add_argument('-v', '--verbose', action='store_true', help="display debug messages")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO,
+                        format='%(asctime)s hepscore [%(levelname)s] %(message)s')
+
+    if args.builtinconf:
+        conffile = hepscore.named_conf(args.builtinconf)
+    else:
+        conffile = args.conffile or os.path.join(hepscore.config_path, 'hepscore-default.yaml')
+    config = hepscore.read_yaml(conffile)
+    confobj = config.get('hepscore', config.get('hepscore_benchmark'))
+    if confobj is None:
+        logger.error("Required 'hepscore' key not in configuration!")
+        sys.exit(1)
+
+    layout = workload_layout(confobj)
+    dirs = find_results(args.trees, list(layout))
+    logger.info("Rescoring %d results directories", len(dirs))
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(read_results, dirs, [layout] * len(dirs),
+                                chunksize=max(1, len(dirs) // (4 * (os.cpu_count() or 1)))))
+
+    benchmarks, scores = rescore(results, confobj)
+    if args.outfile:
+        with open(args.outfile, mode='w', newline='') as out:
+            write_table(results, benchmarks, scores, out, 'json' if args.json else 'csv')
+    else:
+        write_table(results, benchmarks, scores, sys.stdout, 'json' if args.json else 'csv')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+sampler.py - Background sampling of the host while a workload runs
+
+`Sampler` runs a thread taking a sample every interval until it is stopped,
+appends the samples to a time series file (see `hepscore.timeseries`) and
+keeps the first and last of them for the summary of the run.  Subclasses
+only say how to take a sample and how to summarise the run, see
+`hepscore.telemetry` and `hepscore.cpustate`.
+
+Copyright 2019-2021 CERN. See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def read(path):
+    """Content of a sysfs, cgroup or /proc file, stripped; None if it cannot be read"""
+    try:
+        with open(path, mode='r') as sfile:
+            return sfile.read().strip()
+    except OSError:
+        return None
+
+
+class Sampler():
+    """Take samples in a background thread until stopped
+
+    Subclasses set `columns` (the first being 'monotonic') and implement
+    `sample` and `summary`.  Every row is the monotonic time of the sample
+    followed by the values returned by `sample`, as floats.
+    """
+
+    name = 'sampler'  # name of the thread
+    description = 'samples'  # what is sampled, for messages
+    join_timeout = 1  # seconds the last sample may take, beyond the interval
+
+    def __init__(self, store=None, interval=1.0, columns=(), meta=None):
+        """Args:
+            store (str, optional): time series file receiving the samples
+            interval (float, optional): seconds between samples. Default: 1.0
+            columns (tuple[str], optional): columns of the rows
+            meta (dict, optional): metadata stored with the time series
+        """
+        self.store = store
+        self.interval = float(interval)
+        self.columns = tuple(columns)
+        self.meta = meta or {}
+        self.anchor = {}
+        self.samples = 0
+        self.first = None
+        self.last = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        """Take one sample
+
+        Returns:
+            tuple: values of the columns but 'monotonic', or None if there is
+            nothing to sample yet
+        """
+        raise NotImplementedError
+
+    def summary(self):
+        """Summary of the run, see `stop`"""
+        raise NotImplementedError
+
+    def _open(self):
+        if self.store is None:
+            return None
+        from hepscore.timeseries import TimeSeriesWriter
+        try:
+            return TimeSeriesWriter(self.store, self.columns,
+                                    dict(self.meta, anchor=self.anchor, interval=self.interval))
+        except OSError as err:
+            logger.error("Cannot store %s in %s: %s", self.description, self.store, err)
+            return None
+
+    def _run(self):
+        writer = self._open()
+        try:
+            while True:
+                values = self.sample()
+                if values is not None:
+                    row = (time.monotonic(),) + tuple(float(val) for val in values)
+                    self.samples += 1
+                    if self.first is None:
+                        self.first = row
+                    self.last = row
+                    if writer is not None:
+                        writer.append(row)
+                if self._stop.wait(self.interval):
+                    break
+        except Exception as err:  # pylint: disable=broad-except
+            logger.error("Sampling of %s stopped: %s", self.description, err)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def start(self):
+        """Start sampling"""
+        # relates the monotonic sample timestamps to wall-clock time
+        self.anchor = {'wall': time.time(), 'monotonic': time.monotonic()}
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling
+
+        Returns:
+            dict: summary of the run, see `summary`
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(self.interval + self.join_timeout)
+        return self.summary()
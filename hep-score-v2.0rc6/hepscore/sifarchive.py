@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+sifarchive.py - Use SIF images straight from an uncompressed tar archive
+
+The image archives built by archive_images.py are plain tar files, so every
+SIF is stored as a contiguous byte range of the archive.  A member index
+(name -> offset and size of the data) is read from the tar headers only,
+and kept next to the archive as ARCHIVE.index.json, or shipped with it.
+
+A workload then gets its image as a file cloned from that byte range with
+copy_file_range(2): on filesystems with reflinks (XFS, Btrfs) no data is
+copied at all, elsewhere the kernel copies the one image the workload needs.
+The archive is never extracted, and the image is removed once the workload
+is done.
+
+Copyright 2019-2021 CERN. See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+
+import json
+import logging
+import os
+import tarfile
+
+logger = logging.getLogger(__name__)
+
+INDEX_SUFFIX = '.index.json'
+BLOCK = 512  # tar header size
+CHUNK = 1 << 24  # bytes copied at once without copy_file_range
+
+
+def build_index(archive):
+    """Offsets and sizes of the regular file members of a tar archive
+
+    Only the headers are read; the member data is skipped over.
+
+    Args:
+        archive (str): path of an uncompressed tar archive
+
+    Returns:
+        dict: 'size' of the archive and 'members', name -> [offset, size]
+    """
+    members = {}
+    with tarfile.open(archive, mode='r:') as tar:
+        for member in tar:
+            if member.isfile() and not member.issparse():
+                members[member.name] = [member.offset_data, member.size]
+    return {'size': os.path.getsize(archive), 'members': members}
+
+
+def _valid_member(afile, name, offset, size):
+    """Check that the tar header preceding offset describes name and size"""
+    if offset < BLOCK:
+        return False
+    afile.seek(offset - BLOCK)
+    try:
+        header = tarfile.TarInfo.frombuf(afile.read(BLOCK), tarfile.ENCODING, 'surrogateescape')
+    except tarfile.TarError:
+        return False
+    # long names are truncated in the header itself
+    return header.size == size and name.startswith(header.name)
+
+
+def load_index(archive, rebuild=False):
+    """Member index of archive, from ARCHIVE.index.json when it matches
+
+    The index is built and saved when it is missing or stale.  A read-only
+    archive directory only means the index is built again next time.
+
+    Args:
+        archive (str): path of an uncompressed tar archive
+        rebuild (bool, optional): ignore the saved index. Default: False
+
+    Returns:
+        dict: see `build_index`
+    """
+    index_file = archive + INDEX_SUFFIX
+    try:
+        if not rebuild:
+            with open(index_file, mode='r') as ifile:
+                index = json.load(ifile)
+            if index['size'] == os.path.getsize(archive) and isinstance(index['members'], dict):
+                return index
+            logger.debug("Stale index %s", index_file)
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+
+    logger.info("Indexing image archive %s", archive)
+    index = build_index(archive)
+    tmp = "%s.%d.tmp" % (index_file, os.getpid())
+    try:
+        with open(tmp, mode='w') as ifile:
+            json.dump(index, ifile, indent=1)
+        os.replace(tmp, index_file)
+    except OSError as err:
+        logger.debug("Failed to save index %s: %s", index_file, err)
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    return index
+
+
+def _copy_range(afile, ofile, offset, size):
+    """Copy size bytes at offset of afile to ofile, in the kernel if possible
+
+    Returns:
+        str: 'copy_file_range' or 'read'
+    """
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    done = 0
+    if copy_file_range is not None:
+        try:
+            while done < size:
+                copied = copy_file_range(afile.fileno(), ofile.fileno(), size - done,
+                                         offset + done, done)
+                if copied == 0:
+                    break
+                done += copied
+            if done == size:
+                return 'copy_file_range'
+        except OSError as err:
+            logger.debug("copy_file_range failed (%s), copying through user space", err)
+
+    afile.seek(offset + done)
+    ofile.seek(done)
+    while done < size:
+        chunk = afile.read(min(CHUNK, size - done))
+        if not chunk:
+            raise OSError("Unexpected end of archive %s" % afile.name)
+        ofile.write(chunk)
+        done += len(chunk)
+    return 'read'
+
+
+def expose(archive, name, target):
+    """Make member name of archive available as the file target
+
+    Args:
+        archive (str): path of an uncompressed tar archive
+        name (str): member name
+        target (str): path of the image file to create
+
+    Returns:
+        str: how the image was exposed, see `_copy_range`
+
+    Raises:
+        KeyError: if name is not in the archive
+        OSError: if the archive cannot be read or target written
+    """
+    index = load_index(archive)
+    with open(archive, mode='rb') as afile:
+        if name in index['members'] and not _valid_member(afile, name, *index['members'][name]):
+            logger.warning("Index of %s does not match the archive, rebuilding it", archive)
+            index = load_index(archive, rebuild=True)
+        if name not in index['members']:
+            raise KeyError("%s is not in %s" % (name, archive))
+        offset, size = index['members'][name]
+
+        tmp = "%s.%d.tmp" % (target, os.getpid())
+        try:
+            with open(tmp, mode='wb') as ofile:
+                method = _copy_range(afile, ofile, offset, size)
+            os.replace(tmp, target)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+    return method
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+stats.py - Vectorised scoring statistics
+
+Scores are ratios, so they are combined in log space: products of many
+ratios neither overflow nor underflow.  Every function reduces along the
+last axis and accepts arrays of any leading shape, so that the results of
+many runs, workloads or machines are processed in a single call.
+
+Copyright 2019-2021 CERN. See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+
+import numpy as np
+
+BOOTSTRAP_SAMPLES = 1000
+
+
+def weighted_geometric_mean(vals, weights=None):
+    """Weighted geometric mean along the last axis
+
+    Args:
+        vals (array-like): scores, shape (..., n)
+        weights (array-like, optional): weights broadcastable to vals.
+                                        Default: equal weights
+
+    Returns:
+        ndarray: geometric means, shape (...); 0 where the total weight is 0
+        or a score is 0, NaN where a score is negative or NaN
+    """
+    vals = np.asarray(vals, dtype=np.float64)
+    if weights is None:
+        weights = np.ones_like(vals)
+    weights = np.broadcast_to(np.asarray(weights, dtype=np.float64), vals.shape)
+
+    total = weights.sum(axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        logs = np.where(weights != 0, weights * np.log(vals), 0.0)
+        mean = np.exp(logs.sum(axis=-1) / total)
+    return np.where(total == 0, 0.0, mean)
+
+
+def median(vals):
+    """Median along the last axis"""
+    return np.median(np.asarray(vals, dtype=np.float64), axis=-1)
+
+
+def mad(vals, relative=False):
+    """Median absolute deviation along the last axis
+
+    Args:
+        vals (array-like): scores, shape (..., n)
+        relative (bool, optional): divide by the median. Default: False
+
+    Returns:
+        ndarray: shape (...)
+    """
+    vals = np.asarray(vals, dtype=np.float64)
+    center = np.median(vals, axis=-1, keepdims=True)
+    dev = np.median(np.abs(vals - center), axis=-1)
+    if relative:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return dev / center[..., 0]
+    return dev
+
+
+def relative_spread(vals):
+    """Range relative to the median along the last axis
+
+    Args:
+        vals (array-like): scores, shape (..., n)
+
+    Returns:
+        ndarray: (max - min) / median, shape (...); 0 for fewer than two
+        values, inf where the median is 0
+    """
+    vals = np.asarray(vals, dtype=np.float64)
+    if vals.shape[-1] < 2:
+        return np.zeros(vals.shape[:-1])
+    center = np.median(vals, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(center == 0, np.inf, np.ptp(vals, axis=-1) / center)
+
+
+def bootstrap_ci(vals, level=0.95, statistic='median', samples=BOOTSTRAP_SAMPLES, seed=None):
+    """Percentile bootstrap confidence interval along the last axis
+
+    The same resampling of positions is applied to every leading index, so
+    a batch costs one fancy-indexing operation.  Intervals of the geometric
+    mean are computed in log space.
+
+    Args:
+        vals (array-like): scores, shape (..., n)
+        level (float, optional): confidence level. Default: 0.95
+        statistic (str, optional): 'median' or 'geometric_mean'. Default: 'median'
+        samples (int, optional): bootstrap resamples. Default: BOOTSTRAP_SAMPLES
+        seed (int, optional): seed of the resampling
+
+    Returns:
+        ndarray: lower and upper bounds, shape (..., 2)
+
+    Raises:
+        ValueError: if statistic is not known
+    """
+    vals = np.asarray(vals, dtype=np.float64)
+    idx = np.random.default_rng(seed).integers(0, vals.shape[-1], (samples, vals.shape[-1]))
+    resampled = vals[..., idx]
+
+    if statistic == 'median':
+        stats = np.median(resampled, axis=-1)
+    elif statistic == 'geometric_mean':
+        with np.errstate(divide='ignore', invalid='ignore'):
+            stats = np.log(resampled).mean(axis=-1)
+    else:
+        raise ValueError("Unknown statistic %s" % statistic)
+
+    tail = (1 - level) / 2 * 100
+    bounds = np.moveaxis(np.percentile(stats, [tail, 100 - tail], axis=-1), 0, -1)
+    return np.exp(bounds) if statistic == 'geometric_mean' else bounds
+
+
+def workload_scores(sub_scores, ref_scores):
+    """Score of each run from its sub-scores, as in a HEPscore report
+
+    Each sub-score is divided by its reference and rounded to 4 decimals,
+    and the run score is their geometric mean rounded to 4 decimals.
+
+    Args:
+        sub_scores (array-like): sub-scores, shape (..., subs)
+        ref_scores (array-like): reference of each sub-score, shape (subs,)
+
+    Returns:
+        ndarray: run scores, shape (...)
+    """
+    ratios = np.round(np.asarray(sub_scores, dtype=np.float64) /
+                      np.asarray(ref_scores, dtype=np.float64), 4)
+    return np.round(weighted_geometric_mean(ratios), 4)
+
+
+def suite_scores(wl_scores, weights=None, scaling=1.0):
+    """HEPscore of each machine from its workload scores
+
+    Args:
+        wl_scores (array-like): workload scores, shape (..., workloads)
+        weights (array-like, optional): weight of each workload
+        scaling (float, optional): factor applied to the geometric mean. Default: 1.0
+
+    Returns:
+        ndarray: scores rounded to 4 decimals, shape (...)
+    """
+    return np.round(weighted_geometric_mean(wl_scores, weights) * scaling, 4)
+
+
+def summarize(vals, level=0.95, seed=None):
+    """Median, MAD, relative spread, bootstrap interval of the median and geometric mean
+
+    Args:
+        vals (array-like): scores, shape (..., n)
+        level (float, optional): confidence level. Default: 0.95
+        seed (int, optional): seed of the bootstrap
+
+    Returns:
+        dict: 'median', 'mad', 'spread' (see `relative_spread`), 'ci'
+        (shape (..., 2)) and 'geometric_mean'
+    """
+    return {'median': median(vals),
+            'mad': mad(vals),
+            'spread': relative_spread(vals),
+            'ci': bootstrap_ci(vals, level, seed=seed),
+            'geometric_mean': weighted_geometric_mean(vals)}
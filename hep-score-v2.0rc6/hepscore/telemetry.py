@@ -0,0 +1,323 @@
+#!/usr/bin/env python3
+"""
+telemetry.py - Resource usage of a workload container while it runs
+
+A sampler thread follows one run of a workload: the CPU time, CPU
+throttling, memory, page faults and block I/O of the container, and the
+network traffic of its network namespace (the host one, for hepscore runs).
+
+Containers with a cgroup of their own (docker, podman) are read from the
+cgroup, v2 or v1.  Singularity/Apptainer containers share the cgroup of
+hepscore, so the processes descending from the container command are read
+from /proc instead; the counters of exited processes are included through
+those of their parents.
+
+Every sample is appended to a time series file (see `hepscore.timeseries`),
+and a summary of the run is returned when sampling stops.
+
+Copyright 2019-2021 CERN. See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+
+import logging
+import math
+import os
+import subprocess
+
+from hepscore import sampler
+
+logger = logging.getLogger(__name__)
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+PROC = '/proc'
+COLUMNS = ('monotonic', 'cpu_seconds', 'throttled_seconds', 'nr_throttled', 'memory_bytes',
+           'page_faults', 'major_page_faults', 'read_bytes', 'write_bytes',
+           'net_rx_bytes', 'net_tx_bytes')
+NAN = float('nan')
+INSPECT_TIMEOUT = 10  # seconds docker inspect may take
+
+
+def _keyed(text):
+    """Parse 'key value' lines, as in cpu.stat or memory.stat"""
+    values = {}
+    for line in (text or '').splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[1].lstrip('-').isdigit():
+            values[parts[0]] = int(parts[1])
+    return values
+
+
+def net_bytes(pid, proc=PROC):
+    """Received and transmitted bytes of the network namespace of pid, loopback excluded"""
+    rx = tx = 0
+    for line in (sampler.read(os.path.join(proc, str(pid), 'net', 'dev')) or '').splitlines()[2:]:
+        iface, _, counters = line.partition(':')
+        counters = counters.split()
+        if iface.strip() != 'lo' and len(counters) >= 9:
+            rx += int(counters[0])
+            tx += int(counters[8])
+    return rx, tx
+
+
+def cgroup_dirs(pid, proc=PROC, root=CGROUP_ROOT):
+    """Cgroup directories of pid, by controller ('' for the cgroup v2 hierarchy)"""
+    # hybrid hierarchies mount cgroup v2 apart from the v1 controllers
+    unified = root if os.path.exists(os.path.join(root, 'cgroup.controllers')) \
+        else os.path.join(root, 'unified')
+    dirs = {}
+    for line in (sampler.read(os.path.join(proc, str(pid), 'cgroup')) or '').splitlines():
+        _, controllers, path = line.split(':', 2)
+        if not controllers:
+            dirs[''] = os.path.join(unified, path.lstrip('/'))
+            continue
+        mount = os.path.join(root, controllers)
+        for controller in controllers.split(','):
+            if not os.path.isdir(mount):
+                mount = os.path.join(root, controller)
+            dirs[controller.replace('name=', '')] = os.path.join(mount, path.lstrip('/'))
+    return dirs
+
+
+class CgroupReader():
+    """Counters of a cgroup"""
+
+    source = 'cgroup'
+
+    def __init__(self, dirs, pid, proc=PROC):
+        """Args:
+            dirs (dict): see `cgroup_dirs`
+            pid (int): a process of the cgroup, for its network namespace
+        """
+        self.dirs = dirs
+        self.pid = pid
+        self.proc = proc
+        self.v2 = set(dirs) == {''}
+        self.path = dirs[''] if self.v2 else dirs.get('memory', dirs.get('cpuacct', ''))
+
+    def _file(self, controller, name):
+        return sampler.read(os.path.join(self.dirs[''] if self.v2 else self.dirs.get(controller, ''),
+                                  name))
+
+    def peak_memory(self):
+        """Highest memory use of the cgroup, None if the kernel does not track it"""
+        peak = self._file('memory', 'memory.peak' if self.v2 else 'memory.max_usage_in_bytes')
+        return int(peak) if peak and peak.strip().isdigit() else None
+
+    def sample(self):
+        """Current counters, in the order of COLUMNS (without the timestamp)"""
+        if self.v2:
+            cpu = _keyed(self._file('cpu', 'cpu.stat'))
+            cpu_seconds = cpu.get('usage_usec', NAN) / 1e6
+            throttled = cpu.get('throttled_usec', NAN) / 1e6
+            current = self._file('memory', 'memory.current')
+            memory = _keyed(self._file('memory', 'memory.stat'))
+            read_bytes = write_bytes = 0
+            for line in (self._file('io', 'io.stat') or '').splitlines():
+                fields = dict(f.split('=', 1) for f in line.split()[1:] if '=' in f)
+                read_bytes += int(fields.get('rbytes', 0))
+                write_bytes += int(fields.get('wbytes', 0))
+        else:
+            cpu = _keyed(self._file('cpu', 'cpu.stat'))
+            usage = self._file('cpuacct', 'cpuacct.usage')
+            cpu_seconds = int(usage) / 1e9 if usage and usage.strip().isdigit() else NAN
+            throttled = cpu.get('throttled_time', NAN) / 1e9
+            current = self._file('memory', 'memory.usage_in_bytes')
+            memory = _keyed(self._file('memory', 'memory.stat'))
+            memory = {key[len('total_'):]: val for key, val in memory.items()
+                      if key.startswith('total_')} or memory
+            read_bytes = write_bytes = 0
+            for line in (self._file('blkio', 'blkio.throttle.io_service_bytes') or '').splitlines():
+                parts = line.split()
+                if len(parts) == 3 and parts[1] == 'Read':
+                    read_bytes += int(parts[2])
+                elif len(parts) == 3 and parts[1] == 'Write':
+                    write_bytes += int(parts[2])
+
+        rx, tx = net_bytes(self.pid, self.proc)
+        return (cpu_seconds, throttled, cpu.get('nr_throttled', NAN),
+                int(current) if current and current.strip().isdigit() else NAN,
+                memory.get('pgfault', NAN), memory.get('pgmajfault', NAN),
+                read_bytes, write_bytes, rx, tx)
+
+
+class ProcReader():
+    """Counters of a process and all its descendants, from /proc"""
+
+    source = 'proc'
+
+    def __init__(self, pid, proc=PROC):
+        self.pid = pid
+        self.proc = proc
+        self.tick = os.sysconf('SC_CLK_TCK')
+        self.page = os.sysconf('SC_PAGE_SIZE')
+        # kernels without CONFIG_PROC_CHILDREN need a scan of all processes
+        self.has_children = os.path.exists(os.path.join(proc, str(pid), 'task', str(pid),
+                                                        'children'))
+
+    def peak_memory(self):
+        return None
+
+    def _children(self, pid):
+        children = []
+        try:
+            tasks = os.listdir(os.path.join(self.proc, str(pid), 'task'))
+        except OSError:
+            return children  # exited since it was listed
+        for task in tasks:
+            text = sampler.read(os.path.join(self.proc, str(pid), 'task', task, 'children'))
+            children.extend(int(child) for child in (text or '').split())
+        return children
+
+    def _scan_children(self):
+        """Children of every process, from the parent pids in /proc/*/stat"""
+        children = {}
+        for entry in os.listdir(self.proc):
+            if entry.isdigit():
+                stat = sampler.read(os.path.join(self.proc, entry, 'stat'))
+                if stat:
+                    ppid = int(stat[stat.rfind(')') + 2:].split()[1])
+                    children.setdefault(ppid, []).append(int(entry))
+        return children
+
+    def processes(self):
+        """The process and its live descendants"""
+        if self.has_children:
+            children = self._children
+        else:
+            children = self._scan_children().get
+        pids = [self.pid]
+        i = 0
+        while i < len(pids):
+            pids.extend(children(pids[i]) or [])
+            i += 1
+        return pids
+
+    def sample(self):
+        """Current counters, in the order of COLUMNS (without the timestamp)"""
+        ticks = rss = minflt = majflt = read_bytes = write_bytes = 0
+        for pid in self.processes():
+            stat = sampler.read(os.path.join(self.proc, str(pid), 'stat'))
+            if not stat:
+                continue  # exited since it was listed
+            fields = stat[stat.rfind(')') + 2:].split()
+            # minflt cminflt majflt cmajflt utime stime cutime cstime, rss
+            minflt += int(fields[7]) + int(fields[8])
+            majflt += int(fields[9]) + int(fields[10])
+            ticks += sum(int(field) for field in fields[11:15])
+            rss += int(fields[21]) * self.page
+            io = _keyed((sampler.read(os.path.join(self.proc, str(pid), 'io')) or '').replace(':', ''))
+            read_bytes += io.get('read_bytes', 0)
+            write_bytes += io.get('write_bytes', 0)
+
+        rx, tx = net_bytes(self.pid, self.proc)
+        return (ticks / self.tick, NAN, NAN, rss, minflt, majflt,
+                read_bytes, write_bytes, rx, tx)
+
+
+def container_pid(cidfile, engine='docker'):
+    """Host pid of the container whose id docker wrote to cidfile, None if not running yet"""
+    cid = sampler.read(cidfile) or ''
+    if not cid:
+        return None
+    try:
+        inspect = subprocess.run([engine, 'inspect', '--format', '{{.State.Pid}}', cid],
+                                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                 timeout=INSPECT_TIMEOUT, check=False)
+        pid = int(inspect.stdout.decode().strip())
+    except (subprocess.SubprocessError, OSError, ValueError):
+        return None
+    return pid if pid > 0 else None
+
+
+def reader(pid, proc=PROC, root=CGROUP_ROOT):
+    """Counter reader of the container whose main process is pid
+
+    The cgroup is used when the container has its own, /proc otherwise.
+    """
+    dirs = cgroup_dirs(pid, proc, root)
+    if dirs and dirs != cgroup_dirs(os.getpid(), proc, root):
+        return CgroupReader(dirs, pid, proc)
+    return ProcReader(pid, proc)
+
+
+class RunSampler(sampler.Sampler):
+    """Sample the resource usage of a container in a background thread"""
+
+    name = 'telemetry'
+    description = 'telemetry'
+    join_timeout = INSPECT_TIMEOUT
+
+    def __init__(self, store=None, interval=1.0, pid=None, cidfile=None, engine='docker'):
+        """Args:
+            store (str, optional): time series file receiving the samples
+            interval (float, optional): seconds between samples. Default: 1.0
+            pid (int, optional): main process of the container
+            cidfile (str, optional): file the container id is written to,
+                                     when the pid is not known
+            engine (str, optional): docker or podman, to look the id up
+        """
+        super().__init__(store, interval, COLUMNS)
+        self.pid = pid
+        self.cidfile = cidfile
+        self.engine = engine
+        self.reader = None
+        self.peak = 0
+
+    def _attach(self):
+        if self.pid is None and self.cidfile is not None:
+            self.pid = container_pid(self.cidfile, self.engine)
+        if self.pid is not None:
+            self.reader = reader(self.pid)
+            logger.debug("Sampling %s of container process %d", self.reader.source, self.pid)
+
+    def sample(self):
+        """Sample the counters of the container, once its process is known
+
+        Returns:
+            tuple: values of COLUMNS but 'monotonic', or None
+        """
+        if self.reader is None:
+            self._attach()
+        if self.reader is None:
+            return None
+        values = self.reader.sample()
+        if not math.isnan(values[3]):
+            self.peak = max(self.peak, values[3])
+        return values
+
+    def summary(self):
+        """Resource usage of the run
+
+        Counters of the container are reported as last sampled; the network
+        counters, of the whole namespace, as their change over the run.
+
+        Returns:
+            dict: source ('cgroup' or 'proc') and number of samples, CPU time
+            (seconds) and mean CPU utilisation (cores), throttled time and
+            periods, peak memory (bytes), minor and major page faults, block
+            I/O and network bytes; empty if no sample was taken
+        """
+        if self.last is None:
+            return {}
+        last = dict(zip(COLUMNS, self.last))
+        first = dict(zip(COLUMNS, self.first))
+        elapsed = last['monotonic'] - self.anchor['monotonic']
+        peak = self.reader.peak_memory() if self.reader is not None else None
+        summary = {'source': self.reader.source,
+                   'cgroup': self.reader.path if self.reader.source == 'cgroup' else None,
+                   'samples': self.samples,
+                   'cpu_seconds': round(last['cpu_seconds'], 3),
+                   'cpu_utilisation': round(last['cpu_seconds'] / elapsed, 3) if elapsed > 0 else None,
+                   'throttled_seconds': round(last['throttled_seconds'], 3),
+                   'nr_throttled': last['nr_throttled'],
+                   'peak_memory_bytes': peak if peak is not None else self.peak,
+                   'page_faults': last['page_faults'],
+                   'major_page_faults': last['major_page_faults'],
+                   'read_bytes': last['read_bytes'],
+                   'write_bytes': last['write_bytes'],
+                   'net_rx_bytes': last['net_rx_bytes'] - first['net_rx_bytes'],
+                   'net_tx_bytes': last['net_tx_bytes'] - first['net_tx_bytes']}
+        return {key: (int(val) if isinstance(val, float) and val.is_integer() else val)
+                for key, val in summary.items()
+                if val is not None and not (isinstance(val, float) and math.isnan(val))}
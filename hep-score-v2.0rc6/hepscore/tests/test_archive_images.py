@@ -0,0 +1,180 @@
+"""
+Copyright 2019-2021 CERN.
+See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+from hepscore import archive_images, sifarchive
+from unittest.mock import patch
+import io
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+import unittest
+
+CONFIG = """hepscore:
+  benchmarks:
+    atlas-bmk:
+      version: {atlas}
+    cms-bmk:
+      version: v2.0
+    .lhcb-bmk:
+      version: v1.1
+  settings:
+    registry:
+      - oras://registry
+"""
+
+
+class Test_delta_archive(unittest.TestCase):
+    """Per-image content-addressed store and set manifests."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cwd = os.getcwd()
+        os.chdir(self.tmpdir.name)
+        self.pulled = []
+        self.remote = {}
+        self.blobs = {}
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.tmpdir.cleanup()
+
+    def fake_pull(self, command, check=False):
+        with self.lock:
+            self.pulled.append(command[-1])
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        # atlas is the slowest to pull
+        time.sleep(0.2 if 'atlas' in command[-1] else 0.05)
+        with open(command[2], 'wb') as sif:
+            # every version of atlas has the same content
+            sif.write(command[-1].rsplit(':', 1)[0].encode() * 100)
+        with self.lock:
+            self.running -= 1
+        return subprocess.CompletedProcess(command, 0)
+
+    def fake_urlopen(self, url):
+        return io.BytesIO(self.blobs[url])
+
+    def run_main(self, atlas='v1.0', extra=()):
+        with open('config.yaml', 'w') as conf:
+            conf.write(CONFIG.format(atlas=atlas))
+        argv = ['-i', 'config.yaml', '-w', 'store', '-a', 'x86_64'] + list(extra)
+        with patch.object(archive_images.subprocess, 'run', side_effect=self.fake_pull), \
+                patch.object(archive_images, 'remote_json',
+                             side_effect=lambda url: self.remote.get(url, {})), \
+                patch.object(archive_images.urllib.request, 'urlopen',
+                             side_effect=self.fake_urlopen), \
+                patch('sys.stdout', new=io.StringIO()):
+            try:
+                archive_images.main(argv)
+            except SystemExit as err:
+                return err.code
+        return 0
+
+    def publish(self):
+        """Copy the upload area in the fake web archive"""
+        for root, _, files in os.walk(os.path.join('store', 'upload')):
+            for name in files:
+                url = 'https://web/%s/%s' % (os.path.basename(root), name)
+                if name.endswith('.json'):
+                    with open(os.path.join(root, name)) as jfile:
+                        self.remote[url] = json.load(jfile)
+                else:
+                    with open(os.path.join(root, name), 'rb') as blob:
+                        self.blobs[url] = blob.read()
+
+    def uploaded(self, folder):
+        upload = os.path.join('store', 'upload')
+        key = os.listdir(upload)[0]
+        return sorted(os.listdir(os.path.join(upload, key, folder)))
+
+    def test_incremental(self):
+        self.assertEqual(self.run_main(), 0)
+        self.assertEqual(sorted(self.pulled), ['oras://registry/atlas-bmk:v1.0_x86_64',
+                                               'oras://registry/cms-bmk:v2.0_x86_64'])
+        manifests = os.listdir(os.path.join('store', 'manifests'))
+        self.assertEqual(len(manifests), 1)
+        with open(os.path.join('store', 'manifests', manifests[0])) as mfile:
+            manifest = json.load(mfile)
+        self.assertEqual(manifest['architecture'], 'x86_64')
+        atlas = manifest['images']['oras://registry/atlas-bmk:v1.0_x86_64']
+        self.assertEqual(atlas['size'], len(b'oras://registry/atlas-bmk') * 100)
+        self.assertTrue(os.path.exists(os.path.join('store', 'blobs', atlas['digest'] + '.sif')))
+        self.assertEqual(len(self.uploaded('blobs')), 2)
+        with open('ssh_command.sh') as ssh:
+            self.assertIn('manifests/' + manifests[0], ssh.read())
+
+        # a new version of one workload, with a fresh working directory
+        self.publish()
+        shutil.rmtree('store')
+        self.pulled = []
+        self.assertEqual(self.run_main('v1.1', ['-r', 'https://web/']), 0)
+        self.assertEqual(self.pulled, ['oras://registry/atlas-bmk:v1.1_x86_64'])
+        self.assertEqual(len(self.uploaded('refs')), 1)
+        # same content as v1.0, already in the web archive
+        self.assertEqual(len(os.listdir(os.path.join('store', 'manifests'))), 1)
+
+        # nothing new to upload
+        self.publish()
+        self.pulled = []
+        self.assertEqual(self.run_main('v1.1', ['-r', 'https://web']), 111)
+        self.assertEqual(self.pulled, [])
+        self.assertEqual(self.uploaded('blobs'), [])
+
+    def test_tar_and_link(self):
+        self.assertEqual(self.run_main(extra=['--tar', '--link', 'registry']), 0)
+        key = os.listdir(os.path.join('store', 'upload'))[0]
+        with tarfile.open(os.path.join('store', key, key + '.tar')) as tar:
+            self.assertEqual(sorted(tar.getnames()), ['atlas-bmk:v1.0_x86_64', 'cms-bmk:v2.0_x86_64'])
+        archive = os.path.join('store', key, key + '.tar')
+        with open(archive + '.index.json') as ifile:
+            self.assertEqual(json.load(ifile), sifarchive.build_index(archive))
+        with open(os.path.join('store', key, key + '_sha256sum.txt')) as shafile:
+            self.assertEqual(shafile.read().split()[1], archive_images.generate_sha256sum(
+                os.path.join('store', key, key + '.tar')))
+        with open(os.path.join('registry', 'cms-bmk:v2.0_x86_64'), 'rb') as sif:
+            self.assertEqual(sif.read(), b'oras://registry/cms-bmk' * 100)
+        with open('scp_command.sh') as scp:
+            self.assertIn(os.path.join('store', key) + ' ', scp.read())
+
+        # images reused from the web archive are fetched for the links
+        self.publish()
+        shutil.rmtree('store')
+        self.pulled = []
+        self.assertEqual(self.run_main(extra=['-r', 'https://web/', '--link', 'registry2']), 111)
+        self.assertEqual(self.pulled, [])
+        with open(os.path.join('registry2', 'cms-bmk:v2.0_x86_64'), 'rb') as sif:
+            self.assertEqual(sif.read(), b'oras://registry/cms-bmk' * 100)
+        with open(os.path.join('registry2', 'atlas-bmk:v1.0_x86_64'), 'rb') as sif:
+            self.assertEqual(sif.read(), b'oras://registry/atlas-bmk' * 100)
+
+    def test_streamed_archive(self):
+        self.assertEqual(self.run_main(extra=['--tar', '-j', '2']), 0)
+        self.assertEqual(self.max_running, 2)
+        key = os.listdir(os.path.join('store', 'upload'))[0]
+        with tarfile.open(os.path.join('store', key, key + '.tar')) as tar:
+            # images are archived as their pulls complete
+            self.assertEqual(tar.getnames(), ['cms-bmk:v2.0_x86_64', 'atlas-bmk:v1.0_x86_64'])
+
+    def test_fetch_digest(self):
+        self.blobs['https://web/blobs/0123.sif'] = b'corrupted'
+        with patch.object(archive_images.urllib.request, 'urlopen',
+                          side_effect=self.fake_urlopen), patch('sys.stdout', new=io.StringIO()):
+            with self.assertRaises(ValueError):
+                archive_images.fetch_blob('https://web', '0123', 'blob.sif')
+        self.assertFalse(os.path.exists('blob.sif'))
+
+
+if __name__ == '__main__':
+    unittest.main()
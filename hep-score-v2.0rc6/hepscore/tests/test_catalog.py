@@ -0,0 +1,106 @@
+"""
+Copyright 2019-2021 CERN.
+See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+from hepscore import catalog
+import hepscore.hepscore as hepscore
+import contextlib
+import copy
+import io
+import json
+import os
+import tempfile
+import unittest
+
+
+class Test_catalog(unittest.TestCase):
+    """Catalogue of HEPscore results."""
+
+    def setUp(self):
+        head, _ = os.path.split(__file__)
+        with open(os.path.join(head, 'data', 'HEPscore_ci_allWLs',
+                               'hepscore_result_expected_output.json')) as jfile:
+            self.report = json.load(jfile)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = os.path.join(self.tmpdir.name, 'cat', 'catalog.sqlite')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _report(self, host, model, score, start='Tue Mar  2 15:53:19 2021'):
+        report = copy.deepcopy(self.report)
+        report['environment'] = {'system': 'Linux %s 5.14 #1 SMP x86_64' % host,
+                                 'arch': 'x86_64', 'cpu_model': model, 'start_at': start,
+                                 'duration': 100, 'available_cores': 64}
+        report['score'] = score
+        report['energy'] = {'joules': 5000.0, 'mean_watts': 50.0}
+        return report
+
+    def test_record(self):
+        conn = catalog.connect(self.db)
+        run, workloads = catalog.report_rows(self._report('node1', 'AMD EPYC', 872.266), '/r/a')
+        self.assertEqual((run['host'], run['start_at'], run['config_hash'][:8]),
+                         ('node1', '2021-03-02 15:53:19', 'da527a89'))
+        self.assertEqual(len(workloads), 6)
+        # the workload scores combine into the final score
+        self.assertAlmostEqual(hepscore.weighted_geometric_mean(
+            [wl['score'] for wl in workloads]) * self.report['settings']['scaling'], 872.266,
+            places=2)
+        self.assertEqual([wl['runs'] for wl in workloads], [3] * 6)
+
+        catalog.record(conn, self._report('node1', 'AMD EPYC', 872.266), '/r/a')
+        catalog.record(conn, self._report('node2', 'AMD EPYC', 900.0), '/r/b')
+        catalog.record(conn, self._report('node3', 'Intel Xeon', -1), '/r/c')
+        # a replayed run replaces its earlier report
+        catalog.record(conn, self._report('node1', 'AMD EPYC', 880.0), '/r/a')
+        self.assertEqual(conn.execute('SELECT count(*) FROM runs').fetchone()[0], 3)
+        self.assertEqual(conn.execute('SELECT count(*) FROM workloads').fetchone()[0], 18)
+        self.assertEqual(conn.execute("SELECT score FROM runs WHERE host = 'node3'").fetchone()[0],
+                         None)
+        plan = ' '.join(row[-1] for row in conn.execute(
+            'EXPLAIN QUERY PLAN SELECT * FROM runs WHERE config_hash = ?', ('x',)))
+        self.assertIn('runs_config_hash', plan)
+        conn.close()
+
+    def test_cli(self):
+        os.makedirs(os.path.join(self.tmpdir.name, 'fleet', 'HEPscore_a'))
+        os.makedirs(os.path.join(self.tmpdir.name, 'fleet', 'HEPscore_b'))
+        for name, host, score in (('HEPscore_a', 'node1', 800.0), ('HEPscore_b', 'node2', 900.0)):
+            with open(os.path.join(self.tmpdir.name, 'fleet', name, 'HEPscore2X.json'), 'w') as out:
+                json.dump(self._report(host, 'AMD EPYC 7742', score), out)
+        catalog.main(['--db', self.db, 'ingest', os.path.join(self.tmpdir.name, 'fleet')])
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            catalog.main(['--db', self.db, '--format', 'json', 'summary', '--cpu_model', '7742'])
+        rows = json.loads(out.getvalue())
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['runs'], rows[0]['mean'], rows[0]['score_per_watt']),
+                         (2, 850.0, 17.0))
+
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            catalog.main(['--db', self.db, '--format', 'json', 'runs', '--host', 'node2',
+                          '--benchmark', 'cms-reco-bmk'])
+        rows = json.loads(out.getvalue())
+        self.assertEqual([row['host'] for row in rows], ['node2'])
+        self.assertAlmostEqual(rows[0]['score'], 2.4418, places=4)
+
+        # queries are read-only
+        with self.assertRaises(SystemExit):
+            catalog.main(['--db', self.db, 'sql', 'DELETE FROM runs'])
+
+    def test_cpu_model(self):
+        cpuinfo = os.path.join(self.tmpdir.name, 'cpuinfo')
+        with open(cpuinfo, 'w') as out:
+            out.write("processor\t: 0\nvendor_id\t: AuthenticAMD\n"
+                      "model name\t: AMD EPYC 7742 64-Core Processor\n\n"
+                      "processor\t: 1\nmodel name\t: AMD EPYC 7742 64-Core Processor\n")
+        self.assertEqual(hepscore.cpu_model(cpuinfo), 'AMD EPYC 7742 64-Core Processor')
+        self.assertEqual(hepscore.cpu_model(os.path.join(self.tmpdir.name, 'none')), '')
+
+
+if __name__ == '__main__':
+    unittest.main()
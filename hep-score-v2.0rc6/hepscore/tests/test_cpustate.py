@@ -0,0 +1,111 @@
+"""
+Copyright 2019-2021 CERN.
+See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+from hepscore import cpustate, timeseries
+import os
+import tempfile
+import unittest
+
+
+class Test_CPUState(unittest.TestCase):
+    """CPU frequency, temperature and throttling from sysfs."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cpu = os.path.join(self.tmpdir.name, 'cpu')
+        self.thermal = os.path.join(self.tmpdir.name, 'thermal')
+        # one package, two cores with two threads each
+        for cpu in range(4):
+            self.write('cpu%d/topology/physical_package_id' % cpu, '0')
+            self.write('cpu%d/topology/thread_siblings_list' % cpu, '%d,%d' % (cpu % 2, cpu % 2 + 2))
+            self.write('cpu%d/cpufreq/scaling_driver' % cpu, 'intel_pstate')
+            self.write('cpu%d/cpufreq/scaling_governor' % cpu, 'performance')
+            self.write('cpu%d/cpufreq/cpuinfo_min_freq' % cpu, '800000')
+            self.write('cpu%d/cpufreq/cpuinfo_max_freq' % cpu, '3500000')
+            self.write('cpu%d/cpufreq/scaling_cur_freq' % cpu, str(2000000 + cpu * 100000))
+            self.write('cpu%d/thermal_throttle/core_throttle_count' % cpu, str(cpu % 2))
+            self.write('cpu%d/thermal_throttle/package_throttle_count' % cpu, '5')
+        self.write('intel_pstate/no_turbo', '0')
+        self.write('thermal_zone0/type', 'x86_pkg_temp', self.thermal)
+        self.write('thermal_zone0/temp', '60000', self.thermal)
+        self.write('thermal_zone0/trip_point_0_type', 'passive', self.thermal)
+        self.write('thermal_zone0/trip_point_0_temp', '90000', self.thermal)
+        self.write('thermal_zone0/trip_point_1_type', 'critical', self.thermal)
+        self.write('thermal_zone0/trip_point_1_temp', '100000', self.thermal)
+        self.write('thermal_zone1/type', 'acpitz', self.thermal)
+        self.write('thermal_zone1/temp', '40000', self.thermal)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write(self, name, text, base=None):
+        path = os.path.join(base or self.cpu, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as sfile:
+            sfile.write(text + '\n')
+
+    def test_describe(self):
+        self.assertEqual(cpustate.describe(range(4), self.cpu),
+                         {'driver': 'intel_pstate', 'governors': ['performance'],
+                          'min_mhz': 800.0, 'max_mhz': 3500.0, 'boost': True})
+        self.assertEqual(cpustate.describe([7], self.cpu), {})
+        self.assertEqual(cpustate.thermal_zones(self.thermal)[0]['limit_c'], 90.0)
+
+    def test_sample(self):
+        reader = cpustate.StateReader([0, 2], self.cpu, self.thermal)
+        self.assertEqual(reader.columns, ['monotonic', 'freq_mean_mhz', 'freq_min_mhz',
+                                          'freq_max_mhz', 'thermal_zone0_c', 'thermal_zone1_c',
+                                          'core_throttles', 'package_throttles'])
+        # CPUs 0 and 2 are siblings: one core, one package
+        self.assertEqual(reader.sample(), (2100.0, 2000.0, 2200.0, 60.0, 40.0, 0, 5))
+        self.assertEqual(cpustate.StateReader(range(4), self.cpu, self.thermal).sample()[-2:],
+                         (1, 5))
+
+    def test_sampler(self):
+        store = os.path.join(self.tmpdir.name, 'run0.cpustate.hsts')
+        sampler = cpustate.StateSampler(store, 0.01, [1, 3], self.cpu, self.thermal)
+        sampler.start()
+        while not sampler.samples:
+            sampler._stop.wait(0.01)
+        self.write('thermal_zone0/temp', '87000', self.thermal)
+        self.write('cpu1/thermal_throttle/core_throttle_count', '4')
+        sampler._stop.wait(0.1)
+        summary = sampler.stop()
+
+        self.assertGreater(summary['samples'], 1)
+        self.assertEqual(summary['freq_max_mhz'], 2300.0)
+        self.assertEqual(summary['temp_max_c'], {'x86_pkg_temp': 87.0, 'acpitz': 40.0})
+        self.assertTrue(summary['near_trip_point'])
+        self.assertEqual((summary['core_throttles'], summary['package_throttles']), (3, 0))
+        meta, columns = timeseries.load_series(store)
+        self.assertEqual(meta['zones']['thermal_zone1'], 'acpitz')
+        self.assertEqual(len(columns['freq_mean_mhz']), summary['samples'])
+
+    def test_no_sysfs(self):
+        sampler = cpustate.StateSampler(None, 0.01, [0], os.path.join(self.tmpdir.name, 'none'),
+                                        os.path.join(self.tmpdir.name, 'none'))
+        sampler.start()
+        self.assertEqual(sampler.stop(), {'samples': 1})
+
+    def test_outliers(self):
+        scores = {'run0': 100.0, 'run1': 99.0, 'run2': 90.0, 'run3': 80.0}
+        states = {'run0': {'freq_mean_mhz': 3000.0, 'core_throttles': 0},
+                  'run1': {'freq_mean_mhz': 3000.0, 'core_throttles': 0},
+                  'run2': {'freq_mean_mhz': 2950.0, 'core_throttles': 0},
+                  'run3': {'freq_mean_mhz': 2500.0, 'core_throttles': 2,
+                           'near_trip_point': True}}
+        self.assertEqual(cpustate.explain_outliers(scores, states),
+                         {'run2': {'deficit': 0.0476, 'causes': []},
+                          'run3': {'deficit': 0.1534, 'causes': ['throttled', 'hot',
+                                                                 'low_frequency']}})
+        self.assertEqual(cpustate.explain_outliers({'run0': 1.0}, {}), {})
+        self.assertEqual(cpustate.workload_summary(states),
+                         {'freq_mean_mhz': 2862.5, 'freq_run_min_mhz': 2500.0,
+                          'freq_run_max_mhz': 3000.0, 'core_throttles': 2})
+
+
+if __name__ == '__main__':
+    unittest.main()
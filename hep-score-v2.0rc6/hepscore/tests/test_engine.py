@@ -0,0 +1,87 @@
+"""
+Copyright 2019-2021 CERN.
+See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+from hepscore import engine
+from unittest.mock import patch
+import os
+import tempfile
+import unittest
+
+FAKE_ENGINE = """#!/bin/sh
+echo "$@" >> {calls}
+case "$1" in
+    --version) echo "{version}" ;;
+    --help) echo "{help}" ;;
+    run) echo "      --unsquash   Convert SIF file to temporary sandbox" ;;
+esac
+"""
+
+
+class Test_engine(unittest.TestCase):
+    """Container engine capability probe."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.calls = os.path.join(self.tmpdir.name, 'calls')
+        self.cache = os.path.join(self.tmpdir.name, 'cache', 'engines.json')
+        self.path = patch.dict(os.environ, {'PATH': self.tmpdir.name})
+        self.path.start()
+
+    def tearDown(self):
+        self.path.stop()
+        self.tmpdir.cleanup()
+
+    def _engine(self, name, version, helpstr=''):
+        binary = os.path.join(self.tmpdir.name, name)
+        with open(binary, 'w') as script:
+            script.write(FAKE_ENGINE.format(calls=self.calls, version=version, help=helpstr))
+        os.chmod(binary, 0o755)
+        return binary
+
+    def _ncalls(self):
+        if not os.path.exists(self.calls):
+            return 0
+        with open(self.calls) as calls:
+            return len(calls.readlines())
+
+    def test_apptainer(self):
+        binary = self._engine('singularity', 'apptainer version 1.2.5-1.el9')
+        caps = engine.probe('singularity', self.cache)
+        self.assertEqual((caps['engine'], caps['version'], caps['unsquash'], caps['binary']),
+                         ('apptainer', '1.2.5-1.el9', True, binary))
+        self.assertEqual(self._ncalls(), 2)
+
+        # later sessions use the cache
+        self.assertEqual(engine.probe('singularity', self.cache), caps)
+        self.assertEqual(self._ncalls(), 2)
+
+        # until the engine is upgraded
+        self._engine('singularity', 'apptainer version 1.3.0')
+        os.utime(binary, ns=(0, 10 ** 9))
+        self.assertEqual(engine.probe('singularity', self.cache)['version'], '1.3.0')
+        self.assertEqual(self._ncalls(), 4)
+
+    def test_singularity_and_podman(self):
+        self._engine('singularity', 'singularity-ce version 3.11.4')
+        caps = engine.probe('singularity', None)
+        self.assertEqual((caps['engine'], caps['version'], caps['unsquash']),
+                         ('singularity', '3.11.4', False))
+        # --unsquash is only looked for with apptainer
+        self.assertEqual(self._ncalls(), 1)
+
+        self._engine('docker', 'podman version 4.6.1', 'Emulate Docker CLI using podman.')
+        self.assertEqual(engine.probe('docker', self.cache)['engine'], 'podman')
+
+    def test_missing(self):
+        with self.assertLogs(engine.logger, 'ERROR'):
+            caps = engine.probe('docker', self.cache)
+        self.assertEqual((caps['engine'], caps['version'], caps['binary']),
+                         ('unknown', '0.0', None))
+        self.assertFalse(os.path.exists(self.cache))
+
+
+if __name__ == '__main__':
+    unittest.main()
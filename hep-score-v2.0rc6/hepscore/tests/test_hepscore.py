@@ -4,9 +4,14 @@ See the COPYRIGHT file at the top-level directory
 of this distribution. For licensing information, see the COPYING file at
 the top-level directory of this distribution.
 """
-from hepscore.hepscore import HEPscore
+from hepscore.hepscore import HEPscore, cpuset_str, tee_output
+import collections
+import io
 import json
 import logging
+import os
+import tempfile
+import threading
 import unittest
 from unittest.mock import MagicMock, patch, mock_open
 import yaml
@@ -46,6 +51,310 @@ class test_arithmetic_methods(unittest.TestCase):
     
     # def test_weighted_geometric_mean(self):
 
+class test_adaptive_repetitions(unittest.TestCase):
+    """Early stopping of repetitions once scores agree."""
+
+    def test_more_runs(self):
+        fixture = MagicMock()
+        scores = {0: 1.0, 1: 1.1, 2: 1.0}
+        fixture._summary_paths.return_value = {i: 'run%d' % i for i in scores}
+        fixture._run_score.side_effect = lambda bmk, jscore, runstr: scores[int(runstr[3:])]
+
+        # spread of 10% against a 5% target
+        self.assertEqual(HEPscore._more_runs(fixture, 'bmk', 3, (3, 5, 0.05)), 4)
+        self.assertEqual(HEPscore._more_runs(fixture, 'bmk', 3, (3, 5, 0.2)), 3)
+        # at the maximum
+        self.assertEqual(HEPscore._more_runs(fixture, 'bmk', 3, (2, 3, 0.05)), 3)
+
+    def test_report_stats(self):
+        fixture = MagicMock()
+        scores = {0: 1.0, 1: 1.1, 2: 0.9, 3: 1.02}
+        fixture.confobj = {'settings': {'repetitions': 3},
+                           'benchmarks': {'bmk': {'ref_scores': {'sub': 1.0}}}}
+        fixture._summary_paths.return_value = {i: 'run%d' % i for i in scores}
+        fixture._read_summary.side_effect = lambda gpath: {
+            'report': {'wl-scores': {'sub': scores[int(gpath[3:])]}},
+            'app': {}, 'run_info': {}}
+        fixture._run_score.side_effect = lambda bmk, jscore, runstr: scores[int(runstr[3:])]
+        fixture._adaptive_repetitions.return_value = (3, 5, 0.05)
+
+        self.assertAlmostEqual(HEPscore._proc_results(fixture, 'bmk'), 1.01)
+        report = fixture.confobj['benchmarks']['bmk']['stats']
+        self.assertEqual({key: report[key] for key in ('runs', 'spread', 'mad', 'converged')},
+                         {'runs': 4, 'spread': 0.198, 'mad': 0.05, 'converged': False})
+        # bootstrap interval of the median, the same for the same scores
+        low, high = report['ci95']
+        self.assertTrue(0.9 <= low <= 1.01 <= high <= 1.1)
+        fixture.confobj['benchmarks']['bmk']['ref_scores'] = {'sub': 1.0}
+        HEPscore._proc_results(fixture, 'bmk')
+        self.assertEqual(fixture.confobj['benchmarks']['bmk']['stats']['ci95'], [low, high])
+
+
+class test_packed_scheduling(unittest.TestCase):
+    """Core partitioning and ordering for packed execution."""
+
+    def test_cpuset_str(self):
+        self.assertEqual(cpuset_str([0, 1, 2, 3]), "0-3")
+        self.assertEqual(cpuset_str([8, 0, 1, 2, 3]), "0-3,8")
+        self.assertEqual(cpuset_str([5]), "5")
+
+    def test_schedule_order(self):
+        fixture = MagicMock()
+        fixture.durations = {'a': 10, 'b': 300, 'c': 20}
+        order = HEPscore._schedule_order(fixture, ['a', 'b', 'c', 'd'])
+        self.assertEqual(order, ['d', 'b', 'c', 'a'])
+
+    @patch('shutil.which', return_value=None)
+    @patch('hepscore.topology.read_topology')
+    def test_place_workloads(self, mock_topology, mock_which):
+        mock_topology.return_value = {
+            'cpus': {cpu: {'package': cpu // 4, 'core': cpu, 'thread': 0, 'node': cpu // 4}
+                     for cpu in range(8)},
+            'nodes': {0: [0, 1, 2, 3], 1: [4, 5, 6, 7]}}
+        fixture = MagicMock()
+        fixture.confobj = {'environment': {}}
+        fixture.cec = 'singularity'
+        fixture.placement, fixture.smt, fixture.reserve_cores = 'none', None, 0
+        fixture.packed, fixture.ncores, fixture.layout = 0, 0, None
+        HEPscore._place_workloads(fixture)
+        self.assertIsNone(fixture.layout)
+        self.assertEqual(fixture.confobj['environment']['topology']['node_cpus'],
+                         {0: '0-3', 1: '4-7'})
+
+        # one workload per NUMA node, memory bound
+        fixture.placement, fixture.reserve_cores = 'numa', 1
+        with self.assertLogs('hepscore.hepscore', 'WARNING'):
+            HEPscore._place_workloads(fixture)
+        self.assertEqual(fixture.packed, 2)
+        self.assertEqual(fixture.confobj['environment']['placement']['slots'],
+                         [{'cpus': '1-3', 'mems': '0'}, {'cpus': '4-7', 'mems': '1'}])
+        self.assertEqual(fixture.confobj['environment']['placement']['reserved'], '0')
+
+        # ncores only applies to one workload at a time
+        fixture.placement, fixture.reserve_cores, fixture.ncores = 'none', 0, 2
+        with self.assertLogs('hepscore.hepscore', 'WARNING') as logs:
+            HEPscore._place_workloads(fixture)
+        self.assertIn("Ignoring ncores=2", logs.output[0])
+        self.assertEqual(fixture.confobj['environment']['placement']['slots'],
+                         [{'cpus': '0-3', 'mems': None}, {'cpus': '4-7', 'mems': None}])
+
+    def run_packed(self, durations, failing=(), continue_fail=False):
+        """Run benchmarks taking durations (seconds) on two slots of two cores
+
+        Returns:
+            tuple: results of `_run_packed`, benchmarks in the order they
+            started, and the highest number of benchmarks running at a time
+        """
+        fixture = MagicMock()
+        fixture.layout = {'slots': [{'cpus': [0, 1], 'mems': None},
+                                    {'cpus': [2, 3], 'mems': None}]}
+        fixture.packed = 2
+        fixture.durations = durations
+        fixture.confobj = {'benchmarks': {bmk: {} for bmk in sorted(durations)},
+                           'wl-scores': {}}
+        fixture._schedule_order.side_effect = \
+            lambda benchmarks: HEPscore._schedule_order(fixture, benchmarks)
+        fixture._continue_fail.return_value = continue_fail
+
+        lock = threading.Lock()
+        busy = set()
+        started = []
+        running = [0, 0]
+
+        def run_benchmark(benchmark, mock, times, cpus, mems):
+            with lock:
+                self.assertFalse(busy & set(cpus), "%s shares a slot" % benchmark)
+                busy.update(cpus)
+                started.append(benchmark)
+                running[0] += 1
+                running[1] = max(running)
+            threading.Event().wait(durations[benchmark])
+            with lock:
+                busy.difference_update(cpus)
+                running[0] -= 1
+            return -1 if benchmark in failing else 0
+
+        fixture._run_benchmark.side_effect = run_benchmark
+        results = HEPscore._run_packed(fixture, False, {})
+        return results, started, running[1]
+
+    def test_run_packed(self):
+        # c frees its slot for d, which ends before b frees the other for a
+        results, started, most = self.run_packed({'a': 0.02, 'b': 0.3, 'c': 0.2, 'd': 0.05})
+        self.assertEqual(results, {'b': 0, 'c': 0, 'd': 0, 'a': 0})
+        self.assertEqual(set(started[:2]), {'b', 'c'})
+        self.assertEqual(started[2:], ['d', 'a'])
+        self.assertEqual(most, 2)
+
+    def test_run_packed_failure(self):
+        # c fails while b runs: nothing else is started
+        durations = {'a': 0.02, 'b': 0.3, 'c': 0.1, 'd': 0.05}
+        results, started, _ = self.run_packed(durations, failing=('c',))
+        self.assertEqual(results, {'b': 0, 'c': -1, 'd': None, 'a': None})
+        self.assertEqual(set(started), {'b', 'c'})
+
+        results, started, _ = self.run_packed(durations, failing=('c',), continue_fail=True)
+        self.assertEqual(results, {'b': 0, 'c': -1, 'd': 0, 'a': 0})
+        self.assertEqual(len(started), 4)
+
+class test_tee_output(unittest.TestCase):
+    """Streaming copy of container output to log files."""
+
+    def test_tee(self):
+        output = b''.join(b'line %d\n' % i for i in range(5000)) + b'no newline'
+        with tempfile.TemporaryFile() as pipe:
+            pipe.write(output)
+            pipe.seek(0)
+            line_sink = io.BytesIO()
+            raw_sink = io.BytesIO()
+            tail = collections.deque(maxlen=3)
+            first = []
+            self.assertFalse(tee_output(pipe, line_sink, raw_sink, tail,
+                                        lambda: first.append(True)))
+
+        # only the first read is signalled
+        self.assertEqual(first, [True])
+        self.assertEqual(line_sink.getvalue(), output)
+        self.assertEqual(raw_sink.getvalue(), output)
+        self.assertEqual(list(tail), [b'line 4998', b'line 4999', b'no newline'])
+
+    def test_no_space(self):
+        with tempfile.TemporaryFile() as pipe:
+            pipe.write(b'docker: write /var/lib: no space left on device.\n')
+            pipe.seek(0)
+            self.assertTrue(tee_output(pipe, io.BytesIO()))
+
+class test_image_prefetch(unittest.TestCase):
+    """Background image pulls."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fixture = MagicMock()
+        self.fixture.resultsdir = self.tmpdir.name
+        self.fixture.clean = True
+        self.fixture._image_version.return_value = 'v1.0_x86_64'
+        self.fixture._image_cache = None
+        self.fixture._image_target.side_effect = \
+            lambda bmk: HEPscore._image_target(self.fixture, bmk)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    @patch('subprocess.run')
+    def test_pull_singularity(self, mock_run):
+        self.fixture.cec = 'singularity'
+        self.fixture._image_name.return_value = 'oras://registry/bmk:v1.0_x86_64'
+        mock_run.return_value.returncode = 0
+
+        image, pull_info = HEPscore._pull_image(self.fixture, 'bmk')
+
+        target = os.path.join(self.tmpdir.name, 'images', 'bmk_v1.0_x86_64.sif')
+        self.assertEqual(image, target)
+        self.assertEqual(mock_run.call_args[0][0],
+                         ['singularity', 'pull', '--disable-cache', target,
+                          'oras://registry/bmk:v1.0_x86_64'])
+        self.assertEqual(sorted(pull_info), ['duration', 'end_at', 'start_at'])
+
+    @patch('subprocess.run')
+    def test_pull_local_or_failed(self, mock_run):
+        self.fixture.cec = 'singularity'
+        self.fixture._image_name.return_value = '/cvmfs/registry/bmk:v1.0'
+        self.assertEqual(HEPscore._pull_image(self.fixture, 'bmk'),
+                         ('/cvmfs/registry/bmk:v1.0', {}))
+        mock_run.assert_not_called()
+
+        self.fixture.cec = 'docker'
+        self.fixture._image_name.return_value = 'registry/bmk:v1.0'
+        mock_run.return_value.returncode = 1
+        mock_run.return_value.stdout = b'denied'
+        self.assertEqual(HEPscore._pull_image(self.fixture, 'bmk'),
+                         ('registry/bmk:v1.0', {}))
+
+class test_resume(unittest.TestCase):
+    """Resuming an interrupted run."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.fixture = MagicMock()
+        self.fixture.resultsdir = self.tmpdir.name
+        self.fixture.scorekey = 'wl-scores'
+        self.fixture.confobj = {'benchmarks': {'bmk': {'ref_scores': {'gen': 1.0}}},
+                                'wl-scores': {}}
+        self.fixture.checkpoint = {'config_hash': 'abc', 'workloads': {}}
+        self.fixture._summary_paths = lambda bmk: HEPscore._summary_paths(self.fixture, bmk)
+        self.fixture._read_summary = lambda path: HEPscore._read_summary(self.fixture, path)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def write_run(self, run, report):
+        run_dir = os.path.join(self.tmpdir.name, 'bmk', run)
+        os.makedirs(run_dir)
+        if report is not None:
+            with open(os.path.join(run_dir, 'bmk_summary.json'), 'w') as summary:
+                json.dump({'app': {}, 'run_info': {}, 'report': report}, summary)
+
+    def test_resume_runs(self):
+        self.write_run('run0', {'wl-scores': {'gen': 2.0}})
+        self.write_run('run1', None)
+        self.write_run('run2', {'wl-scores': {'sim': 2.0}})
+        self.write_run('run10', {'wl-scores': {'gen': 3.0}})
+        os.makedirs(os.path.join(self.tmpdir.name, 'bmk', '.run1.interrupted'))
+
+        self.assertEqual(HEPscore._resume_runs(self.fixture, 'bmk'), [0, 10])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.tmpdir.name, 'bmk'))),
+                         ['.run1.interrupted', '.run1.interrupted.1', '.run2.interrupted',
+                          'run0', 'run10'])
+
+    def test_checkpoint(self):
+        self.fixture._checkpoint_lock = threading.Lock()
+        self.fixture.confobj['wl-scores']['bmk'] = {'gen': 2.0}
+        self.fixture.bench_time = {'bmkrun0start': 1.0, 'otherrun0start': 2.0}
+        HEPscore._save_checkpoint(self.fixture, 'bmk', 2.0)
+
+        resumed = MagicMock()
+        resumed.resultsdir = self.tmpdir.name
+        resumed.confobj = {'benchmarks': {'bmk': {}}, 'wl-scores': {}}
+        resumed.checkpoint = {'config_hash': 'abc', 'workloads': {}}
+        resumed.bench_time = {}
+        resumed.resumed = set()
+        HEPscore._load_checkpoint(resumed)
+        self.assertEqual(resumed.resumed, {'bmk'})
+        self.assertEqual(resumed.checkpoint['workloads']['bmk']['score'], 2.0)
+        self.assertEqual(resumed.confobj['wl-scores'], {'bmk': {'gen': 2.0}})
+        self.assertEqual(resumed.bench_time, {'bmkrun0start': 1.0})
+
+        # refused with another configuration
+        resumed.checkpoint = {'config_hash': 'def', 'workloads': {}}
+        with self.assertRaises(SystemExit):
+            HEPscore._load_checkpoint(resumed)
+
+    def test_resumed_energy(self):
+        fixture = MagicMock()
+        fixture.power = [(float(t), 100.0, 0) for t in range(101)]
+        fixture.run_windows = {'bmk': {'run1': (10, 20)}, 'new': {'run0': (30, 50)}}
+        fixture.bench_scores = {'old': 1.0, 'bmk': 1.0, 'new': 2.0}
+        fixture.run_window = (0, 100)
+        fixture.confobj = {'benchmarks': {'old': {}, 'bmk': {'run1': {}}, 'new': {'run0': {}}}}
+        fixture.resumed = {'old', 'bmk'}
+        with self.assertLogs('hepscore.hepscore', 'WARNING') as logs:
+            HEPscore._energy_report(fixture, 1.0)
+        self.assertIn("no energy reported for the whole run, nor for bmk, old", logs.output[0])
+
+        # the runs sampled after the resume keep their energy
+        benchmarks = fixture.confobj['benchmarks']
+        self.assertEqual(benchmarks['bmk']['run1']['energy']['joules'], 1000.0)
+        self.assertNotIn('energy', benchmarks['bmk'])
+        self.assertNotIn('energy', benchmarks['old'])
+        self.assertEqual(benchmarks['new']['energy']['joules'], 2000.0)
+        self.assertNotIn('energy', fixture.confobj)
+
+        # nothing from before a resume: the whole run too
+        fixture.resumed = set()
+        HEPscore._energy_report(fixture, 1.0)
+        self.assertEqual(fixture.confobj['energy']['joules'], 10000.0)
+
+
 class test_HEPscore(unittest.TestCase):
     """HEPscore method tests."""
 
@@ -0,0 +1,110 @@
+"""
+Copyright 2019-2021 CERN.
+See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+from hepscore import imagecache
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+
+class Test_ImageCache(unittest.TestCase):
+    """Node-level image cache."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmpdir.name, 'images')
+        self.pulls = []
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _puller(self, content, delay=0.0):
+        def pull(target):
+            self.pulls.append(target)
+            time.sleep(delay)
+            with open(target, 'wb') as sif:
+                sif.write(content)
+            return True
+        return pull
+
+    def test_hit_and_miss(self):
+        cache = imagecache.ImageCache(self.root, 1)
+        key = imagecache.image_key('oras://reg/atlas-bmk:v1', 'x86_64')
+        path, hit = cache.get(key, self._puller(b'atlas'))
+        self.assertFalse(hit)
+        with open(path, 'rb') as sif:
+            self.assertEqual(sif.read(), b'atlas')
+        self.assertEqual(os.path.basename(path),
+                         imagecache.file_digest(path) + '.sif')
+        cache.release(key)
+
+        # a later run on the node finds it
+        other = imagecache.ImageCache(self.root, 1)
+        self.assertEqual(other.get(key, self._puller(b'never')), (path, True))
+        other.release(key)
+        self.assertEqual(len(self.pulls), 1)
+
+        # the same content under another reference is stored once
+        key2 = imagecache.image_key('oras://mirror/atlas-bmk:v1', 'x86_64')
+        self.assertEqual(cache.get(key2, self._puller(b'atlas'))[0], path)
+        self.assertEqual(len(os.listdir(os.path.join(self.root, 'blobs'))), 1)
+
+        self.assertEqual(cache.get('failed', lambda target: False), (None, False))
+        self.assertEqual(os.listdir(os.path.join(self.root, 'tmp')), [])
+        summary = cache.summary()
+        self.assertEqual((summary['hits'], summary['misses'], summary['size']), (0, 2, 5))
+
+    def test_lru_eviction(self):
+        # room for two images of 10 bytes
+        cache = imagecache.ImageCache(self.root, 25e-9)
+        paths = {}
+        for i, name in enumerate(['a', 'b', 'c']):
+            paths[name], _ = cache.get(name, self._puller(name.encode() * 10))
+            cache.release(name)
+            os.utime(paths[name], (i, i))
+            if name == 'b':
+                # 'a' is used again, so 'b' is now the least recently used
+                cache.get('a', self._puller(b'never'))
+                cache.release('a')
+
+        self.assertTrue(os.path.exists(paths['a']))
+        self.assertFalse(os.path.exists(paths['b']))
+        self.assertTrue(os.path.exists(paths['c']))
+        self.assertEqual(cache.summary()['evictions'], 1)
+        # its reference went with it
+        self.assertFalse(cache.get('b', self._puller(b'b' * 10))[1])
+
+    def test_in_use_not_evicted(self):
+        cache = imagecache.ImageCache(self.root, 15e-9)
+        used, _ = cache.get('used', self._puller(b'u' * 10))
+        os.utime(used, (0, 0))
+        cache.get('new', self._puller(b'n' * 10))
+        self.assertTrue(os.path.exists(used))
+        cache.release('used')
+
+    def test_concurrent_pull(self):
+        caches = [imagecache.ImageCache(self.root, 1) for _ in range(4)]
+        results = []
+
+        def fetch(cache):
+            results.append(cache.get('shared', self._puller(b'shared', 0.1)))
+
+        threads = [threading.Thread(target=fetch, args=(cache,)) for cache in caches]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # one pull, everyone else waited for it
+        self.assertEqual(len(self.pulls), 1)
+        self.assertEqual(sorted(hit for _, hit in results), [False, True, True, True])
+        self.assertEqual(len({path for path, _ in results}), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
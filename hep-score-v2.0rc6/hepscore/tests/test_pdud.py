@@ -0,0 +1,116 @@
+"""
+Copyright 2019-2021 CERN.
+See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+from hepscore import pdud, pdusim, power
+import asyncio
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+
+class Test_load_outlets(unittest.TestCase):
+    """Outlets polled by the daemon."""
+
+    def test_union_of_hosts(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.yaml') as yfile:
+            yfile.write("A:\n- [10.0.0.1, 10.0.0.2]\n- ['1', '5']\n"
+                        "B:\n- [10.0.0.1, 10.0.0.2]\n- [2, '5']\n")
+            yfile.flush()
+            self.assertEqual(pdud.load_outlets(yfile.name),
+                             [('10.0.0.1', '1'), ('10.0.0.2', '5'), ('10.0.0.1', '2')])
+
+    def test_invalid_hosts(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.yaml') as yfile:
+            yfile.write("A:\n- [10.0.0.1, null, 10.0.0.3, '10.0.0.4:x']\n- ['1', '2', three, 4]\n"
+                        "B:\n- [null]\n- [null]\n"
+                        "C: unknown\n")
+            yfile.flush()
+            with self.assertLogs('hepscore.pdud', 'WARNING') as logs:
+                self.assertEqual(pdud.load_outlets(yfile.name), [('10.0.0.1', '1')])
+        self.assertEqual(len(logs.output), 5)
+
+    def test_shipped_map(self):
+        path = os.path.join(os.path.dirname(pdud.__file__), 'etc', 'data.yaml')
+        with self.assertLogs('hepscore.pdud', 'WARNING') as logs:
+            outlets = pdud.load_outlets(path)
+        self.assertTrue(any('Error' in line for line in logs.output))
+        self.assertTrue(any('Not Specified' in line for line in logs.output))
+        self.assertTrue(outlets)
+        for ip, num in outlets:
+            self.assertEqual(power.pdu_address(ip)[1], power.SNMP_PORT)
+            self.assertTrue(num.isdigit())
+        # the daemon accepts every outlet of the map
+        daemon = pdud.PDUDaemon(outlets)
+        self.assertEqual(len(daemon.outlets), len(outlets))
+
+
+class Test_PDUDaemon(unittest.TestCase):
+    """Fan-out of PDU samples to subscribed hosts."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.address = 'unix:' + os.path.join(self.tmpdir.name, 'pdud.sock')
+        self.stop = threading.Event()
+        ready = threading.Event()
+        self.sims = []
+
+        async def serve():
+            first, pdu1 = await pdusim.serve(outlets=2, base=100)
+            second, pdu2 = await pdusim.serve(outlets=2, base=300)
+            self.sims = [first, second]
+            self.daemon = pdud.PDUDaemon([(pdu1, 1), (pdu1, 2), (pdu2, 1)], interval=0.02)
+            running = asyncio.ensure_future(self.daemon.run([self.address], self.stop))
+            while not self.daemon.anchor:
+                await asyncio.sleep(0.01)
+            self.pdus = (pdu1, pdu2)
+            ready.set()
+            await running
+
+        self.thread = threading.Thread(target=asyncio.run, args=(serve(),))
+        self.thread.start()
+        ready.wait(10)
+
+    def tearDown(self):
+        self.stop.set()
+        self.thread.join(10)
+        self.tmpdir.cleanup()
+
+    def test_subscribers(self):
+        pdu1, pdu2 = self.pdus
+        hosts = [power.PowerSampler([pdu1, pdu2], [power.OUTLET_OID + '2', '1'],
+                                    daemon=self.address),
+                 power.PowerSampler([pdu1], ['1'], daemon=self.address)]
+        for host in hosts:
+            host.start()
+        time.sleep(0.3)
+        samples = [host.stop() for host in hosts]
+
+        self.assertEqual({(s[1], s[2]) for s in samples[0]}, {(100.0, 0), (300.0, 1)})
+        self.assertEqual({(s[1], s[2]) for s in samples[1]}, {(100.0, 0)})
+        # samples are on the monotonic clock of the subscriber
+        for sample in samples[0]:
+            self.assertAlmostEqual(sample[0], time.monotonic(), delta=1)
+        self.assertEqual(hosts[0].summary()['daemon'], self.address)
+        self.assertEqual(hosts[0].summary()['pdus'][self.address]['errors'], 0)
+
+        # every PDU is polled once per tick, however many hosts subscribe
+        ticks = self.daemon.clock['ticks']
+        self.assertLessEqual(self.sims[0].requests, ticks + 1)
+        self.assertLessEqual(self.sims[1].requests, ticks + 1)
+
+    def test_missing_outlet(self):
+        sampler = power.PowerSampler(['10.9.9.9'], ['7'], daemon=self.address)
+        with self.assertLogs(power.logger, 'WARNING') as logs:
+            sampler.start()
+            time.sleep(0.1)
+            self.assertEqual(sampler.stop(), [])
+        self.assertIn('does not poll', '\n'.join(logs.output))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""
+Copyright 2019-2021 CERN.
+See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+from hepscore import pdusim, power
+from pyasn1.codec.ber import decoder, encoder
+from pysnmp.proto import api
+import asyncio
+import queue
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+PMOD = api.PROTOCOL_MODULES[api.SNMP_VERSION_2C]
+
+
+def get_request(outlets, community=power.COMMUNITY):
+    pdu = PMOD.GetRequestPDU()
+    PMOD.apiPDU.set_defaults(pdu)
+    PMOD.apiPDU.set_varbinds(pdu, [(PMOD.ObjectIdentifier(pdusim.OUTLET_PREFIX + (outlet, 5)),
+                                    PMOD.Null('')) for outlet in outlets])
+    msg = PMOD.Message()
+    PMOD.apiMessage.set_defaults(msg)
+    PMOD.apiMessage.set_community(msg, community)
+    PMOD.apiMessage.set_pdu(msg, pdu)
+    return encoder.encode(msg)
+
+
+class Test_PDUSimulator(unittest.TestCase):
+    """Simulated SNMP PDUs."""
+
+    def test_waveforms(self):
+        sim = pdusim.PDUSimulator(waveform='constant', base=150)
+        self.assertEqual(sim.power(1), 150)
+        sim = pdusim.PDUSimulator(waveform='square', base=100, amplitude=20, period=4)
+        levels = {sim.power(1, sim._start + t) for t in (0, 0.5, 1, 1.5, 2, 2.5, 3, 3.5)}
+        self.assertEqual(levels, {80, 120})
+        sim = pdusim.PDUSimulator(waveform='noise', base=10, amplitude=100, seed=1)
+        self.assertGreaterEqual(min(sim.power(1) for _ in range(100)), 0)
+        with self.assertRaises(ValueError):
+            pdusim.PDUSimulator(waveform='triangle')
+
+    def test_respond(self):
+        sim = pdusim.PDUSimulator(outlets=2, base=230)
+        response, _ = decoder.decode(sim.respond(get_request([1, 3])), asn1Spec=PMOD.Message())
+        values = [val for _, val in PMOD.apiPDU.get_varbinds(PMOD.apiMessage.get_pdu(response))]
+        self.assertEqual(int(values[0]), 230)
+        self.assertTrue(values[1].isSameTypeWith(PMOD.NoSuchInstance()))
+        # wrong community
+        self.assertIsNone(sim.respond(get_request([1], 'public')))
+
+    def test_loss(self):
+        sim = pdusim.PDUSimulator(loss=1.0, seed=0)
+        sim.connection_made(MagicMock())
+        for _ in range(3):
+            sim.datagram_received(get_request([1]), ('127.0.0.1', 1))
+        self.assertEqual((sim.requests, sim.dropped), (3, 3))
+        sim.transport.sendto.assert_not_called()
+
+    def test_sampled(self):
+        stop = threading.Event()
+        samples = queue.SimpleQueue()
+        stats = {}
+
+        async def sample():
+            _, first = await pdusim.serve(outlets=2, base=100, latency=0.001)
+            _, second = await pdusim.serve(outlets=1, base=300)
+            polling = asyncio.ensure_future(power.getPowerReadings(
+                0.01, [first, second, first], stop, samples,
+                [power.OUTLET_OID + o for o in ('1', '1', '2')], stats))
+            while samples.qsize() < 9:
+                await asyncio.sleep(0.01)
+            stop.set()
+            await polling
+
+        asyncio.run(asyncio.wait_for(sample(), 10))
+
+        readings = {}
+        while not samples.empty():
+            _, watts, outlet = samples.get_nowait()
+            readings.setdefault(outlet, set()).add(watts)
+        self.assertEqual(readings, {0: {100.0}, 1: {300.0}, 2: {100.0}})
+        self.assertEqual(sum(pdu['errors'] for pdu in stats.values()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
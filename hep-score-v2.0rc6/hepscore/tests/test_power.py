@@ -0,0 +1,226 @@
+"""
+Copyright 2019-2021 CERN.
+See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+from hepscore import energy, power, timeseries
+import asyncio
+import math
+import os
+import queue
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import AsyncMock, patch
+
+
+async def fake_readings(interval, IPs, stop, samples, oid, stats=None, clock=None):
+    while not stop.is_set():
+        for i in range(len(IPs)):
+            samples.put((time.time(), 100.0 + i, i))
+        await asyncio.sleep(interval)
+
+
+class Test_getPowerReadings(unittest.TestCase):
+    """Polling of the PDUs."""
+
+    def test_batched_concurrent_polls(self):
+        stop = threading.Event()
+        requests = []
+
+        async def fake_get_cmd(engine, community, transport, context, *objects):
+            requests.append((transport, len(objects)))
+            if len(requests) == 4:
+                stop.set()
+            return None, None, None, [(None, 10 * len(objects))] * len(objects)
+
+        samples = queue.SimpleQueue()
+        stats = {}
+        ips = ['10.0.0.1', '10.0.0.2', '10.0.0.1']
+        oids = ['a', 'b', 'c']
+        with patch.object(power.UdpTransportTarget, 'create', new=AsyncMock(
+                side_effect=lambda address: address[0])) as create, \
+                patch.object(power, 'get_cmd', fake_get_cmd):
+            asyncio.run(power.getPowerReadings(0.0, ips, stop, samples, oids, stats))
+
+        # one transport per PDU, one request per PDU and poll for all its outlets
+        self.assertEqual(create.call_count, 2)
+        self.assertEqual(sorted(requests), [('10.0.0.1', 2), ('10.0.0.1', 2),
+                                            ('10.0.0.2', 1), ('10.0.0.2', 1)])
+        outlets = [samples.get_nowait()[2] for _ in range(6)]
+        self.assertEqual(sorted(outlets), [0, 0, 1, 1, 2, 2])
+        self.assertEqual(stats['10.0.0.1']['polls'], 2)
+        self.assertEqual(stats['10.0.0.2']['errors'], 0)
+
+    def test_invalid_readings(self):
+        stop = threading.Event()
+        polls = []
+
+        async def fake_get_cmd(engine, community, transport, context, *objects):
+            polls.append(transport)
+            if len(polls) == 6:
+                stop.set()
+            if transport == '10.0.0.3':
+                raise OSError("unreachable")
+            if transport == '10.0.0.2':
+                return None, None, None, [(None, power.NoSuchInstance(''))]
+            return None, None, None, [(None, 100), (None, 'n/a')]
+
+        samples = queue.SimpleQueue()
+        stats = {}
+        with patch.object(power.UdpTransportTarget, 'create', new=AsyncMock(
+                side_effect=lambda address: address[0])), \
+                patch.object(power, 'get_cmd', fake_get_cmd), \
+                self.assertLogs('hepscore.power', 'WARNING') as logs:
+            asyncio.run(power.getPowerReadings(0.0, ['10.0.0.1', '10.0.0.2', '10.0.0.1',
+                                                     '10.0.0.3'],
+                                               stop, samples, ['a', 'b', 'c', 'd'], stats))
+
+        # polling went on, with the readings of the outlets that have one
+        self.assertEqual(len(polls), 6)
+        self.assertEqual([samples.get_nowait()[1:] for _ in range(2)],
+                         [(100.0, 0), (100.0, 0)])
+        self.assertTrue(samples.empty())
+        self.assertEqual(stats['10.0.0.1']['invalid'], 2)
+        self.assertEqual(stats['10.0.0.2']['invalid'], 2)
+        self.assertEqual(stats['10.0.0.2']['errors'], 0)
+        self.assertEqual(stats['10.0.0.3']['errors'], 2)
+        self.assertEqual(stats['10.0.0.3']['polls'], 0)
+        # one warning per outlet without a reading, one per failed request
+        self.assertEqual(sum('No power reading' in line for line in logs.output), 2)
+        self.assertEqual(sum('unreachable' in line for line in logs.output), 2)
+
+    def test_fixed_rate_clock(self):
+        stop = threading.Event()
+        polls = []
+
+        async def slow_get_cmd(engine, community, transport, context, *objects):
+            polls.append(time.monotonic())
+            # the second poll overruns the next tick, and delays the one after
+            await asyncio.sleep(0.25 if len(polls) == 2 else 0.01)
+            if len(polls) == 4:
+                stop.set()
+            return None, None, None, [(None, 1)]
+
+        samples = queue.SimpleQueue()
+        clock = {}
+        with patch.object(power.UdpTransportTarget, 'create', new=AsyncMock()), \
+                patch.object(power, 'get_cmd', slow_get_cmd):
+            asyncio.run(power.getPowerReadings(0.1, ['10.0.0.1'], stop, samples, ['a'],
+                                               clock=clock))
+
+        self.assertEqual(clock['ticks'], 4)
+        self.assertEqual(clock['missed'], 1)
+        self.assertGreaterEqual(clock['late'], 1)
+        # polls stay on the 0.1s grid instead of drifting by the round trip
+        offsets = [(p - polls[0]) / 0.1 for p in polls]
+        for offset, tick in zip(offsets, [0, 1, 3.5, 4]):
+            self.assertAlmostEqual(offset, tick, delta=0.3)
+        self.assertLessEqual(abs(samples.get_nowait()[0] - polls[0]), 0.1)
+
+
+class Test_PowerSampler(unittest.TestCase):
+    """Background power sampling."""
+
+    @patch.object(power, 'getPowerReadings', fake_readings)
+    def test_start_stop(self):
+        sampler = power.PowerSampler(['10.0.0.1', '10.0.0.2'], ['a', 'b'], interval=0.01)
+        sampler.start()
+        time.sleep(0.1)
+        samples = sampler.stop()
+
+        self.assertFalse(sampler._thread.is_alive())
+        self.assertGreater(len(samples), 2)
+        self.assertEqual({s[2] for s in samples}, {0, 1})
+        self.assertEqual({s[1] for s in samples}, {100.0, 101.0})
+        self.assertEqual(sampler.drain(), [])
+
+    @patch.object(power, 'getPowerReadings', fake_readings)
+    def test_store(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = os.path.join(tmpdir, 'power.hsts')
+            sampler = power.PowerSampler(['10.0.0.1'], ['a'], interval=0.01, store=store)
+            sampler.start()
+            time.sleep(0.05)
+            samples = sampler.stop()
+
+            meta, series = timeseries.load_series(store)
+            self.assertEqual(meta['anchor'], sampler.anchor)
+            self.assertEqual(series['monotonic'].tolist(), [s[0] for s in samples])
+            self.assertEqual(set(series['watts'].tolist()), {100.0})
+
+    def test_summary(self):
+        sampler = power.PowerSampler(['10.0.0.1'], ['a'], interval=1)
+        sampler.stats = {'10.0.0.1': {'polls': 4, 'errors': 1,
+                                      'latency_total': 0.2, 'latency_max': 0.1}}
+        self.assertEqual(sampler.summary(),
+                         {'interval': 1.0, 'max_rate': 20.0,
+                          'pdus': {'10.0.0.1': {'polls': 4, 'errors': 1, 'invalid': 0,
+                                                'latency_mean': 0.05,
+                                                'latency_max': 0.1}}})
+
+    def test_mismatched_outlets(self):
+        sampler = power.PowerSampler(['10.0.0.1'], [], interval=0.01)
+        sampler.start()
+        self.assertIsNone(sampler._thread)
+        self.assertEqual(sampler.stop(), [])
+
+
+class Test_energy(unittest.TestCase):
+    """Energy accounting from power samples."""
+
+    def test_node_power(self):
+        samples = [(0, 100, 0), (2, 100, 0), (1, 50, 1), (3, 70, 1)]
+        times, watts = energy.node_power(samples)
+        self.assertEqual(list(times), [0, 1, 2, 3])
+        self.assertEqual(list(watts), [150, 150, 160, 170])
+
+    def test_integrate_windows(self):
+        times = [float(t) for t in range(11)]
+        ramp = [(t, t, 0) for t in times]
+        joules, mean, peak = energy.integrate_windows(*energy.node_power(ramp),
+                                                      [0, 2.5, 20, -5], [10, 7.5, 30, 20])
+        self.assertAlmostEqual(joules[0], 50)
+        self.assertAlmostEqual(mean[0], 5)
+        self.assertAlmostEqual(peak[0], 10)
+        # interpolated at the window edges
+        self.assertAlmostEqual(joules[1], (7.5 ** 2 - 2.5 ** 2) / 2)
+        self.assertAlmostEqual(peak[1], 7.5)
+        # nothing sampled in the window
+        self.assertTrue(math.isnan(joules[2]))
+        # clipped to the sampled range
+        self.assertAlmostEqual(joules[3], 50)
+
+    def test_energy_report(self):
+        samples = [(float(t), 100.0, psu) for t in range(101) for psu in (0, 1)]
+        windows = {'bmk': {'run0': (10, 20), 'run1': (30, 50)}}
+        workloads, total = energy.energy_report(samples, windows, {'bmk': 2.0},
+                                                (0, 100), 10.0)
+        self.assertEqual(workloads['bmk']['runs']['run0'],
+                         {'joules': 2000.0, 'mean_watts': 200.0, 'peak_watts': 200.0})
+        self.assertEqual(workloads['bmk']['total'],
+                         {'joules': 6000.0, 'mean_watts': 200.0, 'peak_watts': 200.0,
+                          'score_per_watt': 0.01})
+        self.assertEqual(total['joules'], 20000.0)
+        self.assertEqual(total['score_per_watt'], 0.05)
+
+    def test_concurrent_runs(self):
+        samples = [(float(t), 100.0, psu) for t in range(101) for psu in (0, 1)]
+        windows = {'a': {'run0': (10, 60)}, 'b': {'run0': (20, 50), 'run1': (60, 90)}}
+        self.assertTrue(energy.overlapping([(60, 90), (20, 50), (10, 60)]))
+        # back to back runs do not overlap
+        self.assertFalse(energy.overlapping([(60, 90), (10, 60)]))
+        workloads, total = energy.energy_report(samples, windows, {'a': 2.0, 'b': 1.0},
+                                                (0, 100), 10.0)
+        # the node power is counted once, for the whole run only
+        self.assertEqual(workloads['a'], {'runs': {'run0': energy.CONCURRENT},
+                                          'total': energy.CONCURRENT})
+        self.assertEqual(workloads['b']['runs']['run1'], energy.CONCURRENT)
+        self.assertEqual(total, {'joules': 20000.0, 'mean_watts': 200.0, 'peak_watts': 200.0,
+                                 'score_per_watt': 0.05})
+
+
+if __name__ == '__main__':
+    unittest.main()
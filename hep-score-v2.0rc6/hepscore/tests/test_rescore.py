@@ -0,0 +1,68 @@
+"""
+Copyright 2019-2021 CERN.
+See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+from hepscore import rescore
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import yaml
+
+
+class Test_rescore(unittest.TestCase):
+    """Bulk rescoring of results directories."""
+
+    def setUp(self):
+        head, _ = os.path.split(__file__)
+        with open(os.path.join(head, 'etc', 'hepscore_conf.yaml'), 'r') as yam:
+            self.confobj = yaml.safe_load(yam)['hepscore']
+        self.source = os.path.join(head, 'data', 'HEPscore_ci_allWLs')
+        with open(os.path.join(self.source, 'hepscore_result_expected_output.json')) as jfile:
+            self.expected = json.load(jfile)['score']
+
+        self.tmpdir = tempfile.TemporaryDirectory()
+        for name in ('site1/HEPscore_a', 'site2/deeper/HEPscore_b', 'site2/HEPscore_c'):
+            shutil.copytree(self.source, os.path.join(self.tmpdir.name, name),
+                            ignore=lambda src, names: [n for n in names if src == self.source
+                                                       and n.endswith('.json')])
+        # one repetition missing
+        shutil.rmtree(os.path.join(self.tmpdir.name, 'site2/HEPscore_c/cms-digi-bmk/run1'))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_rescore_tree(self):
+        layout = rescore.workload_layout(self.confobj)
+        dirs = rescore.find_results([self.tmpdir.name], list(layout))
+        self.assertEqual([os.path.relpath(d, self.tmpdir.name) for d in dirs],
+                         ['site1/HEPscore_a', 'site2/HEPscore_c', 'site2/deeper/HEPscore_b'])
+
+        results = [rescore.read_results(d, layout) for d in dirs]
+        benchmarks, scores = rescore.rescore(results, self.confobj)
+        self.assertEqual(benchmarks, list(layout))
+        self.assertEqual(list(scores[:, -1][[0, 2]]), [self.expected, self.expected])
+        self.assertTrue(all(v != v for v in scores[1, [benchmarks.index('cms-digi-bmk'), -1]]))
+
+        out = io.StringIO()
+        rescore.write_table(results, benchmarks, scores, out)
+        rows = list(csv.DictReader(io.StringIO(out.getvalue())))
+        self.assertEqual([row['status'] for row in rows], ['success', 'failed', 'success'])
+        self.assertEqual(float(rows[0]['score']), self.expected)
+
+    def test_main(self):
+        outfile = os.path.join(self.tmpdir.name, 'scores.json')
+        conffile = os.path.join(os.path.dirname(__file__), 'etc', 'hepscore_conf.yaml')
+        rescore.main(['-f', conffile, '-J', '2', '--json', '-o', outfile, self.tmpdir.name])
+        with open(outfile) as jfile:
+            rows = json.load(jfile)
+        self.assertEqual([row['score'] for row in rows], [self.expected, None, self.expected])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""
+Copyright 2019-2021 CERN.
+See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+from hepscore import sampler, timeseries
+import os
+import tempfile
+import unittest
+
+
+class Counter(sampler.Sampler):
+    """Nothing to sample on the first call, then the call count; fails on call fail_at"""
+
+    description = 'counts'
+
+    def __init__(self, store=None, fail_at=None):
+        super().__init__(store, 0.01, ('monotonic', 'count'), {'what': 'count'})
+        self.calls = 0
+        self.fail_at = fail_at
+
+    def sample(self):
+        self.calls += 1
+        if self.calls == 1:
+            return None
+        if self.calls == self.fail_at:
+            raise RuntimeError("gone")
+        return (self.calls,)
+
+    def summary(self):
+        return {'samples': self.samples}
+
+
+class Test_Sampler(unittest.TestCase):
+    """Background sampling shared by the telemetry and CPU state samplers."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_read(self):
+        path = os.path.join(self.tmpdir.name, 'value')
+        with open(path, 'w') as sfile:
+            sfile.write(' 42\n')
+        self.assertEqual(sampler.read(path), '42')
+        self.assertIsNone(sampler.read(os.path.join(self.tmpdir.name, 'none')))
+
+    def test_sample(self):
+        store = os.path.join(self.tmpdir.name, 'run0.hsts')
+        counter = Counter(store)
+        counter.start()
+        while counter.samples < 3:
+            counter._stop.wait(0.01)
+        summary = counter.stop()
+
+        self.assertFalse(counter._thread.is_alive())
+        self.assertEqual(summary['samples'], counter.samples)
+        self.assertEqual(counter.first[1], 2.0)
+        self.assertGreaterEqual(counter.first[0], counter.anchor['monotonic'])
+        meta, columns = timeseries.load_series(store)
+        self.assertEqual((meta['what'], meta['anchor']), ('count', counter.anchor))
+        self.assertEqual(list(columns['count']), [float(n) for n in range(2, counter.samples + 2)])
+
+    def test_failure(self):
+        counter = Counter(fail_at=4)
+        with self.assertLogs('hepscore.sampler', level='ERROR') as logs:
+            counter.start()
+            counter._thread.join(1)
+        self.assertFalse(counter._thread.is_alive())
+        self.assertIn("Sampling of counts stopped: gone", logs.output[0])
+        self.assertEqual(counter.stop(), {'samples': 2})
+        self.assertEqual(counter.last[1], 3.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""
+Copyright 2019-2021 CERN.
+See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+from hepscore import sifarchive
+from hepscore.hepscore import HEPscore
+from unittest.mock import MagicMock, patch
+import io
+import json
+import os
+import tarfile
+import tempfile
+import unittest
+
+LONG_NAME = 'a-workload-with-a-rather-long-name-bmk:v1.0_x86_64' * 3
+
+
+class Test_sifarchive(unittest.TestCase):
+    """Images used in place from a tar archive."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.archive = os.path.join(self.tmpdir.name, 'x86_64_abc.tar')
+        self.content = {'atlas-bmk:v1.0_x86_64': b'atlas' * 1000,
+                        'cms-bmk:v2.0_x86_64': b'cms' * 333,
+                        LONG_NAME: b'long'}
+        with tarfile.open(self.archive, mode='w', format=tarfile.GNU_FORMAT) as tar:
+            for name, data in self.content.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _read(self, path):
+        with open(path, 'rb') as ifile:
+            return ifile.read()
+
+    def test_expose(self):
+        for name, data in self.content.items():
+            target = os.path.join(self.tmpdir.name, 'image.sif')
+            self.assertIn(sifarchive.expose(self.archive, name, target),
+                          ('copy_file_range', 'read'))
+            self.assertEqual(self._read(target), data)
+        self.assertTrue(os.path.exists(self.archive + sifarchive.INDEX_SUFFIX))
+        with self.assertRaises(KeyError):
+            sifarchive.expose(self.archive, 'lhcb-bmk:v1.0_x86_64', target)
+
+    def test_user_space_copy(self):
+        target = os.path.join(self.tmpdir.name, 'image.sif')
+        with patch.object(sifarchive.os, 'copy_file_range', create=True,
+                          side_effect=OSError(18, 'Invalid cross-device link')):
+            self.assertEqual(sifarchive.expose(self.archive, 'cms-bmk:v2.0_x86_64', target),
+                             'read')
+        self.assertEqual(self._read(target), self.content['cms-bmk:v2.0_x86_64'])
+
+    def test_bad_index(self):
+        index = sifarchive.load_index(self.archive)
+        # an index that does not match the archive is not trusted
+        index['members'] = {name: [offset + 512, size]
+                            for name, (offset, size) in index['members'].items()}
+        with open(self.archive + sifarchive.INDEX_SUFFIX, 'w') as ifile:
+            json.dump(index, ifile)
+        target = os.path.join(self.tmpdir.name, 'image.sif')
+        with self.assertLogs(sifarchive.logger, 'WARNING'):
+            sifarchive.expose(self.archive, 'atlas-bmk:v1.0_x86_64', target)
+        self.assertEqual(self._read(target), self.content['atlas-bmk:v1.0_x86_64'])
+        self.assertEqual(sifarchive.load_index(self.archive),
+                         sifarchive.build_index(self.archive))
+
+        # nor is the index of another archive
+        index['size'] += 1
+        with open(self.archive + sifarchive.INDEX_SUFFIX, 'w') as ifile:
+            json.dump(index, ifile)
+        self.assertEqual(sifarchive.load_index(self.archive),
+                         sifarchive.build_index(self.archive))
+
+    def test_tar_registry(self):
+        fixture = MagicMock()
+        fixture.resultsdir = self.tmpdir.name
+        fixture._image_cache = None
+        fixture._prefetch_pool = None
+        fixture._image_version.return_value = 'v2.0_x86_64'
+        fixture._image_target.side_effect = lambda bmk: HEPscore._image_target(fixture, bmk)
+        fixture._image_registry.return_value = 'tar://' + self.archive
+        fixture._archive_image.side_effect = \
+            lambda bmk, image: HEPscore._archive_image(fixture, bmk, image)
+        fixture.cec = 'singularity'
+        fixture._image_name.return_value = 'tar://' + self.archive + '/cms-bmk:v2.0_x86_64'
+
+        image, pull_info = HEPscore._pull_image(fixture, 'cms-bmk')
+        self.assertEqual(image, os.path.join(self.tmpdir.name, 'images',
+                                             'cms-bmk_v2.0_x86_64.sif'))
+        self.assertEqual(self._read(image), self.content['cms-bmk:v2.0_x86_64'])
+        self.assertEqual(pull_info['archive'], self.archive)
+
+        HEPscore._release_image(fixture, 'cms-bmk')
+        self.assertFalse(os.path.exists(image))
+
+        fixture._image_name.return_value = 'tar://' + self.archive + '/lhcb-bmk:v2.0_x86_64'
+        with self.assertLogs('hepscore.hepscore', 'ERROR'):
+            self.assertEqual(HEPscore._pull_image(fixture, 'lhcb-bmk'), (None, {}))
+
+    def test_missing_image_fails(self):
+        """A workload whose image is not in the archive is not run."""
+        fixture = MagicMock()
+        fixture.checkpoint = {}
+        fixture.confobj = {'benchmarks': {'lhcb-bmk': {}},
+                           'settings': {'repetitions': 3, 'name': 'test'}}
+        fixture.resultsdir = self.tmpdir.name
+        fixture.resume = False
+        fixture.clean_files = False
+        fixture.ncores = 0
+        fixture._adaptive_repetitions.return_value = None
+        fixture._image_version.return_value = 'v2.0_x86_64'
+        fixture._fetch_image.return_value = None
+
+        with patch('subprocess.Popen') as popen, self.assertLogs('hepscore.hepscore', 'ERROR'):
+            self.assertEqual(HEPscore._run_benchmark(fixture, 'lhcb-bmk', False, {}), -1)
+        popen.assert_not_called()
+        fixture._release_image.assert_called_once_with('lhcb-bmk')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+"""
+Copyright 2019-2021 CERN.
+See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+import json
+import subprocess
+import sys
+import unittest
+
+# Dependencies the command line must not load unless a run needs them
+HEAVY = ('numpy', 'pysnmp', 'pyasn1', 'requests', 'urllib3', 'pbr', 'asyncio', 'sqlite3',
+         'csv')
+# Import time of hepscore.main, in microseconds, as measured by -X importtime.
+# About 70ms without bytecode caches on a workstation: the budget leaves
+# room for slow CI runners but not for a heavy dependency.
+IMPORT_BUDGET = 250000
+
+PROBE = """
+import json, sys
+import hepscore.main as main
+sys.argv = ['hep-score'] + json.loads(sys.argv[1])
+try:
+    main.main()
+except SystemExit:
+    pass
+print(json.dumps(sorted(sys.modules)))
+"""
+
+
+def loaded_modules(args):
+    """Top-level packages imported by `hep-score args`, run in a new interpreter"""
+    proc = subprocess.run([sys.executable, '-c', PROBE, json.dumps(args)],
+                          stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    return {name.split('.')[0] for name in json.loads(proc.stdout.decode().splitlines()[-1])}
+
+
+def import_time(module):
+    """Cumulative import time of module in microseconds, from -X importtime"""
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+                          stderr=subprocess.PIPE, check=True)
+    for line in proc.stderr.decode().splitlines():
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1])
+    raise AssertionError("%s not reported by -X importtime" % module)
+
+
+class Test_startup(unittest.TestCase):
+    """Command line start up does not load the heavy dependencies."""
+
+    def test_import(self):
+        # exits for the missing OUTDIR, after parsing the arguments
+        modules = loaded_modules([])
+        self.assertEqual([mod for mod in HEAVY if mod in modules], [])
+
+    def test_informational_options(self):
+        for args in (['-l'], ['-p']):
+            modules = loaded_modules(args)
+            self.assertEqual([mod for mod in HEAVY if mod in modules], [], args)
+        # the package metadata read by -V is parsed with csv
+        self.assertEqual([mod for mod in HEAVY if mod in loaded_modules(['-V'])],
+                         ['pbr', 'csv'])
+
+    def test_import_budget(self):
+        # best of a few attempts, to ignore a busy machine
+        best = min(import_time('hepscore.main') for _ in range(3))
+        self.assertLess(best, IMPORT_BUDGET)
+
+
+if __name__ == '__main__':
+    unittest.main()
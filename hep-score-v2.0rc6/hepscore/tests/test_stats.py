@@ -0,0 +1,73 @@
+"""
+Copyright 2019-2021 CERN.
+See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+from hepscore import stats
+from hepscore.hepscore import weighted_geometric_mean
+import math
+import numpy as np
+import unittest
+
+
+class Test_stats(unittest.TestCase):
+    """Vectorised scoring statistics."""
+
+    def test_weighted_geometric_mean(self):
+        self.assertAlmostEqual(float(stats.weighted_geometric_mean([2, 8])), 4)
+        self.assertAlmostEqual(float(stats.weighted_geometric_mean([2, 8], [3, 1])),
+                               (2 ** 3 * 8) ** 0.25)
+        self.assertEqual(float(stats.weighted_geometric_mean([2, 8], [0, 0])), 0)
+        self.assertEqual(float(stats.weighted_geometric_mean([0, 8])), 0)
+        # a zero weight ignores the score
+        self.assertAlmostEqual(float(stats.weighted_geometric_mean([0, 8], [0, 1])), 8)
+
+    def test_no_overflow(self):
+        # the product of the scores is far beyond the float range
+        self.assertAlmostEqual(float(stats.weighted_geometric_mean([1e300] * 400)) / 1e300, 1)
+        self.assertAlmostEqual(float(stats.weighted_geometric_mean([1e-300] * 400)) / 1e-300, 1)
+        self.assertAlmostEqual(weighted_geometric_mean([1e200, 1e200, 1e-200]) / 1e200 ** (1 / 3), 1)
+
+    def test_batch(self):
+        scores = np.array([[1.0, 2.0, 4.0], [3.0, 3.0, 3.0]])
+        np.testing.assert_allclose(stats.weighted_geometric_mean(scores), [2.0, 3.0])
+        np.testing.assert_allclose(stats.median(scores), [2.0, 3.0])
+        np.testing.assert_allclose(stats.mad(scores), [1.0, 0.0])
+        np.testing.assert_allclose(stats.suite_scores(scores, [1, 1, 2], 10), [
+            round(10 * (1 * 2 * 16) ** 0.25, 4), 30.0])
+        ci = stats.bootstrap_ci(scores, seed=1)
+        self.assertEqual(ci.shape, (2, 2))
+        self.assertTrue(np.all(ci[:, 0] <= ci[:, 1]))
+        np.testing.assert_allclose(ci[1], [3.0, 3.0])
+
+    def test_workload_scores(self):
+        self.assertEqual(float(stats.workload_scores([20.0, 5.0], [10.0, 5.0])),
+                         round(math.sqrt(2.0), 4))
+        runs = stats.workload_scores([[20.0, 5.0], [10.0, 5.0]], [10.0, 5.0])
+        np.testing.assert_allclose(runs, [1.4142, 1.0])
+
+    def test_bootstrap_geometric_mean(self):
+        low, high = stats.bootstrap_ci([1.0, 10.0, 100.0], statistic='geometric_mean', seed=0)
+        self.assertGreaterEqual(low, 1.0 - 1e-9)
+        self.assertLessEqual(high, 100.0 + 1e-9)
+        self.assertLess(low, 10.0)
+        with self.assertRaises(ValueError):
+            stats.bootstrap_ci([1.0], statistic='mode')
+
+    def test_relative_spread(self):
+        self.assertEqual(float(stats.relative_spread([2.0])), 0.0)
+        self.assertAlmostEqual(float(stats.relative_spread([1.0, 1.1, 0.9])), 0.2)
+        self.assertEqual(float(stats.relative_spread([0.0, 0.0, 1.0])), math.inf)
+        np.testing.assert_allclose(stats.relative_spread([[1.0, 3.0], [2.0, 2.0]]), [1.0, 0.0])
+
+    def test_summarize(self):
+        summary = stats.summarize([1.0, 2.0, 3.0, 4.0, 100.0], seed=0)
+        self.assertEqual(float(summary['median']), 3.0)
+        self.assertEqual(float(summary['mad']), 1.0)
+        self.assertAlmostEqual(float(summary['spread']), 33.0)
+        self.assertEqual(summary['ci'].shape, (2,))
+
+
+if __name__ == '__main__':
+    unittest.main()
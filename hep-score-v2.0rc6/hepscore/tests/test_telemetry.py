@@ -0,0 +1,135 @@
+"""
+Copyright 2019-2021 CERN.
+See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+from hepscore import telemetry, timeseries
+import math
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+NET_DEV = """Inter-|   Receive                                                |  Transmit
+ face |bytes    packets errs drop fifo frame compressed multicast|bytes    packets errs drop fifo colls carrier compressed
+    lo: 1000       10    0    0    0     0          0         0     1000      10    0    0    0     0       0          0
+  eth0: 5000       50    0    0    0     0          0         0     7000      70    0    0    0     0       0          0
+"""
+
+
+class Test_telemetry(unittest.TestCase):
+    """Container resource usage sampling."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.proc = os.path.join(self.tmpdir.name, 'proc')
+        self.cgroup = os.path.join(self.tmpdir.name, 'cgroup')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def _write(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as tfile:
+            tfile.write(content)
+
+    def _process(self, pid, cgroup):
+        self._write(os.path.join(self.proc, str(pid), 'cgroup'), cgroup)
+        self._write(os.path.join(self.proc, str(pid), 'net', 'dev'), NET_DEV)
+
+    def test_cgroup_v2(self):
+        self._write(os.path.join(self.cgroup, 'cgroup.controllers'), 'cpu io memory\n')
+        self._process(os.getpid(), '0::/user.slice\n')
+        self._process(42, '0::/system.slice/docker-abc.scope\n')
+        scope = os.path.join(self.cgroup, 'system.slice', 'docker-abc.scope')
+        self._write(os.path.join(scope, 'cpu.stat'),
+                    'usage_usec 2500000\nnr_throttled 3\nthrottled_usec 400000\n')
+        self._write(os.path.join(scope, 'memory.current'), '1048576\n')
+        self._write(os.path.join(scope, 'memory.peak'), '4194304\n')
+        self._write(os.path.join(scope, 'memory.stat'), 'anon 1\npgfault 900\npgmajfault 9\n')
+        self._write(os.path.join(scope, 'io.stat'),
+                    '8:0 rbytes=100 wbytes=200 rios=1 wios=2\n8:16 rbytes=1 wbytes=2\n')
+
+        reader = telemetry.reader(42, self.proc, self.cgroup)
+        self.assertIsInstance(reader, telemetry.CgroupReader)
+        self.assertEqual(reader.path, scope)
+        self.assertEqual(reader.sample(), (2.5, 0.4, 3, 1048576, 900, 9, 101, 202, 5000, 7000))
+        self.assertEqual(reader.peak_memory(), 4194304)
+
+    def test_cgroup_v1(self):
+        own = '4:memory:/\n2:cpu,cpuacct:/\n1:blkio:/\n0::/\n'
+        self._process(os.getpid(), own)
+        self._process(42, own.replace(':/\n', ':/docker/abc\n'))
+        os.makedirs(os.path.join(self.cgroup, 'cpu,cpuacct'))
+        cpu = os.path.join(self.cgroup, 'cpu,cpuacct', 'docker', 'abc')
+        memory = os.path.join(self.cgroup, 'memory', 'docker', 'abc')
+        self._write(os.path.join(cpu, 'cpuacct.usage'), '1500000000\n')
+        self._write(os.path.join(cpu, 'cpu.stat'),
+                    'nr_periods 10\nnr_throttled 2\nthrottled_time 300000000\n')
+        self._write(os.path.join(memory, 'memory.usage_in_bytes'), '2048\n')
+        self._write(os.path.join(memory, 'memory.max_usage_in_bytes'), '8192\n')
+        self._write(os.path.join(memory, 'memory.stat'),
+                    'pgfault 5\ntotal_pgfault 50\ntotal_pgmajfault 1\n')
+        self._write(os.path.join(self.cgroup, 'blkio', 'docker', 'abc',
+                                 'blkio.throttle.io_service_bytes'),
+                    '8:0 Read 10\n8:0 Write 20\n8:0 Total 30\nTotal 30\n')
+
+        reader = telemetry.reader(42, self.proc, self.cgroup)
+        self.assertIsInstance(reader, telemetry.CgroupReader)
+        self.assertFalse(reader.v2)
+        self.assertEqual(reader.sample(), (1.5, 0.3, 2, 2048, 50, 1, 10, 20, 5000, 7000))
+        self.assertEqual(reader.peak_memory(), 8192)
+
+    def test_proc(self):
+        # a singularity container shares the cgroup of hepscore
+        self._process(os.getpid(), '0::/user.slice\n')
+        self._process(42, '0::/user.slice\n')
+        tick = os.sysconf('SC_CLK_TCK')
+        page = os.sysconf('SC_PAGE_SIZE')
+        for pid, ppid, cpu in ((42, 1, 1), (43, 42, 2), (44, 43, 3), (50, 1, 100)):
+            # minflt cminflt majflt cmajflt utime stime cutime cstime ... rss
+            self._write(os.path.join(self.proc, str(pid), 'stat'),
+                        '%d (a (b) c) S %d 0 0 0 0 0 10 1 2 0 %d %d 0 0 20 0 1 0 0 0 %d 0\n'
+                        % (pid, ppid, cpu * tick, cpu * tick, cpu))
+            self._write(os.path.join(self.proc, str(pid), 'io'),
+                        'rchar: 1\nread_bytes: %d\nwrite_bytes: 7\n' % cpu)
+
+        reader = telemetry.reader(42, self.proc, self.cgroup)
+        self.assertIsInstance(reader, telemetry.ProcReader)
+        self.assertFalse(reader.has_children)
+        self.assertEqual(reader.processes(), [42, 43, 44])
+        sample = reader.sample()
+        self.assertEqual(sample[0], 12.0)
+        # no throttling counters outside of a cgroup
+        self.assertTrue(math.isnan(sample[1]) and math.isnan(sample[2]))
+        self.assertEqual(sample[3:], (6 * page, 33, 6, 6, 21, 5000, 7000))
+
+    def test_sampler(self):
+        store = os.path.join(self.tmpdir.name, 'run0.telemetry.hsts')
+        code = "x = bytearray(20000000)\nimport time\nt = time.time()\n" \
+               "while time.time() - t < 0.3: pass\n"
+        proc = subprocess.Popen([sys.executable, '-c', code])
+        sampler = telemetry.RunSampler(store, 0.05, pid=proc.pid)
+        sampler.start()
+        proc.wait()
+        summary = sampler.stop()
+
+        self.assertEqual(summary['source'], 'proc')
+        self.assertGreater(summary['samples'], 2)
+        self.assertGreater(summary['cpu_seconds'], 0.1)
+        self.assertGreater(summary['peak_memory_bytes'], 20000000)
+        self.assertNotIn('throttled_seconds', summary)
+        meta, data = timeseries.load_series(store)
+        self.assertEqual(meta['columns'], list(telemetry.COLUMNS))
+        self.assertEqual(len(data['monotonic']), summary['samples'])
+
+    def test_no_container(self):
+        sampler = telemetry.RunSampler(None, 0.01, cidfile=os.path.join(self.tmpdir.name, 'cid'))
+        sampler.start()
+        self.assertEqual(sampler.stop(), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
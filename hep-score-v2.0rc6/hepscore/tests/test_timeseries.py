@@ -0,0 +1,62 @@
+"""
+Copyright 2019-2021 CERN.
+See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+from hepscore import timeseries
+import numpy as np
+import os
+import tempfile
+import unittest
+
+
+class Test_timeseries(unittest.TestCase):
+    """Binary time series files."""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'series.hsts')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_roundtrip(self):
+        with timeseries.TimeSeriesWriter(self.path, ('t', 'watts'), {'anchor': {'wall': 1.5}}) \
+                as writer:
+            for i in range(5):
+                writer.append((i, 100.0 + i))
+
+        meta, series = timeseries.load_series(self.path)
+        self.assertEqual(meta['columns'], ['t', 'watts'])
+        self.assertEqual(meta['anchor'], {'wall': 1.5})
+        self.assertEqual(series['t'].tolist(), [0, 1, 2, 3, 4])
+        self.assertEqual(series['watts'].tolist(), [100, 101, 102, 103, 104])
+        # columns are views of the mapped file
+        self.assertIsInstance(series['t'].base, np.memmap)
+        self.assertFalse(series['t'].flags.writeable)
+
+    def test_incremental_and_truncated(self):
+        writer = timeseries.TimeSeriesWriter(self.path, ('a', 'b', 'c'))
+        _, series = timeseries.load_series(self.path)
+        self.assertEqual(series['a'].shape, (0,))
+
+        writer.append((1, 2, 3))
+        writer._file.flush()
+        self.assertEqual(timeseries.load_series(self.path)[1]['c'].tolist(), [3])
+        writer.close()
+
+        # a partial row left by an interrupted write is ignored
+        with open(self.path, 'ab') as sfile:
+            sfile.write(b'\0' * 12)
+        self.assertEqual(timeseries.load_series(self.path)[1]['b'].tolist(), [2])
+
+    def test_not_a_series(self):
+        with open(self.path, 'w') as sfile:
+            sfile.write('{"power": []}')
+        with self.assertRaises(ValueError):
+            timeseries.load_series(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+"""
+Copyright 2019-2021 CERN.
+See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+from hepscore import topology
+import os
+import tempfile
+import unittest
+
+
+class Test_topology(unittest.TestCase):
+    """Topology of a dual-socket node with two threads per core."""
+
+    def setUp(self):
+        # cpus 0-7 on node 0, 8-15 on node 1, cpu N and N+4 are siblings
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.sysfs_cpu = os.path.join(self.tmpdir.name, 'cpu')
+        self.sysfs_node = os.path.join(self.tmpdir.name, 'node')
+        for cpu in range(16):
+            base = os.path.join(self.sysfs_cpu, 'cpu%d' % cpu, 'topology')
+            os.makedirs(base)
+            first = cpu - 4 if cpu % 8 >= 4 else cpu
+            with open(os.path.join(base, 'physical_package_id'), 'w') as sfile:
+                sfile.write('%d\n' % (cpu // 8))
+            with open(os.path.join(base, 'thread_siblings_list'), 'w') as sfile:
+                sfile.write('%d,%d\n' % (first, first + 4))
+        for node in range(2):
+            os.makedirs(os.path.join(self.sysfs_node, 'node%d' % node))
+            with open(os.path.join(self.sysfs_node, 'node%d' % node, 'cpulist'), 'w') as sfile:
+                sfile.write('%d-%d\n' % (node * 8, node * 8 + 7))
+        self.topo = topology.read_topology(range(16), self.sysfs_cpu, self.sysfs_node)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_read(self):
+        self.assertEqual(topology.parse_cpulist('0-3,8\n'), [0, 1, 2, 3, 8])
+        self.assertEqual(self.topo['cpus'][13],
+                         {'package': 1, 'core': 9, 'thread': 1, 'node': 1})
+        self.assertEqual(self.topo['nodes'], {0: list(range(8)), 1: list(range(8, 16))})
+        self.assertEqual(topology.describe(self.topo),
+                         {'packages': 2, 'nodes': 2, 'cores': 8, 'threads_per_core': 2})
+
+        # without sysfs: one core per cpu, one node
+        bare = topology.read_topology([0, 1], self.tmpdir.name, self.tmpdir.name)
+        self.assertEqual(topology.describe(bare),
+                         {'packages': 1, 'nodes': 1, 'cores': 2, 'threads_per_core': 1})
+
+    def test_partition_cpus(self):
+        # CPUs are given out in the order given
+        self.assertEqual(topology.partition_cpus([3, 2, 1, 0], 2), [[3, 2], [1, 0]])
+        # left-over cores are not assigned, cpusets stay equally sized
+        self.assertEqual(topology.partition_cpus(range(7), 3), [[0, 1], [2, 3], [4, 5]])
+        self.assertEqual(topology.partition_cpus([0, 1], 4), [[0], [1]])
+        self.assertEqual(topology.partition_cpus([], 2), [])
+
+    def test_default(self):
+        layout = topology.place(self.topo, 3)
+        self.assertEqual([slot['cpus'] for slot in layout['slots']],
+                         [[0, 1, 2, 3, 4], [5, 6, 7, 8, 9], [10, 11, 12, 13, 14]])
+        self.assertEqual(layout['reserved'], [])
+        self.assertIsNone(layout['slots'][0]['mems'])
+
+    def test_smt(self):
+        packed = topology.place(self.topo, 4, smt='pack')['slots']
+        self.assertEqual(packed[0]['cpus'], [0, 4, 1, 5])
+        spread = topology.place(self.topo, 2, smt='spread')['slots']
+        self.assertEqual(spread[0]['cpus'], [0, 1, 2, 3, 8, 9, 10, 11])
+
+        # a single workload on 4 cores gets 4 physical cores
+        self.assertEqual(topology.place(self.topo, 1, smt='spread', ncores=4)['slots'],
+                         [{'cpus': [0, 1, 2, 3], 'mems': None}])
+
+    def test_numa(self):
+        layout = topology.place(self.topo, 2, 'numa', reserve=1)
+        self.assertEqual(layout['reserved'], [0, 4])
+        self.assertEqual(layout['slots'], [{'cpus': [1, 2, 3, 5, 6, 7], 'mems': [0]},
+                                           {'cpus': list(range(8, 16)), 'mems': [1]}])
+
+        # two workloads per node, on whole cores
+        slots = topology.place(self.topo, 4, 'numa', smt='pack')['slots']
+        self.assertEqual([slot['cpus'] for slot in slots],
+                         [[0, 4, 1, 5], [2, 6, 3, 7], [8, 12, 9, 13], [10, 14, 11, 15]])
+        self.assertEqual([slot['mems'] for slot in slots], [[0], [0], [1], [1]])
+
+        # slots not divisible by the nodes: the first node takes one more
+        slots = topology.place(self.topo, 3, 'numa')['slots']
+        self.assertEqual(slots, [{'cpus': [0, 1, 2, 3], 'mems': [0]},
+                                 {'cpus': [4, 5, 6, 7], 'mems': [0]},
+                                 {'cpus': list(range(8, 16)), 'mems': [1]}])
+        self.assertEqual([len(slot['cpus']) for slot in topology.place(self.topo, 5, 'numa')['slots']],
+                         [2, 2, 2, 4, 4])
+        # or the node with the most CPUs left
+        slots = topology.place(self.topo, 3, 'numa', reserve=1)['slots']
+        self.assertEqual([slot['mems'] for slot in slots], [[0], [1], [1]])
+
+        # one workload over both nodes
+        self.assertEqual(topology.place(self.topo, 1, 'numa', ncores=10)['slots'],
+                         [{'cpus': list(range(10)), 'mems': [0, 1]}])
+
+
+if __name__ == '__main__':
+    unittest.main()
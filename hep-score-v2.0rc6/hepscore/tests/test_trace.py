@@ -0,0 +1,70 @@
+"""
+Copyright 2019-2021 CERN.
+See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+from hepscore import trace
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+
+class Test_Tracer(unittest.TestCase):
+    """Phase spans, overhead breakdown and Chrome trace export."""
+
+    def setUp(self):
+        self.tracer = trace.Tracer()
+        origin = self.tracer.origin
+        # two runs of a workload, in nanoseconds since the tracer was created
+        self.tracer.add('atlas', 'pull', origin, origin + 2 * 10**9, cache='miss')
+        self.tracer.add('atlas', 'container_start', origin + 2 * 10**9, origin + 3 * 10**9)
+        self.tracer.add('atlas', 'workload', origin + 3 * 10**9, origin + 9 * 10**9, run='run0')
+        self.tracer.add('atlas', 'workload', origin + 9 * 10**9, origin + 11 * 10**9, run='run1')
+        self.tracer.add('atlas', 'benchmark', origin, origin + 11 * 10**9)
+
+    def test_breakdown(self):
+        with self.tracer.span('atlas', 'results') as args:
+            args['score'] = 1.0
+        # pulled while another workload ran
+        self.tracer.add('cms', 'prefetch', self.tracer.origin, self.tracer.origin + 5 * 10**9)
+        breakdown = self.tracer.breakdown()
+
+        self.assertEqual(list(breakdown['phases']), ['pull', 'prefetch', 'container_start',
+                                                     'workload', 'results'])
+        self.assertEqual(breakdown['phases']['workload'],
+                         {'seconds': 8.0, 'count': 2, 'max_seconds': 6.0})
+        self.assertEqual(breakdown['workload_seconds'], 8.0)
+        # the whole workload is only in the timeline
+        self.assertAlmostEqual(breakdown['overhead_seconds'], 3.0, places=2)
+        self.assertAlmostEqual(breakdown['overhead_fraction'], 3.0 / 11, places=3)
+        self.assertEqual(self.tracer.spans[-2][-1], {'score': 1.0})
+        self.assertEqual(trace.Tracer().breakdown()['overhead_fraction'], 0.0)
+
+    def test_chrome_trace(self):
+        thread = threading.Thread(target=lambda: self.tracer.add('cms', 'pull', 0, 0),
+                                  name='prefetch')
+        thread.start()
+        thread.join()
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, trace.TRACE_FILE)
+            self.tracer.write_chrome(path)
+            self.assertEqual(os.listdir(tmpdir), [trace.TRACE_FILE])
+            with open(path) as tfile:
+                events = json.load(tfile)['traceEvents']
+
+        threads = {event['args']['name']: event['tid'] for event in events if event['ph'] == 'M'}
+        self.assertEqual(sorted(threads), ['MainThread', 'prefetch'])
+        spans = [event for event in events if event['ph'] == 'X']
+        self.assertEqual(len(spans), 6)
+        workload = [event for event in spans if event['args'].get('run') == 'run0'][0]
+        self.assertEqual((workload['ts'], workload['dur'], workload['cat']),
+                         (3e6, 6e6, 'workload'))
+        self.assertEqual(workload['tid'], threads['MainThread'])
+
+
+if __name__ == '__main__':
+    unittest.main()
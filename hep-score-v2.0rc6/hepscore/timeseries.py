@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+timeseries.py - Append-only binary store for sampled time series
+
+A series file starts with a small header: an 8 byte magic string, the
+header length as a little-endian uint64, and JSON metadata naming the
+columns, padded to a multiple of 8 bytes.  Rows of little-endian float64
+values follow, one per sample, so the data can be memory-mapped as a 2D
+array.  A row cut short by an interrupted write is ignored when loading.
+
+Copyright 2019-2021 CERN. See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+
+import json
+import struct
+import time
+import numpy as np
+
+MAGIC = b'HEPSCTS1'
+FLUSH_INTERVAL = 1.0  # seconds between flushes of appended rows
+
+
+class TimeSeriesWriter():
+    """Write rows of float64 values to a series file as they are sampled"""
+
+    def __init__(self, path, columns, meta=None):
+        """Args:
+            path (str): series file, overwritten if it exists
+            columns (list[str]): column names
+            meta (dict, optional): JSON serialisable metadata stored in the header
+        """
+        self.path = path
+        self.columns = list(columns)
+        self._row = struct.Struct('<%dd' % len(self.columns))
+        self._last_flush = time.monotonic()
+
+        header = dict(meta or {})
+        header['columns'] = self.columns
+        body = json.dumps(header).encode('utf-8')
+        hlen = len(MAGIC) + 8 + len(body)
+        body += b' ' * (-hlen % 8)
+
+        self._file = open(path, mode='wb')
+        self._file.write(MAGIC + struct.pack('<Q', len(MAGIC) + 8 + len(body)) + body)
+        self._file.flush()
+
+    def append(self, row):
+        """Append one row, flushing to disk at most every FLUSH_INTERVAL"""
+        self._file.write(self._row.pack(*row))
+        now = time.monotonic()
+        if now - self._last_flush >= FLUSH_INTERVAL:
+            self._file.flush()
+            self._last_flush = now
+
+    def close(self):
+        """Flush and close the series file"""
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_header(path):
+    """Return the metadata and data offset of a series file
+
+    Args:
+        path (str): series file
+
+    Returns:
+        2-tuple (dict, int): metadata, including 'columns', and data offset
+
+    Raises:
+        ValueError: if path is not a series file
+    """
+    with open(path, mode='rb') as sfile:
+        prefix = sfile.read(len(MAGIC) + 8)
+        if len(prefix) != len(MAGIC) + 8 or prefix[:len(MAGIC)] != MAGIC:
+            raise ValueError("%s is not a time series file" % path)
+        offset = struct.unpack('<Q', prefix[len(MAGIC):])[0]
+        meta = json.loads(sfile.read(offset - len(prefix)).decode('utf-8'))
+
+    return meta, offset
+
+
+def load_series(path):
+    """Memory-map a series file
+
+    Args:
+        path (str): series file
+
+    Returns:
+        2-tuple (dict, dict): metadata, and {column name: ndarray} where
+        each array is a read-only view of the mapped file
+    """
+    meta, offset = read_header(path)
+    ncols = len(meta['columns'])
+    with open(path, mode='rb') as sfile:
+        sfile.seek(0, 2)
+        nrows = (sfile.tell() - offset) // (8 * ncols)
+
+    if nrows == 0:
+        data = np.empty((0, ncols), dtype='<f8')
+    else:
+        data = np.memmap(path, dtype='<f8', mode='r', offset=offset, shape=(nrows, ncols))
+
+    return meta, {name: data[:, i] for i, name in enumerate(meta['columns'])}
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+topology.py - CPU topology of the host and placement of the workloads
+
+The NUMA nodes, physical cores and SMT siblings of the CPUs hepscore may use
+are read from sysfs, and the CPUs are split into slots, one per workload
+running at a time, according to a placement policy:
+
+    none    slots are consecutive CPU numbers, memory is not bound
+    numa    each slot lies within a NUMA node, and its memory is bound to it;
+            with as many slots as nodes, one workload runs per node
+
+SMT siblings (hyperthreads) of a core are either kept in the same slot
+('pack'), or the first thread of every core is used before any second
+thread ('spread').  Housekeeping cores, with all their siblings, can be
+kept out of every slot for the system and hepscore itself.
+
+Copyright 2019-2021 CERN. See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+
+import glob
+import os
+
+from hepscore import sampler
+
+SYSFS_CPU = '/sys/devices/system/cpu'
+SYSFS_NODE = '/sys/devices/system/node'
+POLICIES = ('none', 'numa')
+SMT_MODES = ('pack', 'spread')
+
+
+def parse_cpulist(cpulist):
+    """Return the CPU numbers of a cpu-list string (eg "0-3,8")
+
+    Args:
+        cpulist (str): cpu-list, as found in sysfs
+
+    Returns:
+        list[int]: CPU numbers
+    """
+    cpus = []
+    for part in cpulist.strip().split(','):
+        if not part:
+            continue
+        low, _, high = part.partition('-')
+        cpus.extend(range(int(low), int(high or low) + 1))
+    return cpus
+
+
+def read_topology(cpus=None, sysfs_cpu=SYSFS_CPU, sysfs_node=SYSFS_NODE):
+    """Read the topology of CPUs from sysfs
+
+    Missing sysfs entries are treated as one core per CPU on a single node.
+
+    Args:
+        cpus (list[int], optional): CPUs to describe. Default: the CPUs
+                                    hepscore is allowed to run on
+        sysfs_cpu (str, optional): cpu directory of sysfs
+        sysfs_node (str, optional): node directory of sysfs
+
+    Returns:
+        dict: 'cpus', CPU -> {'package', 'core' (lowest sibling), 'thread'
+        (index among its siblings), 'node'}, and 'nodes', node -> CPUs
+    """
+    if cpus is None:
+        cpus = os.sched_getaffinity(0)
+    info = {}
+    for cpu in sorted(cpus):
+        base = os.path.join(sysfs_cpu, 'cpu%d' % cpu, 'topology')
+        package = sampler.read(os.path.join(base, 'physical_package_id'))
+        siblings = sorted(parse_cpulist(sampler.read(os.path.join(base, 'thread_siblings_list'))
+                                        or str(cpu)))
+        if cpu not in siblings:
+            siblings = [cpu]
+        info[cpu] = {'package': int(package) if package else 0,
+                     'core': siblings[0],
+                     'thread': siblings.index(cpu)}
+
+    for path in glob.glob(os.path.join(sysfs_node, 'node[0-9]*')):
+        node = int(os.path.basename(path)[len('node'):])
+        for cpu in parse_cpulist(sampler.read(os.path.join(path, 'cpulist')) or ''):
+            if cpu in info:
+                info[cpu]['node'] = node
+
+    nodes = {}
+    for cpu in sorted(info):
+        nodes.setdefault(info[cpu].setdefault('node', 0), []).append(cpu)
+    return {'cpus': info, 'nodes': nodes}
+
+
+def describe(topology):
+    """Packages, NUMA nodes, cores and threads per core of a topology"""
+    cpus = topology['cpus'].values()
+    return {'packages': len({cpu['package'] for cpu in cpus}),
+            'nodes': len(topology['nodes']),
+            'cores': len({cpu['core'] for cpu in cpus}),
+            'threads_per_core': max([cpu['thread'] + 1 for cpu in cpus] or [1])}
+
+
+def order_cpus(topology, cpus, smt=None):
+    """Order CPUs so that consecutive CPUs share cores ('pack'), or not ('spread')
+
+    Args:
+        topology (dict): see `read_topology`
+        cpus (list[int]): CPUs to order
+        smt (str, optional): 'pack', 'spread' or None for CPU number order
+
+    Returns:
+        list[int]: ordered CPUs
+    """
+    info = topology['cpus']
+    if smt == 'pack':
+        return sorted(cpus, key=lambda cpu: (info[cpu]['core'], cpu))
+    if smt == 'spread':
+        return sorted(cpus, key=lambda cpu: (info[cpu]['thread'], info[cpu]['core'], cpu))
+    return sorted(cpus)
+
+
+def partition_cpus(cpus, slots):
+    """Split ordered CPUs into disjoint, equally sized consecutive cpusets
+
+    Args:
+        cpus (list[int]): CPUs, in the order they are given out
+        slots (int): number of cpusets to create
+
+    Returns:
+        list[list[int]]: cpusets; left-over CPUs are not assigned
+    """
+    cpus = list(cpus)
+    slots = min(slots, len(cpus))
+    if slots <= 0:
+        return []
+    size = len(cpus) // slots
+    return [cpus[i * size:(i + 1) * size] for i in range(slots)]
+
+
+def place(topology, slots, policy='none', smt=None, reserve=0, ncores=0):
+    """Split the CPUs of topology into slots according to a placement policy
+
+    Args:
+        topology (dict): see `read_topology`
+        slots (int): number of slots to create
+        policy (str, optional): one of POLICIES. Default: 'none'
+        smt (str, optional): one of SMT_MODES, None for CPU number order
+        reserve (int, optional): number of housekeeping cores. Default: 0
+        ncores (int, optional): CPUs per slot, 0 to use all. Default: 0
+
+    Returns:
+        dict: 'reserved' CPUs and 'slots', a list of {'cpus', 'mems'}, where
+        'mems' are the NUMA nodes to bind memory to (None not to bind it);
+        there are fewer slots than requested if CPUs are lacking
+    """
+    info = topology['cpus']
+    cores = sorted({cpu['core'] for cpu in info.values()})
+    reserved = sorted(cpu for cpu in info if info[cpu]['core'] in cores[:reserve])
+    available = [cpu for cpu in sorted(info) if cpu not in reserved]
+
+    layout = []
+    if policy == 'numa':
+        nodes = {}
+        for cpu in available:
+            nodes.setdefault(info[cpu]['node'], []).append(cpu)
+        nodes = sorted(nodes.items())
+        if slots >= len(nodes):
+            # several slots per node; when they do not divide evenly, the
+            # nodes with the most CPUs take one more slot
+            extra = sorted(nodes, key=lambda item: -len(item[1]))[:slots % len(nodes)]
+            for node, ncpus in nodes:
+                count = slots // len(nodes) + (1 if (node, ncpus) in extra else 0)
+                for cpuset in partition_cpus(order_cpus(topology, ncpus, smt), count):
+                    layout.append({'cpus': cpuset, 'mems': [node]})
+        else:
+            # several nodes per slot
+            groups = [nodes[i::slots] for i in range(slots)]
+            for group in groups:
+                layout.append({'cpus': [cpu for _, ncpus in group
+                                        for cpu in order_cpus(topology, ncpus, smt)],
+                               'mems': [node for node, _ in group]})
+    else:
+        layout = [{'cpus': cpuset, 'mems': None}
+                  for cpuset in partition_cpus(order_cpus(topology, available, smt), slots)]
+
+    if ncores > 0:
+        for slot in layout:
+            slot['cpus'] = slot['cpus'][:ncores]
+            if slot['mems'] is not None:
+                slot['mems'] = sorted({info[cpu]['node'] for cpu in slot['cpus']})
+
+    return {'reserved': reserved, 'slots': layout}
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+trace.py - Time spent by hepscore in each phase of a run
+
+Spans are timed on the high-resolution monotonic clock (perf_counter) and
+recorded, from any thread, with a phase among PHASES:
+
+    resolve          image reference of a workload
+    pull             pull, build or extraction of an image ahead of the run
+    prefetch         the same, in the background while other workloads run
+    pull_wait        wait for the prefetched image of a workload
+    container_start  from starting the container to its first output
+    workload         from the first output of the container to its exit
+    results          parsing and scoring of the workload results
+    cleanup          removal of images and caches
+    output           writing of the report
+
+Other phases (eg a whole workload) only appear in the timeline.  The
+phases are summed into an overhead breakdown for the report, where
+background phases do not count as overhead, and the spans
+can be written as Chrome trace events, to be opened in chrome://tracing or
+https://ui.perfetto.dev.
+
+Copyright 2019-2021 CERN. See the COPYRIGHT file at the top-level directory
+of this distribution. For licensing information, see the COPYING file at
+the top-level directory of this distribution.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+
+PHASES = ('resolve', 'pull', 'prefetch', 'pull_wait', 'container_start', 'workload',
+          'results', 'cleanup', 'output')
+BACKGROUND = ('prefetch',)  # phases overlapping the workloads
+TRACE_FILE = 'trace.json'  # default trace, in resultsdir
+
+
+class Tracer():
+    """Record timed spans of the phases of a run"""
+
+    def __init__(self):
+        self.origin = time.perf_counter_ns()
+        # relates span timestamps to wall-clock time
+        self.anchor = {'wall': time.time(), 'perf_counter_ns': self.origin}
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def now():
+        """Current time of the span clock, in nanoseconds"""
+        return time.perf_counter_ns()
+
+    def add(self, name, phase, start, end, **args):
+        """Record a span timed by the caller
+
+        Args:
+            name (str): span name, eg the workload
+            phase (str): one of PHASES, or another category for the timeline
+            start (int): start time, see `now`
+            end (int): end time, see `now`
+            args: details shown with the span in the timeline
+        """
+        thread = threading.current_thread()
+        with self._lock:
+            self.spans.append((name, phase, start, end - start, thread.ident, thread.name, args))
+
+    @contextlib.contextmanager
+    def span(self, name, phase, **args):
+        """Time the enclosed block as a span, see `add`
+
+        The details of the span may be updated inside the block.
+        """
+        start = time.perf_counter_ns()
+        try:
+            yield args
+        finally:
+            self.add(name, phase, start, time.perf_counter_ns(), **args)
+
+    def breakdown(self):
+        """Time spent in each phase
+
+        Spans of concurrent workloads overlap, so in packed mode the phases
+        may add up to more than the elapsed time.
+
+        Returns:
+            dict: 'phases', phase -> {'seconds', 'count', 'max_seconds'};
+            'elapsed_seconds' since the tracer was created, 'workload_seconds'
+            and 'overhead_seconds' (all other phases, but BACKGROUND ones) and
+            'overhead_fraction'
+        """
+        with self._lock:
+            spans = list(self.spans)
+        phases = {}
+        for _, phase, _, dur, _, _, _ in spans:
+            if phase not in PHASES:
+                continue
+            entry = phases.setdefault(phase, {'seconds': 0, 'count': 0, 'max_seconds': 0})
+            entry['seconds'] += dur
+            entry['count'] += 1
+            entry['max_seconds'] = max(entry['max_seconds'], dur)
+
+        workload = phases.get('workload', {}).get('seconds', 0)
+        overhead = sum(entry['seconds'] for phase, entry in phases.items()
+                       if phase != 'workload' and phase not in BACKGROUND)
+        for entry in phases.values():
+            entry['seconds'] = round(entry['seconds'] / 1e9, 6)
+            entry['max_seconds'] = round(entry['max_seconds'] / 1e9, 6)
+        return {'phases': {phase: phases[phase] for phase in PHASES if phase in phases},
+                'elapsed_seconds': round((time.perf_counter_ns() - self.origin) / 1e9, 6),
+                'workload_seconds': round(workload / 1e9, 6),
+                'overhead_seconds': round(overhead / 1e9, 6),
+                'overhead_fraction': round(overhead / (workload + overhead), 6)
+                                     if workload + overhead else 0.0}
+
+    def chrome_events(self):
+        """Spans as Chrome trace events
+
+        Returns:
+            list[dict]: complete ('X') events, timestamps in microseconds
+            since the tracer was created, and thread name metadata events
+        """
+        pid = os.getpid()
+        with self._lock:
+            spans = list(self.spans)
+        tids = {}
+        events = []
+        for name, phase, start, dur, ident, tname, args in sorted(spans, key=lambda sp: sp[2]):
+            if ident not in tids:
+                tids[ident] = len(tids) + 1
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': pid,
+                               'tid': tids[ident], 'args': {'name': tname}})
+            events.append({'name': name, 'cat': phase, 'ph': 'X', 'pid': pid,
+                           'tid': tids[ident], 'ts': (start - self.origin) / 1e3,
+                           'dur': dur / 1e3, 'args': args})
+        return events
+
+    def write_chrome(self, path):
+        """Write the spans to path in the Chrome trace event format
+
+        Raises:
+            OSError: if path cannot be written
+        """
+        trace = {'traceEvents': self.chrome_events(),
+                 'displayTimeUnit': 'ms',
+                 'otherData': {'anchor': self.anchor}}
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            with open(tmp, mode='w') as tfile:
+                json.dump(trace, tfile)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.unlink(tmp)